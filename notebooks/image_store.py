@@ -0,0 +1,204 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+# --- 配置 ---
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "image_store")
+IMG_SIZE = 224
+CHANNELS = 3
+APPEND_CHUNK = 256  # 每攒够这么多张图写一次盘
+BBOX_TOLERANCE_M = 0.01  # 与 TileCache 的 bbox 精度 (厘米) 一致
+INDEX_COLUMNS = ["src_id", "minx", "miny", "maxx", "maxy", "fetched_at", "label"]
+
+
+class ImageStore:
+    """
+    预处理好的屋顶图片库：
+    1. images.u8：N x H x W x 3 的 uint8 原始字节，只追加，用 np.memmap 读取。
+    2. index.csv：每行一张图 (src_id, 屋顶 bbox (不含 padding), fetched_at, label)，行号即图片在数组中的位置。
+    3. meta.json：行数和图片尺寸。
+    追加时先写图片字节，再原子替换 index/meta，所以读者看到的行数永远不超过已写完的图片。
+    多个进程用 memmap 打开同一文件时共享操作系统的页缓存，不会各自复制一份。
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR, img_size=IMG_SIZE):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._images_path = os.path.join(root, "images.u8")
+        self._index_path = os.path.join(root, "index.csv")
+        self._meta_path = os.path.join(root, "meta.json")
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            self.height, self.width = meta["height"], meta["width"]
+            self.index = pd.read_csv(self._index_path, dtype={"src_id": str}).head(meta["n"])
+        else:
+            self.height = self.width = img_size
+            self.index = pd.DataFrame({c: pd.Series(dtype=float if c in ("minx", "miny", "maxx", "maxy", "label") else str)
+                                       for c in INDEX_COLUMNS})
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def shape(self):
+        return (len(self), self.height, self.width, CHANNELS)
+
+    def images(self, mode="c"):
+        """
+        全部图片的 memmap，形状 (N, H, W, 3)。默认 copy-on-write 模式：
+        切片是零拷贝视图，可以直接交给 torch.from_numpy (不会有只读警告)，但写入不会落盘。
+        """
+        if len(self) == 0:
+            return np.zeros(self.shape, dtype=np.uint8)
+        return np.memmap(self._images_path, dtype=np.uint8, mode=mode, shape=self.shape)
+
+    def rows(self, src_ids):
+        """src_id 对应的行号 (不在库中的为 -1)。同一 src_id 有多行时取最新的一行。"""
+        latest = pd.Series(np.arange(len(self)), index=self.index["src_id"].astype(str))
+        latest = latest[~latest.index.duplicated(keep="last")]
+        return latest.reindex(pd.Index(np.asarray(src_ids).astype(str))).fillna(-1).astype(int).to_numpy()
+
+    def add(self, src_ids, images, bboxes, labels=None, fetched_at=None):
+        """追加一批图片 (n, H, W, 3) uint8 及其索引信息；返回新行号。"""
+        images = np.ascontiguousarray(images, dtype=np.uint8)
+        if images.shape[1:] != (self.height, self.width, CHANNELS):
+            raise ValueError(f"expected images of shape (n, {self.height}, {self.width}, {CHANNELS}), got {images.shape}")
+        n = len(images)
+        bboxes = np.asarray(bboxes, dtype=float).reshape(n, 4)
+        start = len(self)
+        # 截断到已提交的长度：上次追加若中途失败，多出来的字节在这里丢弃
+        with open(self._images_path, "ab") as f:
+            f.truncate(start * self.height * self.width * CHANNELS)
+            f.write(images.tobytes())
+        new = pd.DataFrame({
+            "src_id": np.asarray(src_ids).astype(str),
+            "minx": bboxes[:, 0], "miny": bboxes[:, 1], "maxx": bboxes[:, 2], "maxy": bboxes[:, 3],
+            "fetched_at": fetched_at or datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            "label": np.nan if labels is None else np.asarray(labels, dtype=float),
+        })
+        self.index = pd.concat([self.index, new], ignore_index=True) if start else new
+        self._flush()
+        return np.arange(start, start + n)
+
+    def _flush(self):
+        tmp = f"{self._index_path}.tmp"
+        self.index.to_csv(tmp, index=False)
+        os.replace(tmp, self._index_path)
+        tmp = f"{self._meta_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"n": len(self), "height": self.height, "width": self.width,
+                       "channels": CHANNELS, "dtype": "uint8"}, f)
+        os.replace(tmp, self._meta_path)
+
+
+def build_image_store(gdf, store=None, labels=None, id_col="src_id", refresh=False, prefetch_depth=64,
+                      workers=8, chunk=APPEND_CHUNK, **dataset_kwargs):
+    """
+    把 gdf 中每个屋顶的图片下载、裁剪、缩放一次，写入 ImageStore。
+    增量：库中已有 src_id 且 bbox 未变的屋顶跳过；几何变了 (新的 VersieId) 的屋顶重新取图并追加新行，
+    之后按 src_id 读取时用最新的一行。refresh=True 则全部重新取图。
+    不传 labels 时，重新取图的屋顶沿用上一行的 label。
+    取图经过 RooftopDataset (图块缓存、可选 mosaic=True) 和 WMSPrefetcher 线程池；
+    失败的屋顶不写入，返回的统计里列出。dataset_kwargs 传给 RooftopDataset (如 tile_cache、wms_url)。
+    """
+    from rooftop_dataset import RooftopDataset
+    from wms_prefetch import WMSPrefetcher
+
+    store = store if store is not None else ImageStore()
+    ids = gdf[id_col].astype(str).to_numpy()
+    rows = store.rows(ids)
+    changed = np.zeros(len(gdf), dtype=bool)
+    if len(store):
+        stored = store.index[["minx", "miny", "maxx", "maxy"]].to_numpy(float)[np.maximum(rows, 0)]
+        changed = (rows >= 0) & ~(np.abs(stored - gdf.geometry.bounds.to_numpy()) <= BBOX_TOLERANCE_M).all(axis=1)
+    todo = np.arange(len(gdf)) if refresh else np.flatnonzero((rows < 0) | changed)
+    size = (store.width, store.height)
+    subset = gdf.iloc[todo]
+
+    def to_uint8(img):
+        # 只缩放成 uint8，不做 ToTensor/Normalize：归一化留到训练时按 batch 做。
+        # 用 BILINEAR 与 RooftopDataset 默认的 transforms.Resize 一致 (PIL 默认是 BICUBIC)
+        return np.asarray(img.resize(size, Image.BILINEAR), dtype=np.uint8)
+
+    dataset = RooftopDataset(subset, transform=to_uint8, img_size=store.width, **dataset_kwargs)
+    order = dataset.mosaic.order() if dataset.mosaic is not None else None
+    prefetcher = WMSPrefetcher(dataset, depth=prefetch_depth, workers=workers)
+    bboxes = subset.geometry.bounds.to_numpy()
+    if labels is not None:
+        labels = np.asarray(labels, dtype=float)[todo]
+    elif len(store):
+        # 没给 labels 时，重新取图的屋顶沿用库中上一行的 label，而不是变成 NaN
+        prev = rows[todo]
+        labels = np.where(prev >= 0, store.index["label"].to_numpy(float)[np.maximum(prev, 0)], np.nan)
+    pending, failed = [], []
+    start = time.perf_counter()
+
+    def flush():
+        if pending:
+            rows, images = zip(*pending)
+            rows = np.array(rows)
+            store.add(ids[todo[rows]], np.stack(images), bboxes[rows], None if labels is None else labels[rows])
+            pending.clear()
+
+    for i, image, _, error in prefetcher.iterate(order):
+        if error:
+            failed.append((ids[todo[i]], error))
+            continue
+        pending.append((i, image))
+        if len(pending) >= chunk:
+            flush()
+    flush()
+    return {"roofs": len(gdf), "skipped": len(gdf) - len(todo), "changed": int(changed.sum()),
+            "added": len(todo) - len(failed),
+            "failed": failed, "seconds": time.perf_counter() - start, "store_rows": len(store),
+            "prefetch": prefetcher.metrics()}
+
+
+# --- 基准测试：每次解码 PNG (现在的做法) vs 从 memmap 读切片 ---
+if __name__ == "__main__":
+    import io
+    import tempfile
+
+    N = 1000
+    rng = np.random.default_rng(0)
+    pngs = []
+    for _ in range(N):
+        buf = io.BytesIO()
+        Image.fromarray(rng.integers(0, 255, (256, 256, 3), dtype=np.uint8)).save(buf, format="PNG")
+        pngs.append(buf.getvalue())
+
+    start = time.perf_counter()
+    for data in pngs:
+        img = Image.open(io.BytesIO(data)).convert("RGB").resize((IMG_SIZE, IMG_SIZE), Image.BILINEAR)
+        x = np.asarray(img, dtype=np.float32) / 255.0
+    decode_s = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ImageStore(tmp)
+        for first in range(0, N, 500):  # 增量追加
+            crops = np.stack([np.asarray(Image.open(io.BytesIO(d)).convert("RGB").resize((IMG_SIZE, IMG_SIZE), Image.BILINEAR))
+                              for d in pngs[first:first + 500]])
+            store.add([f"Gebouw.{i}" for i in range(first, first + len(crops))], crops,
+                      np.zeros((len(crops), 4)))
+        reopened = ImageStore(tmp)
+        mm = reopened.images()
+        mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+        std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+        start = time.perf_counter()
+        for first in range(0, N, 32):
+            batch = mm[first:first + 32]  # 零拷贝切片
+            x = batch.astype(np.float32)  # 每个 batch 一次归一化
+            x *= 1 / 255.0
+            x -= mean
+            x /= std
+        mmap_s = time.perf_counter() - start
+        print(f"{N} 张图: 每次解码 PNG {decode_s:.2f}s ({N / decode_s:.0f} 张/秒), "
+              f"memmap 按 batch 读取+归一化 {mmap_s:.2f}s ({N / mmap_s:.0f} 张/秒)")
+        print(f"库: {reopened.shape}, {os.path.getsize(os.path.join(tmp, 'images.u8')) / 1e6:.0f} MB, "
+              f"行号示例 {reopened.rows(['Gebouw.5', f'Gebouw.{N - 1}', 'missing'])}")
@@ -1,5 +1,9 @@
+import argparse
+import time
+
 import torch
 import geopandas as gpd
+from torch.utils.data import DataLoader, Dataset
 from tqdm import tqdm
 import os
 import sys
@@ -13,12 +17,87 @@ if current_dir not in sys.path:
 try:
     from rooftop_dataset import RooftopDataset
     from train_classifier import get_model
+    from wms_prefetch import WMSPrefetcher
 except ImportError as e:
-    print(f"❌ 导入错误: {e}")
-    print("请确保 rooftop_dataset.py 和 train_classifier.py 在 notebooks 目录下")
-    sys.exit(1)
+    # 不要 sys.exit：src/pipeline.py 会导入本模块，缺依赖时应抛出可捕获的错误
+    raise ImportError(f"{e} (请确保 rooftop_dataset.py 和 train_classifier.py 在 notebooks 目录下，"
+                      f"并已安装 torch/torchvision)") from e
+
+# --- 推理配置 ---
+BATCH_SIZE = 32
+NUM_WORKERS = 4  # 并行下载/解码图片的 DataLoader 进程数；Mac/Windows 上不稳定时设为 0
+LABEL_MAP = {0: 'Flat', 1: 'Pitched'} # 确保跟训练时一致！
+
+
+class InferenceItems(Dataset):
+    """
+    包装 RooftopDataset 用于批量推理：
+    每一项返回 (图像 Tensor, 索引, 错误信息)。单张图下载/解码失败时返回全零图像并记录错误，
+    而不是抛异常让整个 batch 失败。
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        ds = self.dataset
+        try:
+            image = ds.fetch_satellite_image(ds.gdf.geometry.iloc[idx])
+            return ds.transform(image), idx, ""
+        except Exception as e:
+            return torch.zeros(3, ds.img_size, ds.img_size), idx, f"{type(e).__name__}: {e}"
+
+
+def run_inference(model, dataset, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, device=None, progress=True,
+                  prefetch_depth=0):
+    """
+    批量推理：图片由 DataLoader 的 worker 进程并行下载和解码；prefetch_depth > 0 时改用
+    WMSPrefetcher 线程池 (num_workers 个线程) 提前准备 prefetch_depth 张图。
+    主进程每个 batch 做一次 torch.inference_mode() 前向传播。
+    返回 (predictions, confidence, errors, stats)；失败的项预测为 0、置信度 0.0，
+    errors 中是错误信息 (成功为空字符串)，stats 包含 images_per_second
+    (预取时还有 prefetch_* 队列深度 / 等待时间指标)。
+    """
+    device = device or next(model.parameters()).device
+    # 拼图模式下按拼图顺序取图，同一拼图的屋顶连续处理 (结果按索引写回，顺序不影响输出)
+    mosaic = getattr(dataset, "mosaic", None)
+    order = mosaic.order() if mosaic is not None else None
+    if prefetch_depth:
+        prefetcher = WMSPrefetcher(dataset, depth=prefetch_depth, workers=max(num_workers, 1))
+        batches = ((images, idx, errs) for images, idx, _, errs in prefetcher.batches(batch_size, order=order))
+        n_batches = -(-len(dataset) // batch_size)
+    else:
+        loader = DataLoader(InferenceItems(dataset), batch_size=batch_size, shuffle=False, sampler=order,
+                            num_workers=num_workers, persistent_workers=False)
+        batches = ((images, idx.numpy(), errs) for images, idx, errs in loader)
+        n_batches = len(loader)
+    n = len(dataset)
+    predictions = np.zeros(n, dtype=np.int64)
+    confidence = np.zeros(n, dtype=np.float32)
+    errors = [""] * n
+    model.eval()
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for images, idx, errs in tqdm(batches, total=n_batches, disable=not progress):
+            probs = torch.nn.functional.softmax(model(images.to(device)), dim=1)
+            conf, pred = torch.max(probs, 1)
+            ok = np.array([not e for e in errs])
+            predictions[idx[ok]] = pred.cpu().numpy()[ok]
+            confidence[idx[ok]] = conf.cpu().numpy()[ok]
+            for i, e in zip(idx, errs):
+                errors[i] = e
+    seconds = time.perf_counter() - start
+    stats = {"images": n, "failed": sum(1 for e in errors if e), "seconds": seconds,
+             "images_per_second": n / seconds if seconds else float("nan"),
+             "batch_size": batch_size, "num_workers": num_workers}
+    if prefetch_depth:
+        stats.update({f"prefetch_{k}": v for k, v in prefetcher.metrics().items()})
+    return predictions, confidence, errors, stats
+
 
-def predict():
+def predict(batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, prefetch_depth=0, mosaic=False):
     # --- 1. 配置路径 ---
     # 假设你在项目根目录运行 (Leuven2030_Rooftops/)
     # 或者在 notebooks 目录运行，这里尝试自动适配
@@ -53,7 +132,7 @@ def predict():
 
     # --- 3. 加载模型 ---
     print(f"🧠 加载模型: {model_path} ...")
-    model = get_model(num_classes=2)
+    model = get_model(num_classes=2, pretrained=False) # 权重马上被覆盖，无需下载 ImageNet 权重
     model.load_state_dict(torch.load(model_path, map_location=device))
     model.to(device)
     model.eval() # 开启评估模式
@@ -64,46 +143,83 @@ def predict():
     print(f"   待处理屋顶数: {len(gdf)}")
 
     # 准备数据集 (自动下载图片)
-    dataset = RooftopDataset(gdf)
+    dataset = RooftopDataset(gdf, mosaic=mosaic)
+    if mosaic:
+        report = dataset.mosaic.report()
+        print(f"   🧩 拼图: {report['baseline_requests']} -> {report['requests']} 次请求, "
+              f"{report['baseline_mb']:.0f} -> {report['planned_mb']:.0f} MB")
     
-    # --- 5. 开始推理 ---
-    print("🔮 开始 AI 预测...")
-    predictions = []
-    probabilities = []
-    
-    with torch.no_grad(): # 不计算梯度，省内存
-        for i in tqdm(range(len(dataset))):
-            try:
-                img, _ = dataset[i] if dataset.labels is not None else (dataset[i], None)
-                # dataset[i] 返回 (img) 或者 (img, label)，这里做个兼容处理
-                if isinstance(img, tuple): img = img[0]
-                
-                # 增加 batch 维度
-                img_input = img.unsqueeze(0).to(device)
-                
-                # 预测
-                outputs = model(img_input)
-                probs = torch.nn.functional.softmax(outputs, dim=1)
-                conf, pred = torch.max(probs, 1)
-                
-                predictions.append(pred.item())
-                probabilities.append(conf.item())
-            except Exception as e:
-                print(f"   ⚠️ 跳过索引 {i}: {e}")
-                predictions.append(0)
-                probabilities.append(0.0)
+    # --- 5. 开始推理 (批量 + 多进程取图) ---
+    print(f"🔮 开始 AI 预测 (batch={batch_size}, workers={num_workers}, prefetch={prefetch_depth})...")
+    predictions, probabilities, errors, stats = run_inference(model, dataset, batch_size, num_workers, device,
+                                                              prefetch_depth=prefetch_depth)
+    print(f"   ⏱️ {stats['images_per_second']:.1f} 张/秒, 失败 {stats['failed']} 张")
+    if prefetch_depth:
+        print(f"   📶 预取: 等待 {stats['prefetch_stall_seconds']:.1f}s, 平均就绪 "
+              f"{stats['prefetch_mean_ready']:.1f}/{prefetch_depth} -> {stats['prefetch_bound']}-bound")
+    for i, e in enumerate(errors):
+        if e:
+            print(f"   ⚠️ 索引 {i}: {e}")
 
     # --- 6. 保存结果 ---
     print("💾 保存结果...")
-    label_map = {0: 'Flat', 1: 'Pitched'} # 确保跟训练时一致！
-    
     gdf['roof_type_id'] = predictions
-    gdf['roof_type'] = [label_map[p] for p in predictions]
+    gdf['roof_type'] = [LABEL_MAP[p] for p in predictions]
     gdf['ai_confidence'] = probabilities
+    gdf['ai_error'] = errors
     
     gdf.to_file(output_file, driver="GPKG")
     print(f"✅ 完成！已生成增强数据: {output_file}")
     print("👉 现在去刷新你的 Streamlit 网页吧！")
 
+
+def benchmark(n_roofs=128, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, latency_s=0.15):
+    """
+    CPU 基准测试：在本地模拟 WMS 上比较逐张推理 (旧做法)、批量推理和线程预取的 张/秒。
+    每种做法使用一个空的临时图块缓存，所以都包含下载时间；模型使用随机权重。
+    """
+    import tempfile
+    from shapely.geometry import box
+    from tile_cache import TileCache
+    from wms_prefetch import PREFETCH_DEPTH, PREFETCH_WORKERS
+    from wms_stub import WMSStubServer
+
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(170000, 178000, n_roofs), rng.uniform(170000, 178000, n_roofs)
+    gdf = gpd.GeoDataFrame(geometry=[box(a, b, a + 40, b + 30) for a, b in zip(x, y)], crs=31370)
+    model = get_model(num_classes=2, pretrained=False).eval()
+    results = {}
+    with WMSStubServer(latency_s) as wms, tempfile.TemporaryDirectory() as tmp:
+        dataset = RooftopDataset(gdf, tile_cache=TileCache(os.path.join(tmp, "serial")), wms_url=wms.url)
+        start = time.perf_counter()
+        with torch.no_grad():
+            for i in range(len(dataset)):
+                torch.max(torch.nn.functional.softmax(model(dataset[i].unsqueeze(0)), dim=1), 1)
+        results["serial_images_per_second"] = n_roofs / (time.perf_counter() - start)
+
+        dataset = RooftopDataset(gdf, tile_cache=TileCache(os.path.join(tmp, "batched")), wms_url=wms.url)
+        _, _, _, stats = run_inference(model, dataset, batch_size, num_workers, progress=False)
+        results["batched_images_per_second"] = stats["images_per_second"]
+
+        dataset = RooftopDataset(gdf, tile_cache=TileCache(os.path.join(tmp, "prefetch")), wms_url=wms.url)
+        _, _, _, stats = run_inference(model, dataset, batch_size, PREFETCH_WORKERS, progress=False,
+                                       prefetch_depth=PREFETCH_DEPTH)
+        results["prefetch_images_per_second"] = stats["images_per_second"]
+        results["prefetch_bound"] = stats["prefetch_bound"]
+    results.update({"images": n_roofs, "batch_size": batch_size, "num_workers": num_workers,
+                    "latency_s": latency_s, "threads": torch.get_num_threads()})
+    return results
+
+
 if __name__ == "__main__":
-    predict()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="屋顶类型批量预测")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--prefetch", type=int, default=0, help="线程预取队列长度 (0 = 使用 DataLoader worker)")
+    parser.add_argument("--mosaic", action="store_true", help="相邻屋顶合并为一次 GetMap 再本地裁剪")
+    parser.add_argument("--benchmark", action="store_true", help="在本地模拟 WMS 上做 CPU 基准测试")
+    args = parser.parse_args()
+    if args.benchmark:
+        print(benchmark(batch_size=args.batch_size, num_workers=args.workers))
+    else:
+        predict(args.batch_size, args.workers, args.prefetch, args.mosaic)
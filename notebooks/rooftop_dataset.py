@@ -1,5 +1,5 @@
 import io
-import requests
+import os
 import numpy as np
 import torch
 from torch.utils.data import Dataset
@@ -8,40 +8,56 @@ from torchvision import transforms
 import geopandas as gpd
 from shapely.geometry import box
 
+from image_store import ImageStore
+from tile_cache import TileCache, TileCacheMiss
+
 # --- 配置 (已修复 URL) ---
 # 旧域名: geoservices.informatievlaanderen.be (已失效)
 # 新域名: geo.api.vlaanderen.be
 # 服务: OMWRGBMRVL (Orthofotomozaïek, Winter, RGB, Vlaanderen)
 WMS_URL = "https://geo.api.vlaanderen.be/OMWRGBMRVL/wms"
 LAYER_NAME = "Ortho" # "Ortho" 通常是指向最新拼接图的图层别名
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
 
 class RooftopDataset(Dataset):
     """
     自定义 PyTorch 数据集：
     1. 接收一个包含屋顶几何形状的 GeoDataFrame。
     2. (可选) 接收 labels (0=Flat, 1=Pitched)。如果是预测模式，可以没有 label。
-    3. 实时从 WMS 服务抓取该屋顶的卫星图像。
+    3. 实时从 WMS 服务抓取该屋顶的卫星图像 (经过本地图块缓存，每张图只下载一次)。
     """
-    def __init__(self, gdf, labels=None, transform=None, img_size=224):
+    def __init__(self, gdf, labels=None, transform=None, img_size=224, tile_cache=None, wms_url=WMS_URL,
+                 mosaic=False):
         """
         args:
             gdf (GeoDataFrame): 包含 'geometry' 列 (必须是 EPSG:31370 投影)
             labels (list/array): 对应的标签 (可选)
             transform: PyTorch 图像增强
             img_size: 神经网络输入大小 (ResNet 默认为 224)
+            tile_cache (TileCache): 图块缓存 (可选)，默认使用 notebooks/cache/tiles；
+                                    传入 TileCache(offline=True) 可完全离线运行
+            wms_url: WMS 服务地址 (默认 OMWRGBMRVL，测试时可指向本地模拟服务)
+            mosaic (bool): True 时把相邻屋顶合并成一张大图请求，再在本地裁剪 (见 wms_mosaic.py)
         """
         self.gdf = gdf
         self.labels = labels
         self.transform = transform
         self.img_size = img_size
+        self.tile_cache = tile_cache if tile_cache is not None else TileCache()
+        self.wms_url = wms_url
+        self.mosaic = None
+        if mosaic:
+            from wms_mosaic import MosaicFetcher
+            self.mosaic = MosaicFetcher(gdf, self.tile_cache, wms_url=wms_url, layer=LAYER_NAME, img_size=img_size)
 
         # 默认的转换：转 Tensor 并 归一化
         if self.transform is None:
             self.transform = transforms.Compose([
                 transforms.Resize((img_size, img_size)),
                 transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], # ImageNet 标准
-                                     std=[0.229, 0.224, 0.225])
+                transforms.Normalize(mean=IMAGENET_MEAN, # ImageNet 标准
+                                     std=IMAGENET_STD)
             ])
 
     def __len__(self):
@@ -54,6 +70,9 @@ class RooftopDataset(Dataset):
         # 2. 获取图像 (这是最关键的一步)
         try:
             image = self.fetch_satellite_image(polygon)
+        except TileCacheMiss:
+            # 离线模式下缺图应立即报错，而不是悄悄用黑图训练/预测
+            raise
         except Exception as e:
             print(f"Error fetching image for index {idx}: {e}")
             # 如果失败，返回一个全黑图像防止崩溃
@@ -70,9 +89,10 @@ class RooftopDataset(Dataset):
         else:
             return image
 
-    def fetch_satellite_image(self, polygon):
+    def fetch_satellite_image(self, polygon, session=None):
         """
         根据多边形边界框从 WMS 获取图片。
+        session: 可选的 requests.Session (预取线程共用，复用 HTTP 连接)。
         """
         minx, miny, maxx, maxy = polygon.bounds
         
@@ -80,6 +100,10 @@ class RooftopDataset(Dataset):
         padding = 2.0 # 米
         bbox = (minx - padding, miny - padding, maxx + padding, maxy + padding)
         
+        # 拼图模式：从所在拼图中裁剪 (与其它屋顶共用一次请求)
+        if self.mosaic is not None:
+            return self.mosaic.fetch(bbox, session=session)
+
         # 构建 WMS 请求参数
         width = self.img_size
         height = self.img_size
@@ -97,14 +121,80 @@ class RooftopDataset(Dataset):
             "STYLES": ""
         }
         
-        # 发送请求
-        response = requests.get(WMS_URL, params=params, timeout=10)
-        response.raise_for_status()
+        # 发送请求 (先查本地缓存，未命中才访问 WMS)
+        content = self.tile_cache.fetch(self.wms_url, params, session=session)
         
         # 将字节流转换为 PIL Image
-        img = Image.open(io.BytesIO(response.content))
+        img = Image.open(io.BytesIO(content))
         return img.convert("RGB")
 
+
+def normalize_batch(images, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+    """
+    uint8 图片 batch (N, H, W, 3) -> 归一化的 float (N, 3, H, W)，与默认 transform 的结果相同。
+    整个 batch 一次张量运算 (建议先 .to(device) 再调用，在 GPU 上做)。
+    """
+    mean = torch.tensor(mean, device=images.device).view(1, -1, 1, 1)
+    std = torch.tensor(std, device=images.device).view(1, -1, 1, 1)
+    return images.permute(0, 3, 1, 2).float().div_(255).sub_(mean).div_(std)
+
+
+class StoredRooftopDataset(Dataset):
+    """
+    从 ImageStore (image_store.py 预先生成的 uint8 memmap) 读取屋顶图片的数据集：
+    1. __getitem__ 返回 (H, W, 3) uint8 Tensor，是 memmap 的零拷贝视图，不解码 PNG、不 resize。
+    2. 归一化不在这里做：训练/预测循环里对整个 batch 调用 normalize_batch。
+    3. memmap 在每个进程里第一次取图时才打开：DataLoader 的 worker 共享同一份页缓存，不复制数据。
+    """
+    def __init__(self, store, src_ids=None, labels=None):
+        """
+        args:
+            store (ImageStore 或目录)
+            src_ids: 要用的屋顶 (默认库中全部)；同一 src_id 有多行时取最新的一行
+            labels: 对应的标签 (可选)；labels="store" 表示使用库中 index 的 label 列
+        """
+        self.store = store if isinstance(store, ImageStore) else ImageStore(store)
+        if src_ids is None:
+            self.rows = np.arange(len(self.store))
+        else:
+            self.rows = self.store.rows(src_ids)
+            if (self.rows < 0).any():
+                missing = np.asarray(src_ids)[self.rows < 0]
+                raise KeyError(f"{len(missing)} roofs not in image store {self.store.root}, e.g. {list(missing[:5])}; "
+                               f"run image_store.build_image_store first")
+        if isinstance(labels, str) and labels == "store":
+            labels = self.store.index["label"].to_numpy(float)[self.rows]
+            if np.isnan(labels).any():
+                missing = self.store.index["src_id"].to_numpy()[self.rows][np.isnan(labels)]
+                raise ValueError(f"{len(missing)} roofs have no label in image store {self.store.root}, "
+                                 f"e.g. {list(missing[:5])}; pass labels to build_image_store")
+            labels = labels.astype(int)
+        self.labels = labels
+        self.img_size = self.store.width
+        self._images = None
+        self._pid = None
+
+    # pickle 给 worker 时不带 memmap，worker 里重新打开
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"], state["_pid"] = None, None
+        return state
+
+    @property
+    def images(self):
+        if self._images is None or self._pid != os.getpid():
+            self._images, self._pid = self.store.images(), os.getpid()
+        return self._images
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        image = torch.from_numpy(self.images[self.rows[idx]])
+        if self.labels is not None:
+            return image, torch.tensor(self.labels[idx], dtype=torch.long)
+        return image
+
 # --- 调试/测试代码 ---
 if __name__ == "__main__":
     # 模拟：加载你在 osm_experiments 生成的数据
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+# --- 配置 ---
+# 缓存放在 notebooks/cache/tiles 下：图片按内容键 (sha1) 分目录存放，索引在 index.sqlite
+DEFAULT_TILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "tiles")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB 上限，超出后按 LRU 淘汰
+EVICT_TO = 0.9  # 淘汰到上限的 90%，避免每次写入都触发淘汰
+BBOX_DECIMALS = 2  # bbox 精确到厘米，浮点误差不会产生不同的键
+FETCH_TIMEOUT_S = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+"""
+
+
+class TileCacheMiss(Exception):
+    """离线模式下缓存中没有该图块。"""
+
+
+def tile_key(url, params):
+    """
+    图块的内容键：服务地址 + 图层、bbox、尺寸、CRS、服务版本、格式、样式。
+    参数名不区分大小写，bbox 四舍五入到 BBOX_DECIMALS 位。
+    """
+    p = {k.upper(): v for k, v in params.items()}
+    bbox = p.get("BBOX", "")
+    if isinstance(bbox, str):
+        bbox = bbox.split(",")
+    ident = {
+        "url": url,
+        "layer": p.get("LAYERS"),
+        "bbox": [round(float(v), BBOX_DECIMALS) for v in bbox],
+        "size": [int(p.get("WIDTH", 0)), int(p.get("HEIGHT", 0))],
+        "crs": p.get("CRS", p.get("SRS")),
+        "version": p.get("VERSION"),
+        "format": p.get("FORMAT"),
+        "styles": p.get("STYLES", ""),
+    }
+    return hashlib.sha1(json.dumps(ident, sort_keys=True).encode()).hexdigest()
+
+
+class TileCache:
+    """
+    WMS 图块的本地持久缓存：
+    1. 以 tile_key 为键，原始图片字节存成文件 (先写临时文件再 os.replace，原子写入)。
+    2. SQLite 索引记录大小与最近访问时间，总大小超过 max_bytes 时按 LRU 淘汰。
+    3. offline=True 时未命中直接抛出 TileCacheMiss，不访问网络。
+    DataLoader 的多个 worker 进程可以共用同一个缓存目录：每个进程各自打开数据库连接。
+    """
+
+    def __init__(self, root=DEFAULT_TILE_DIR, max_bytes=DEFAULT_MAX_BYTES, offline=False,
+                 timeout=FETCH_TIMEOUT_S):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    # fork 出来的 worker 不能复用父进程的连接；pickle (spawn) 时也不带连接
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"], state["_conn"], state["_pid"] = None, None, None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(os.path.join(self.root, "index.sqlite"), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.img")
+
+    def get(self, key):
+        """缓存中的图片字节；没有则返回 None。"""
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.conn.execute("UPDATE tiles SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        now = time.time()
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", (key, len(data), now, now))
+        if self.total_bytes() > self.max_bytes:
+            self.evict()
+
+    def total_bytes(self):
+        with self._lock:
+            return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()[0]
+
+    def evict(self, target_bytes=None):
+        """按最近访问时间从旧到新删除图块，直到总大小不超过 target_bytes。返回删除的数量。"""
+        target = self.max_bytes * EVICT_TO if target_bytes is None else target_bytes
+        removed = 0
+        with self._lock:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()[0]
+            rows = self.conn.execute("SELECT key, size FROM tiles ORDER BY accessed_at").fetchall()
+            for key, size in rows:
+                if total <= target:
+                    break
+                try:
+                    os.remove(self.path(key))
+                except FileNotFoundError:
+                    pass
+                self.conn.execute("DELETE FROM tiles WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+        return removed
+
+    def fetch(self, url, params, session=None):
+        """
+        带缓存的 GetMap：命中直接返回字节；未命中时联网下载并写入缓存 (离线模式则抛出 TileCacheMiss)。
+        session: 可选的 requests.Session，多线程共用以复用连接。
+        """
+        key = tile_key(url, params)
+        data = self.get(key)
+        with self._lock:
+            if data is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if data is not None:
+            return data
+        if self.offline:
+            raise TileCacheMiss(f"tile {key} not cached (offline mode)")
+        response = (session or requests).get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        if not response.headers.get("Content-Type", "image").startswith("image"):
+            # WMS 出错时常返回 200 + XML 异常报告，不能写进缓存
+            raise ValueError(f"WMS returned {response.headers.get('Content-Type')}: {response.text[:200]}")
+        self.put(key, response.content)
+        return response.content
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+
+# --- 基准测试：本地模拟 WMS (带网络延迟) 上比较 "每次下载" 和 "热缓存" 的一个 epoch ---
+if __name__ == "__main__":
+    import io
+    import tempfile
+
+    import numpy as np
+    from PIL import Image
+
+    from wms_stub import WMSStubServer
+
+    N_ROOFS = 200
+    xs = np.random.default_rng(0).uniform(170000, 178000, N_ROOFS)
+    requests_params = [{"SERVICE": "WMS", "VERSION": "1.3.0", "REQUEST": "GetMap", "LAYERS": "Ortho",
+                        "CRS": "EPSG:31370", "BBOX": f"{x},{x},{x + 40},{x + 40}", "WIDTH": 224,
+                        "HEIGHT": 224, "FORMAT": "image/png", "STYLES": ""} for x in xs]
+
+    def epoch(get):
+        start = time.perf_counter()
+        for params in requests_params:
+            Image.open(io.BytesIO(get(params))).convert("RGB")
+        return time.perf_counter() - start
+
+    with WMSStubServer() as wms, tempfile.TemporaryDirectory() as tmp:
+        def direct(params):
+            # 现在 RooftopDataset.fetch_satellite_image 的做法
+            r = requests.get(wms.url, params=params, timeout=FETCH_TIMEOUT_S)
+            r.raise_for_status()
+            return r.content
+
+        cache = TileCache(tmp)
+        print(f"不使用缓存: {epoch(direct):.2f}s / epoch ({N_ROOFS} 张, 延迟 {wms.latency_s}s)")
+        print(f"冷缓存:     {epoch(lambda p: cache.fetch(wms.url, p)):.2f}s")
+        print(f"热缓存:     {epoch(lambda p: cache.fetch(wms.url, p)):.2f}s (命中 {cache.hits}, 未命中 {cache.misses})")
+        offline = TileCache(tmp, offline=True)
+        print(f"离线热缓存: {epoch(lambda p: offline.fetch(wms.url, p)):.2f}s")
+        try:
+            offline.fetch(wms.url, dict(requests_params[0], BBOX="0,0,1,1"))
+        except TileCacheMiss as e:
+            print("离线未命中:", e)
+        size = os.path.getsize(cache.path(tile_key(wms.url, requests_params[0])))
+        small = TileCache(tmp, max_bytes=size * 50)
+        print(f"上限 50 张: 淘汰 {small.evict()} 张, 剩余 {len(small)}")
@@ -9,18 +9,21 @@ import pandas as pd
 # 引入我们刚才定义的 Dataset 类
 # 注意：如果在同一个 notebook 运行，可以直接用；如果在不同文件，需要 import
 try:
-    from rooftop_dataset import RooftopDataset
+    from image_store import ImageStore, build_image_store
+    from rooftop_dataset import RooftopDataset, StoredRooftopDataset, normalize_batch
+    from wms_prefetch import WMSPrefetcher
 except ImportError:
     # Fallback for demonstration if running in a single context
     pass 
 
-def get_model(num_classes=2):
+def get_model(num_classes=2, pretrained=True):
     """
     加载预训练的 ResNet-18 并修改最后一层。
     Classes: 0 = Flat (平顶), 1 = Pitched (斜顶)
+    pretrained=False 时不下载 ImageNet 权重 (之后会 load_state_dict 或只做基准测试时使用)
     """
     # 1. 加载预训练模型 (ImageNet 权重)
-    model = models.resnet18(weights=models.ResNet18_Weights.DEFAULT)
+    model = models.resnet18(weights=models.ResNet18_Weights.DEFAULT if pretrained else None)
     
     # 2. 冻结前面的层 (可选，如果数据量少建议冻结)
     # for param in model.parameters():
@@ -33,7 +36,13 @@ def get_model(num_classes=2):
     
     return model
 
-def train_loop():
+def train_loop(prefetch_depth=0, image_store=None):
+    """
+    prefetch_depth > 0 (如 wms_prefetch.PREFETCH_DEPTH) 时训练集图片由 WMSPrefetcher 线程池提前下载/解码
+    (每个 epoch 重新打乱)，取图失败的样本直接跳过；默认 0 使用原来的 DataLoader。
+    image_store: ImageStore 目录 (见 image_store.py)。给出时先把缺少的屋顶图片增量写入库中，
+    然后从 memmap 读 uint8 图片，每个 batch 在 device 上归一化一次 (不再使用预取)。
+    """
     print("1. Loading Data...")
     gdf = gpd.read_file("notebooks/data/large_roofs_test.gpkg") # 确保路径对
 
@@ -54,7 +63,16 @@ def train_loop():
     real_labels = labeled_gdf['ground_truth'].astype(int).values
     
     # 使用 labeled_gdf 而不是完整的 gdf 来创建 Dataset
-    full_dataset = RooftopDataset(labeled_gdf, labels=real_labels)
+    if image_store:
+        store = ImageStore(image_store)
+        report = build_image_store(labeled_gdf, store, labels=real_labels)
+        print(f"图片库: 新增 {report['added']}, 已有 {report['skipped']}, 失败 {len(report['failed'])}")
+        # 取图失败的屋顶不在库中，不参与训练
+        stored = store.rows(labeled_gdf['src_id']) >= 0
+        full_dataset = StoredRooftopDataset(store, labeled_gdf['src_id'][stored], labels=real_labels[stored])
+        prefetch_depth = 0
+    else:
+        full_dataset = RooftopDataset(labeled_gdf, labels=real_labels)
     
     # 划分 训练集 / 验证集
     train_size = int(0.8 * len(full_dataset))
@@ -64,6 +82,8 @@ def train_loop():
     # DataLoaders
     train_loader = DataLoader(train_dataset, batch_size=16, shuffle=True, num_workers=0) # Mac/Windows 上 num_workers=0 更稳定
     val_loader = DataLoader(val_dataset, batch_size=16, shuffle=False)
+    if prefetch_depth:
+        prefetcher = WMSPrefetcher(train_dataset, depth=prefetch_depth)
     
     # --- 2. 准备模型 ---
     print("2. Initializing Model...")
@@ -86,8 +106,21 @@ def train_loop():
         correct = 0
         total = 0
         
-        for images, labels in train_loader:
+        if prefetch_depth:
+            prefetcher.reset_metrics()
+            batches = prefetcher.batches(16, shuffle=True, seed=epoch)
+        else:
+            batches = ((images, None, labels, None) for images, labels in train_loader)
+        for images, _, labels, errors in batches:
+            if errors is not None:
+                # 跳过取图失败的样本 (全零图像)，不要拿它们训练
+                ok = torch.tensor([not e for e in errors])
+                if not ok.any():
+                    continue
+                images, labels = images[ok], labels[ok]
             images, labels = images.to(device), labels.to(device)
+            if images.dtype == torch.uint8:
+                images = normalize_batch(images)
             
             optimizer.zero_grad()
             outputs = model(images)
@@ -100,7 +133,11 @@ def train_loop():
             total += labels.size(0)
             correct += (predicted == labels).sum().item()
             
-        print(f"Epoch {epoch+1}/{num_epochs} - Loss: {running_loss/len(train_loader):.4f} - Acc: {100 * correct / total:.2f}%")
+        print(f"Epoch {epoch+1}/{num_epochs} - Loss: {running_loss/len(train_loader):.4f} - Acc: {100 * correct / max(total, 1):.2f}%")
+        if prefetch_depth:
+            m = prefetcher.metrics()
+            print(f"   预取: {m['items_per_second']:.1f} 张/秒, 等待 {m['stall_seconds']:.1f}s, "
+                  f"平均就绪 {m['mean_ready']:.1f}/{m['depth']}, 失败 {m['failed']} -> {m['bound']}-bound")
         
     print("Training Complete!")
     
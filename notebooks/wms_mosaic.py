@@ -0,0 +1,236 @@
+import collections
+import io
+import math
+import threading
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from tile_cache import TileCache
+
+# --- 配置 ---
+WMS_URL = "https://geo.api.vlaanderen.be/OMWRGBMRVL/wms"
+LAYER_NAME = "Ortho"
+PADDING_M = 2.0  # 与 RooftopDataset.fetch_satellite_image 相同的 padding
+IMG_SIZE = 224
+NATIVE_RES_M = 0.25  # OMWRGBMRVL 原始分辨率 25 cm：请求更细的分辨率只是服务器端插值
+MAX_MOSAIC_PX = 2048  # 单张拼图最大宽/高 (服务器上限通常是 4096；2048 解码更快)
+MAX_PIXEL_RATIO = 1.0  # 拼图像素数不超过逐张请求像素总和 (避免为稀疏屋顶下载大片空地)；调大则用字节换请求数
+MEMORY_MOSAICS = 4  # 内存中保留的已解码拼图数
+
+
+def roof_bboxes(gdf, padding=PADDING_M):
+    """每个屋顶加 padding 后的 bbox (EPSG:31370)，形状 (n, 4)。"""
+    b = gdf.geometry.bounds.to_numpy()
+    return b + np.array([-padding, -padding, padding, padding])
+
+
+def mosaic_transform(minx, maxy, res):
+    """北向上拼图的仿射变换，参数顺序与 rasterio/affine 的 Affine(a, b, c, d, e, f) 相同。"""
+    return (res, 0.0, minx, 0.0, -res, maxy)
+
+
+def pixel_box(transform, bbox):
+    """地理 bbox -> 图像上的 (left, top, right, bottom) 浮点像素框 (逆仿射变换)。"""
+    a, _, c, _, e, f = transform
+    minx, miny, maxx, maxy = bbox
+    return ((minx - c) / a, (maxy - f) / e, (maxx - c) / a, (miny - f) / e)
+
+
+def plan_mosaics(bboxes, img_size=IMG_SIZE, native_res_m=NATIVE_RES_M, max_px=MAX_MOSAIC_PX,
+                 max_pixel_ratio=MAX_PIXEL_RATIO):
+    """
+    把屋顶 bbox 分组成拼图请求。
+
+    从全部屋顶开始，沿外包框较长的一边按中位数递归二分，直到一组满足：拼图宽高不超过
+    max_px，且像素数不超过逐张请求的 max_pixel_ratio 倍。剩下单独一个屋顶的组照旧单独请求。
+    拼图分辨率取组内最细的需求 (bbox 短边 / img_size)，但不细于 native_res_m，
+    所以裁剪后的清晰度不低于原来的逐张请求。
+
+    返回 (roofs, mosaics)：roofs 每个屋顶一行，mosaic 列为拼图编号 (-1 = 单独请求)；
+    mosaics 每张拼图一行 (minx, miny, maxx, maxy, width, height, res, n_roofs)。
+    """
+    bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+    n = len(bboxes)
+    res = np.maximum(native_res_m, np.minimum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1]) / img_size)
+    cx, cy = (bboxes[:, 0] + bboxes[:, 2]) / 2, (bboxes[:, 1] + bboxes[:, 3]) / 2
+    mosaic = np.full(n, -1, dtype=np.int64)
+    rows = []
+    stack = [np.arange(n)]
+    while stack:
+        members = stack.pop()
+        if len(members) < 2:
+            continue
+        b = bboxes[members]
+        minx, miny = b[:, 0].min(), b[:, 1].min()
+        maxx, maxy = b[:, 2].max(), b[:, 3].max()
+        r = res[members].min()
+        width, height = math.ceil((maxx - minx) / r), math.ceil((maxy - miny) / r)
+        if width <= max_px and height <= max_px and width * height <= max_pixel_ratio * len(members) * img_size ** 2:
+            mosaic[members] = len(rows)
+            # 宽高取整后扩展 maxx / miny，使仿射变换精确对齐像素
+            rows.append((minx, maxy - height * r, minx + width * r, maxy, width, height, r, len(members)))
+            continue
+        centers = cx[members] if maxx - minx >= maxy - miny else cy[members]
+        order = members[np.argsort(centers, kind="stable")]
+        half = len(order) // 2
+        stack += [order[:half], order[half:]]
+    mosaics = pd.DataFrame(rows, columns=["minx", "miny", "maxx", "maxy", "width", "height", "res", "n_roofs"])
+    return pd.DataFrame({"mosaic": mosaic}), mosaics
+
+
+def plan_report(roofs, mosaics, img_size=IMG_SIZE):
+    """拼图方案与逐张请求相比节省的 HTTP 请求数和像素/字节数 (字节按未压缩 RGB 计)。"""
+    n = len(roofs)
+    singles = int((roofs["mosaic"] < 0).sum())
+    baseline_px = n * img_size ** 2
+    planned_px = int((mosaics["width"] * mosaics["height"]).sum()) + singles * img_size ** 2
+    requests = len(mosaics) + singles
+    return {
+        "roofs": n,
+        "baseline_requests": n,
+        "requests": requests,
+        "requests_saved": n - requests,
+        "mosaics": len(mosaics),
+        "roofs_in_mosaics": n - singles,
+        "baseline_mb": baseline_px * 3 / 1e6,
+        "planned_mb": planned_px * 3 / 1e6,
+        "mb_saved": (baseline_px - planned_px) * 3 / 1e6,
+    }
+
+
+class MosaicFetcher:
+    """
+    按 plan_mosaics 的方案取图：
+    1. 同一拼图中的屋顶共用一次 GetMap (经过 TileCache，按拼图 bbox/尺寸缓存)。
+    2. 每个屋顶用拼图的仿射变换在本地裁剪并重采样到 img_size x img_size。
+    3. 不在方案中的 bbox 或单独的屋顶照旧单独请求。
+    已解码的拼图在内存中保留 MEMORY_MOSAICS 张；按 order() 的顺序取图可以让同一拼图的屋顶连续处理。
+    线程安全，可以和 WMSPrefetcher 一起使用。
+    """
+
+    def __init__(self, gdf, tile_cache=None, wms_url=WMS_URL, layer=LAYER_NAME, img_size=IMG_SIZE,
+                 padding=PADDING_M, memory_mosaics=MEMORY_MOSAICS, **plan_kwargs):
+        self.tile_cache = tile_cache if tile_cache is not None else TileCache()
+        self.wms_url = wms_url
+        self.layer = layer
+        self.img_size = img_size
+        self.bboxes = roof_bboxes(gdf, padding)
+        self.roofs, self.mosaics = plan_mosaics(self.bboxes, img_size, **plan_kwargs)
+        self._lookup = {tuple(np.round(b, 2)): i for i, b in enumerate(self.bboxes)}
+        self._memory = collections.OrderedDict()
+        self._memory_size = memory_mosaics
+        self._lock = threading.Lock()
+        self._mosaic_locks = collections.defaultdict(threading.Lock)
+
+    # DataLoader worker (spawn) 需要 pickle：锁和已解码的拼图不带过去
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_memory"], state["_lock"], state["_mosaic_locks"] = None, None, None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._mosaic_locks = collections.defaultdict(threading.Lock)
+
+    def report(self):
+        return plan_report(self.roofs, self.mosaics, self.img_size)
+
+    def order(self):
+        """按拼图分组的屋顶顺序 (单独请求的屋顶排在最后)。"""
+        m = self.roofs["mosaic"].to_numpy()
+        return np.lexsort((np.arange(len(m)), np.where(m < 0, len(self.mosaics), m)))
+
+    def getmap(self, bbox, width, height, session=None):
+        params = {
+            "SERVICE": "WMS",
+            "VERSION": "1.3.0",
+            "REQUEST": "GetMap",
+            "LAYERS": self.layer,
+            "CRS": "EPSG:31370",
+            "BBOX": f"{bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]}",
+            "WIDTH": width,
+            "HEIGHT": height,
+            "FORMAT": "image/png",
+            "STYLES": "",
+        }
+        content = self.tile_cache.fetch(self.wms_url, params, session=session)
+        return Image.open(io.BytesIO(content)).convert("RGB")
+
+    def _mosaic(self, m, session=None):
+        with self._lock:
+            if m in self._memory:
+                self._memory.move_to_end(m)
+                return self._memory[m]
+            lock = self._mosaic_locks[m]
+        # 同一拼图只让一个线程去取，其它线程等它完成
+        with lock:
+            with self._lock:
+                if m in self._memory:
+                    return self._memory[m]
+            row = self.mosaics.iloc[m]
+            image = self.getmap((row.minx, row.miny, row.maxx, row.maxy), int(row.width), int(row.height), session)
+            with self._lock:
+                self._memory[m] = image
+                while len(self._memory) > self._memory_size:
+                    self._memory.popitem(last=False)
+        return image
+
+    def fetch(self, bbox, session=None):
+        """bbox (已加 padding) 对应屋顶的 img_size x img_size RGB 图像。"""
+        i = self._lookup.get(tuple(np.round(bbox, 2)))
+        m = -1 if i is None else int(self.roofs["mosaic"].iat[i])
+        if m < 0:
+            return self.getmap(bbox, self.img_size, self.img_size, session)
+        row = self.mosaics.iloc[m]
+        transform = mosaic_transform(row.minx, row.maxy, row.res)
+        return self._mosaic(m, session).resize((self.img_size, self.img_size), Image.BILINEAR,
+                                               box=pixel_box(transform, bbox))
+
+
+# --- 统计：500 个候选屋顶和整个城市 (src/wfs_stub 合成的 56k 建筑) 的请求数/字节数节省 ---
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+    import time
+
+    import geopandas as gpd
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    candidates = gpd.read_file(os.path.join(here, "data", "500_large_with_pv.gpkg"))
+    for ratio in (MAX_PIXEL_RATIO, 2.0):
+        print(f"500 候选屋顶 (max_pixel_ratio={ratio}):",
+              plan_report(*plan_mosaics(roof_bboxes(candidates), max_pixel_ratio=ratio)))
+
+    sys.path.append(os.path.join(here, os.pardir, "src"))
+    from wfs_stub import synthetic_buildings
+
+    city = gpd.GeoDataFrame.from_features(synthetic_buildings(56_000), crs=31370)
+    start = time.perf_counter()
+    roofs, mosaics = plan_mosaics(roof_bboxes(city))
+    print(f"全城 (规划 {time.perf_counter() - start:.1f}s):", plan_report(roofs, mosaics))
+
+    # 在本地模拟 WMS 上实际取图：逐张 vs 拼图
+    from wms_stub import WMSStubServer
+
+    minx, miny = city.total_bounds[:2]
+    sample = city.cx[minx:minx + 400, miny:miny + 2000]
+    with WMSStubServer() as wms, tempfile.TemporaryDirectory() as tmp:
+        fetcher = MosaicFetcher(sample, TileCache(os.path.join(tmp, "mosaic")), wms_url=wms.url)
+        bboxes = fetcher.bboxes
+        start = time.perf_counter()
+        for i in fetcher.order():
+            img = fetcher.fetch(bboxes[i])
+            assert img.size == (IMG_SIZE, IMG_SIZE)
+        mosaic_s, mosaic_requests = time.perf_counter() - start, wms.requests
+
+        single = MosaicFetcher(sample.head(0), TileCache(os.path.join(tmp, "single")), wms_url=wms.url)
+        start = time.perf_counter()
+        for b in bboxes:
+            single.getmap(b, IMG_SIZE, IMG_SIZE)
+        print(f"模拟 WMS, {len(sample)} 个屋顶: 逐张 {wms.requests - mosaic_requests} 次请求 "
+              f"{time.perf_counter() - start:.1f}s, 拼图 {mosaic_requests} 次请求 {mosaic_s:.1f}s")
@@ -0,0 +1,202 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- 配置 ---
+PREFETCH_DEPTH = 64  # 提前准备好的图片数 (look-ahead 队列长度)
+PREFETCH_WORKERS = 8  # 下载/解码线程数；WMS 请求主要在等网络，线程比进程便宜
+MAX_RETRIES = 3
+BACKOFF_S = 0.5  # 第 n 次重试前等待 BACKOFF_S * 2**n 秒
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def is_transient(error):
+    """连接错误、超时、429/5xx 值得重试；4xx、WMS 的 XML 错误页、图片解码失败重试也没用。"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRY_STATUS
+    return False
+
+
+def make_session(pool_size=PREFETCH_WORKERS):
+    """所有预取线程共用的 Session：每个主机一个连接池，最多 pool_size 个保持连接。"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class WMSPrefetcher:
+    """
+    RooftopDataset 的预取图片源：
+    1. 线程池在后台下载、解码、resize (dataset.transform) 接下来的 depth 张屋顶图片。
+    2. 暂时性错误 (连接、超时、429/5xx) 按指数退避重试，其它错误立即失败；
+       失败的图片返回全零图像和错误信息，不中断迭代。
+    3. 所有线程共用一个 requests.Session (连接池)，并经过 dataset 的图块缓存。
+    4. metrics() 给出队列深度和等待 (stall) 时间，用来判断瓶颈在网络还是在 CPU/模型。
+
+    dataset 可以是 RooftopDataset，也可以是 random_split 得到的 Subset。
+    """
+
+    def __init__(self, dataset, depth=PREFETCH_DEPTH, workers=PREFETCH_WORKERS,
+                 max_retries=MAX_RETRIES, backoff_s=BACKOFF_S, session=None):
+        # Subset -> (原始 dataset, 索引)
+        self.indices = np.asarray(getattr(dataset, "indices", np.arange(len(dataset))))
+        self.dataset = getattr(dataset, "dataset", dataset)
+        self.depth = depth
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.session = session or make_session(workers)
+        self._lock = threading.Lock()
+        self.reset_metrics()
+
+    def __len__(self):
+        return len(self.indices)
+
+    def reset_metrics(self):
+        self._m = collections.Counter()
+        self._ready_sum = 0
+        self._started = time.perf_counter()
+
+    def _load(self, i):
+        """在线程中运行：下载 + 解码 + transform 一张图片。返回 (图像, 标签, 错误信息)。"""
+        ds = self.dataset
+        polygon = ds.gdf.geometry.iloc[i]
+        label = None if ds.labels is None else ds.labels[i]
+        error = ""
+        t0 = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                image = ds.fetch_satellite_image(polygon, session=self.session)
+                break
+            except Exception as e:
+                image, error = None, f"{type(e).__name__}: {e}"
+                if not is_transient(e):  # 包括离线缓存未命中 (TileCacheMiss)
+                    break
+                if attempt < self.max_retries:
+                    with self._lock:
+                        self._m["retries"] += 1
+                    time.sleep(self.backoff_s * 2 ** attempt)
+        t1 = time.perf_counter()
+        if image is not None:
+            error = ""
+            image = ds.transform(image) if ds.transform else image
+        t2 = time.perf_counter()
+        with self._lock:
+            self._m["fetch_seconds"] += t1 - t0
+            self._m["transform_seconds"] += t2 - t1
+            self._m["failed"] += bool(error)
+        return image, label, error
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iterate(self, order=None):
+        """按 order (默认原始顺序) 依次产出 (索引, 图像, 标签, 错误信息)，后台保持 depth 张在途/就绪。"""
+        order = self.indices if order is None else np.asarray(order)
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                position = 0
+                while position < len(order) or pending:
+                    while position < len(order) and len(pending) < self.depth:
+                        i = int(order[position])
+                        pending.append((i, pool.submit(self._load, i)))
+                        position += 1
+                    i, future = pending.popleft()
+                    ready = sum(f.done() for _, f in pending) + future.done()
+                    t0 = time.perf_counter()
+                    image, label, error = future.result()
+                    stall = time.perf_counter() - t0
+                    with self._lock:
+                        self._m["items"] += 1
+                        self._m["stall_seconds"] += stall
+                        self._m["stalls"] += stall > 1e-3
+                        self._ready_sum += ready
+                    yield i, image, label, error
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def batches(self, batch_size, shuffle=False, seed=None, order=None):
+        """
+        按 batch 产出 (images, indices, labels, errors)，images 为堆叠好的 Tensor。
+        失败的图片用全零图像占位，labels 在预测模式下为 None。order 可指定取图顺序。
+        """
+        import torch
+
+        order = self.indices if order is None else np.asarray(order)
+        if shuffle:
+            order = np.random.default_rng(seed).permutation(order)
+        size = self.dataset.img_size
+        items = []
+        for item in self.iterate(order):
+            items.append(item)
+            if len(items) == batch_size:
+                yield self._collate(items, size, torch)
+                items = []
+        if items:
+            yield self._collate(items, size, torch)
+
+    @staticmethod
+    def _collate(items, size, torch):
+        idx, images, labels, errors = zip(*items)
+        images = torch.stack([img if img is not None else torch.zeros(3, size, size) for img in images])
+        labels = None if labels[0] is None else torch.tensor(labels, dtype=torch.long)
+        return images, np.array(idx), labels, list(errors)
+
+    def metrics(self):
+        """
+        items / failed / retries；stall_seconds: 消费者等待图片的总时间；
+        mean_ready: 取图时已经准备好的平均张数 (满队列 = depth)。
+        stall_share 高、mean_ready 接近 0 -> 受网络限制；mean_ready 接近 depth -> 受 CPU/模型限制。
+        """
+        with self._lock:
+            m = {"items": 0, "failed": 0, "retries": 0, "stalls": 0, "stall_seconds": 0.0,
+                 "fetch_seconds": 0.0, "transform_seconds": 0.0}
+            m.update(self._m)
+            items = m["items"]
+            wall = time.perf_counter() - self._started
+            mean_ready = self._ready_sum / items if items else 0.0
+        stall_share = m["stall_seconds"] / wall if wall else 0.0
+        bound = "network" if stall_share > 0.2 and mean_ready < self.depth / 4 else "compute"
+        m.update({"depth": self.depth, "workers": self.workers, "wall_seconds": wall,
+                  "mean_ready": mean_ready, "stall_share": stall_share,
+                  "items_per_second": items / wall if wall else 0.0, "bound": bound})
+        return m
+
+
+# --- 基准测试：本地模拟 WMS，比较不同线程数下的吞吐和瓶颈判断 ---
+if __name__ == "__main__":
+    import tempfile
+
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    from rooftop_dataset import RooftopDataset
+    from tile_cache import TileCache
+    from wms_stub import WMSStubServer
+
+    N_ROOFS = 256
+    MODEL_S_PER_BATCH = 0.2  # 模拟 ResNet-18 在 CPU 上处理 32 张图的时间
+
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(170000, 178000, N_ROOFS), rng.uniform(170000, 178000, N_ROOFS)
+    gdf = gpd.GeoDataFrame(geometry=[box(a, b, a + 40, b + 30) for a, b in zip(x, y)], crs=31370)
+    with WMSStubServer() as wms, tempfile.TemporaryDirectory() as tmp:
+        for workers in (1, 4, 16):
+            dataset = RooftopDataset(gdf, tile_cache=TileCache(f"{tmp}/{workers}"), wms_url=wms.url)
+            prefetcher = WMSPrefetcher(dataset, workers=workers)
+            for _ in prefetcher.batches(32):
+                time.sleep(MODEL_S_PER_BATCH)
+            m = prefetcher.metrics()
+            print(f"workers={workers:2d}: {m['items_per_second']:6.1f} 张/秒, 等待 {m['stall_seconds']:.1f}s "
+                  f"({m['stall_share']:.0%}), 平均就绪 {m['mean_ready']:.1f}/{m['depth']} -> {m['bound']}-bound")
@@ -0,0 +1,78 @@
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+# 本地模拟的 WMS GetMap 服务，用于离线基准测试 (不访问 geo.api.vlaanderen.be)
+DEFAULT_LATENCY_S = 0.15  # 真实 WMS 单张 224px 图通常需要 0.1–1 秒
+
+
+class WMSStubServer:
+    """
+    本地 WMS 模拟服务：
+    1. 对每个 GetMap 请求等待 latency_s 秒 (模拟网络 + 渲染延迟)。
+    2. 返回 WIDTH x HEIGHT 的 PNG，内容由 BBOX 决定 (同一 bbox 每次返回相同的图)。
+    3. 统计请求次数与请求过的 bbox，方便检查缓存/合并请求的效果。
+    用法: with WMSStubServer() as wms: ... wms.url ...
+    """
+
+    def __init__(self, latency_s=DEFAULT_LATENCY_S):
+        self.latency_s = latency_s
+        self.requests = 0
+        self.bboxes = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/wms"
+
+    def render(self, bbox, width, height):
+        # 以 bbox 为种子生成图像，保证可复现
+        seed = abs(hash(tuple(round(v, 2) for v in bbox))) % (2 ** 32)
+        rng = np.random.default_rng(seed)
+        img = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(img).save(buf, format="PNG", compress_level=1)
+        return buf.getvalue()
+
+    def handle(self, query):
+        q = {k.upper(): v[0] for k, v in query.items()}
+        bbox = tuple(float(v) for v in q["BBOX"].split(","))
+        with self._lock:
+            self.requests += 1
+            self.bboxes.append(bbox)
+        time.sleep(self.latency_s)
+        return self.render(bbox, int(q.get("WIDTH", 224)), int(q.get("HEIGHT", 224)))
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    body = stub.handle(parse_qs(urlparse(self.path).query))
+                except (KeyError, ValueError) as e:
+                    self.send_error(400, str(e))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
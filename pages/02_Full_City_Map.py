@@ -6,8 +6,12 @@ from folium.plugins import MarkerCluster
 import geopandas as gpd
 from pyproj import Transformer
 import os
+import sys
 import glob
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+from geostore import ensure_layer
+
 st.set_page_config(layout="wide", page_title="Full City Scan", page_icon="🏙️")
 
 # --- 1. 数据加载逻辑 (Ha Van/Alex's Data) ---
@@ -16,13 +20,18 @@ def load_full_city_data():
     # 路径指向 Ha Van 提到的 notebook 数据目录
     search_path = "notebooks/data"
     
-    # 既然我们知道具体文件名，就直接指定优先级
-    # 优先加载 GPKG (包含几何信息且读取快)，其次 GeoJSON，最后 CSV
+    # 既然我们知道具体文件名，就直接指定优先级: GPKG、GeoJSON，最后 CSV
     priority_files = [
         "large_roofs_test.gpkg",
         "large_roofs_test.geojson",
         "large_roofs_test.csv"
     ]
+    # 优先加载由 GPKG/GeoJSON 生成的 GeoParquet 副本 (src/geostore.py，列式读取最快)；
+    # notebook 重新写出 GPKG 后副本会自动重建，不会读到旧数据
+    try:
+        priority_files.insert(0, os.path.basename(ensure_layer("large_roofs_test", search_path)))
+    except Exception:
+        pass  # 没有原始文件或生成副本失败时直接读原始文件
     
     target_file = None
     for fname in priority_files:
@@ -48,6 +57,11 @@ def load_full_city_data():
             if 'lat' not in df.columns and 'x' in df.columns:
                  transformer = Transformer.from_crs("EPSG:31370", "EPSG:4326", always_xy=True)
                  df['lon'], df['lat'] = transformer.transform(df['x'].values, df['y'].values)
+        elif target_file.endswith(".parquet"):
+            # 只读取地图需要的列
+            df = gpd.read_parquet(target_file, columns=["src_id", "area_m2", "geometry"]).to_crs(4326)
+            df['lon'] = df.geometry.centroid.x
+            df['lat'] = df.geometry.centroid.y
         else:
             # GPKG 或 GeoJSON
             df = gpd.read_file(target_file).to_crs(4326)
@@ -94,7 +108,7 @@ for idx, row in subset.iterrows():
         color="#3b82f6",
         fill=True,
         fill_opacity=0.6,
-        popup=f"ID: {idx}<br>Area: {area_val}"
+        popup=f"ID: {row.get('src_id', idx)}<br>Area: {area_val}"
     ).add_to(marker_cluster)
 
 st_folium(m, height=700, width="100%")
\ No newline at end of file
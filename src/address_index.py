@@ -0,0 +1,192 @@
+import hashlib
+import os
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.spatial import cKDTree
+
+from buildings import TARGET_EPSG, geometry_hashes
+
+DEFAULT_ADDRESS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "notebooks", "data", "address_points.gpkg",
+)
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "notebooks", "cache", "addresses",
+)
+MAX_DISTANCE_M = 75.0
+# Adressenregister / CRAB field names, matched case-insensitively.
+STREET_FIELDS = ("straatnaam", "street", "straat")
+NUMBER_FIELDS = ("huisnummer", "housenumber", "huisnr")
+BOX_FIELDS = ("busnummer", "box")
+POSTCODE_FIELDS = ("postcode", "postinfo", "postal_code")
+MUNICIPALITY_FIELDS = ("gemeentenaam", "municipality", "gemeente")
+ADDRESS_COLUMNS = ["address", "address_distance_m", "address_match"]
+
+
+def _field(frame, names):
+    lower = {c.lower(): c for c in frame.columns}
+    for name in names:
+        if name in lower:
+            return frame[lower[name]].astype("string").str.strip()
+    return None
+
+
+def format_addresses(frame):
+    """
+    Address labels in the reverse-geocoding format, e.g. ``"Naamsestraat 22,
+    3000 Leuven, Belgium"``. An ``address`` column is used as is.
+    """
+    if "address" in frame:
+        return frame["address"].astype("string")
+    street, number = _field(frame, STREET_FIELDS), _field(frame, NUMBER_FIELDS)
+    if street is None:
+        raise ValueError("address file needs an 'address' or a street name column")
+    box = _field(frame, BOX_FIELDS)
+    postcode, municipality = _field(frame, POSTCODE_FIELDS), _field(frame, MUNICIPALITY_FIELDS)
+    label = street
+    if number is not None:
+        label = label.str.cat(number, sep=" ", na_rep="").str.strip()
+    if box is not None:
+        label = label.where(box.isna() | (box == ""), label + " bus " + box)
+    place = None
+    for part in (postcode, municipality):
+        if part is not None:
+            place = part if place is None else place.str.cat(part, sep=" ", na_rep="").str.strip()
+    if place is not None:
+        label = label + ", " + place
+    return label + ", Belgium"
+
+
+class AddressIndex:
+    """
+    Nearest-address lookup over address points in Lambert 72 (EPSG:31370).
+
+    A KD-tree over the points answers one vectorised nearest-neighbour query for
+    all footprint centroids; an STRtree over the same points finds addresses that
+    lie inside a footprint, which take precedence over a closer point outside it.
+    """
+
+    def __init__(self, x, y, labels):
+        self.xy = np.column_stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)])
+        self.labels = np.asarray(labels, dtype=object)
+        self.kdtree = cKDTree(self.xy)
+        self.strtree = shapely.STRtree(shapely.points(self.xy))
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_ADDRESS_PATH, **read_kwargs):
+        """Address points from any file geopandas reads (GPKG, SHP, GeoJSON, ...)."""
+        points = gpd.read_file(path, **read_kwargs)
+        if points.crs is not None:
+            points = points.to_crs(TARGET_EPSG)
+        points = points[points.geometry.notna() & ~points.geometry.is_empty]
+        labels = format_addresses(points)
+        keep = labels.notna().to_numpy()
+        return cls(points.geometry.x[keep], points.geometry.y[keep], labels[keep])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def nearest(self, x, y, max_distance_m=MAX_DISTANCE_M):
+        """Position of the nearest address for each point (-1 beyond ``max_distance_m``) and its distance."""
+        dist, idx = self.kdtree.query(np.column_stack([x, y]), distance_upper_bound=max_distance_m)
+        found = np.isfinite(dist)
+        return np.where(found, idx, -1), np.where(found, dist, np.nan)
+
+    def assign(self, geometries, max_distance_m=MAX_DISTANCE_M):
+        """
+        Address per footprint: the address inside it closest to its centroid, else
+        the nearest one within ``max_distance_m`` of the centroid. Returns a frame
+        with ``address``, ``address_distance_m`` and ``address_match`` ("inside",
+        "nearest" or missing).
+        """
+        geoms = np.asarray(geometries, dtype=object)
+        centroids = shapely.centroid(geoms)
+        cx, cy = shapely.get_x(centroids), shapely.get_y(centroids)
+        idx, dist = self.nearest(cx, cy, max_distance_m)
+        match = np.where(idx >= 0, "nearest", None).astype(object)
+
+        building, point = self.strtree.query(geoms, predicate="contains")
+        if len(building):
+            d = np.hypot(self.xy[point, 0] - cx[building], self.xy[point, 1] - cy[building])
+            order = np.lexsort((d, building))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = building[order][1:] != building[order][:-1]
+            rows, points = building[order][first], point[order][first]
+            idx[rows], dist[rows], match[rows] = points, d[order][first], "inside"
+
+        labels = np.where(idx >= 0, self.labels[np.maximum(idx, 0)], None)
+        return pd.DataFrame({"address": pd.array(labels, dtype="string"),
+                             "address_distance_m": dist,
+                             "address_match": pd.array(match, dtype="string")})
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def geocode_buildings(gdf, address_path=DEFAULT_ADDRESS_PATH, cache_dir=DEFAULT_CACHE_DIR,
+                      max_distance_m=MAX_DISTANCE_M, index=None):
+    """
+    Address columns for every footprint of ``gdf`` (indexed like it), using an
+    :class:`AddressIndex` over ``address_path``.
+
+    Results are cached per geometry hash in ``cache_dir``, in one parquet file per
+    version of the address file, so refreshed or re-run datasets only look up
+    footprints that changed. The index is only built when something is missing.
+    """
+    start = time.perf_counter()
+    hashes = geometry_hashes(gdf.geometry.values)
+    cache_path = os.path.join(cache_dir, f"{_file_digest(address_path)[:16]}-{int(max_distance_m)}m.parquet")
+    cached = pd.read_parquet(cache_path) if os.path.exists(cache_path) else \
+        pd.DataFrame({c: pd.Series(dtype=t) for c, t in
+                      zip(["geom_hash"] + ADDRESS_COLUMNS, ["string", "string", "float64", "string"])})
+    cached = cached.drop_duplicates("geom_hash").set_index("geom_hash")
+    missing = ~pd.Index(hashes).isin(cached.index) & pd.notna(hashes)
+    if missing.any():
+        index = index if index is not None else AddressIndex.from_file(address_path)
+        todo = pd.Series(hashes[missing]).drop_duplicates()
+        found = index.assign(gdf.geometry.values[missing][todo.index], max_distance_m)
+        found.index = pd.Index(todo.to_numpy(), name="geom_hash")
+        cached = pd.concat([cached, found])
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{cache_path}.tmp"
+        cached.reset_index().to_parquet(tmp, index=False)
+        os.replace(tmp, cache_path)
+    out = cached.reindex(hashes)[ADDRESS_COLUMNS]
+    out.index = gdf.index
+    out.attrs.update({"looked_up": int(missing.sum()), "cached": int(len(gdf) - missing.sum()),
+                      "seconds": time.perf_counter() - start})
+    return out
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from wfs_stub import synthetic_buildings
+
+    buildings = gpd.GeoDataFrame.from_features(synthetic_buildings(56_000), crs=TARGET_EPSG)
+    rng = np.random.default_rng(0)
+    cen = buildings.geometry.centroid
+    n = 80_000
+    pick = rng.integers(0, len(buildings), n)
+    points = gpd.GeoDataFrame({
+        "straatnaam": [f"Straat {i % 900}" for i in range(n)],
+        "huisnummer": (pick % 200 + 1).astype(str),
+        "postcode": "3000", "gemeentenaam": "Leuven",
+    }, geometry=gpd.points_from_xy(cen.x.to_numpy()[pick] + rng.normal(0, 15, n),
+                                   cen.y.to_numpy()[pick] + rng.normal(0, 15, n)), crs=TARGET_EPSG)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "address_points.gpkg")
+        points.to_file(path)
+        for run in ("cold", "warm"):
+            result = geocode_buildings(buildings, path, cache_dir=os.path.join(tmp, "cache"))
+            print(f"{run}: {len(result)} buildings, {result.attrs['looked_up']} looked up in "
+                  f"{result.attrs['seconds']:.2f}s; {result['address_match'].value_counts().to_dict()}")
+        print(result.head())
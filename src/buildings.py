@@ -0,0 +1,48 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+import shapely
+
+TARGET_EPSG = 31370
+LARGE_ROOF_MIN_M2 = 500
+
+
+def clean_columns(g, drop_invalid=True):
+    """
+    Rename the raw GRB WFS columns and drop empty or invalid geometries (as in the
+    notebooks). With ``drop_invalid=False`` invalid geometries are kept, e.g. for
+    :func:`geometry_prep.prepare_buildings` to repair.
+    """
+    g = g.copy()
+    ren = {}
+    if "id" in g.columns: ren["id"] = "src_id"
+    if "Id" in g.columns: ren["Id"] = "wfs_id"
+    if "ObjectId" in g.columns: ren["ObjectId"] = "object_id"
+    g = g.rename(columns=ren)
+    if "VersieId" in g.columns:
+        g["VersieId"] = pd.to_datetime(g["VersieId"], utc=True, errors="coerce").dt.strftime("%Y-%m-%d %H:%M:%S")
+    keep = g.geometry.notnull()
+    if drop_invalid:
+        keep &= g.geometry.is_valid
+    g = g[keep]
+    return g
+
+
+def add_area_centroid(g):
+    g = g.copy()
+    g["area_m2"] = g.geometry.area
+    cen = g.geometry.centroid
+    g["centroid_x"] = cen.x
+    g["centroid_y"] = cen.y
+    return g
+
+
+def geometry_hashes(geometries):
+    """
+    Per-row SHA-1 of the normalised WKB of each geometry (None for missing ones), so
+    the same footprint hashes equally whatever its ring start or orientation.
+    """
+    geoms = np.asarray(geometries, dtype=object)
+    wkb = shapely.to_wkb(shapely.normalize(geoms))
+    return np.array([None if b is None else hashlib.sha1(b).hexdigest() for b in wkb], dtype=object)
@@ -0,0 +1,183 @@
+import os
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from buildings import TARGET_EPSG
+from layouts import SOUTH
+from pvgis_utils import DEFAULT_LOSS, WP_PER_M2
+
+HOURS_PER_YEAR = 8760
+TOTAL_GRID_CAPACITY_KW = 130000  # city-wide figure from the congestion notebook
+DEFAULT_ZONES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "notebooks", "data", "grid_zones.gpkg",
+)
+ZONE_COL = "zone_id"
+CAPACITY_COL = "capacity_kw"
+ZONE_CELL_M = 2000
+CHUNK_PROFILES = 512
+
+
+def load_zones(path=DEFAULT_ZONES_PATH, zone_col=ZONE_COL, capacity_col=CAPACITY_COL):
+    """Grid zones from a local polygon file with a zone id and a capacity (kW) per zone."""
+    zones = gpd.read_file(path).to_crs(TARGET_EPSG)
+    missing = {zone_col, capacity_col} - set(zones.columns)
+    if missing:
+        raise ValueError(f"{path} lacks columns {sorted(missing)}")
+    return zones.rename(columns={zone_col: ZONE_COL, capacity_col: CAPACITY_COL})[[ZONE_COL, CAPACITY_COL, "geometry"]]
+
+
+def grid_zones(boundary, cell_m=ZONE_CELL_M, total_capacity_kw=TOTAL_GRID_CAPACITY_KW):
+    """
+    Placeholder zones when no zone file is available: square cells of ``cell_m``
+    clipped to ``boundary``, sharing ``total_capacity_kw`` in proportion to area.
+    """
+    geom = boundary.to_crs(TARGET_EPSG).union_all()
+    minx, miny, maxx, maxy = geom.bounds
+    xs, ys = np.meshgrid(np.arange(minx, maxx, cell_m), np.arange(miny, maxy, cell_m))
+    cells = shapely.intersection(shapely.box(xs.ravel(), ys.ravel(), xs.ravel() + cell_m, ys.ravel() + cell_m), geom)
+    cells = cells[~shapely.is_empty(cells)]
+    area = shapely.area(cells)
+    return gpd.GeoDataFrame({
+        ZONE_COL: [f"Z{i:03d}" for i in range(len(cells))],
+        CAPACITY_COL: total_capacity_kw * area / area.sum(),
+    }, geometry=cells, crs=TARGET_EPSG)
+
+
+def assign_zones(x, y, zones):
+    """Position in ``zones`` of the zone containing each point (EPSG:31370), -1 outside all zones."""
+    points = shapely.points(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    tree = shapely.STRtree(zones.geometry.values)
+    point_idx, zone_idx = tree.query(points, predicate="within")
+    zone = np.full(len(points), -1, dtype=np.int64)
+    zone[point_idx[::-1]] = zone_idx[::-1]  # first zone wins on shared edges
+    return zone
+
+
+def zone_injection(zone, profile_rows, kwp, profiles, n_zones, chunk_rows=CHUNK_PROFILES):
+    """
+    ``n_zones x 8760`` hourly injection (kW).
+
+    Roofs are reduced to a zone x profile matrix of installed kWp, which is then
+    multiplied with ``profiles`` (per-kWp kW, ``(n_profiles, 8760)``; a memmap such as
+    ``HourlyProfileStore.profiles`` works) ``chunk_rows`` profiles at a time.
+    Roofs with a negative zone are ignored.
+    """
+    zone, profile_rows, kwp = (np.asarray(a) for a in (zone, profile_rows, kwp))
+    inside = zone >= 0
+    n_profiles = len(profiles)
+    weights = np.bincount(zone[inside] * n_profiles + profile_rows[inside], weights=kwp[inside],
+                          minlength=n_zones * n_profiles).reshape(n_zones, n_profiles)
+    out = np.zeros((n_zones, HOURS_PER_YEAR))
+    for start in range(0, n_profiles, chunk_rows):
+        stop = min(start + chunk_rows, n_profiles)
+        w = weights[:, start:stop]
+        used = np.flatnonzero(w.any(axis=0))
+        if len(used):
+            out += w[:, used] @ np.asarray(profiles[start + used], dtype=np.float64)
+    return out
+
+
+def zone_report(injection, capacity_kw, load_kw=0.0):
+    """
+    Per-zone congestion figures for an ``n_zones x 8760`` injection matrix.
+
+    ``load_kw`` (scalar, per zone, or per zone and hour) is local consumption that
+    offsets injection. Overload hours are hours where net injection exceeds
+    ``capacity_kw``; headroom is capacity minus peak net injection, and
+    ``headroom_factor`` is how far all PV in the zone could be scaled before the
+    first overload hour.
+    """
+    capacity = np.asarray(capacity_kw, dtype=float).reshape(-1, 1)
+    load = np.broadcast_to(np.asarray(load_kw, dtype=float).reshape(-1, 1) if np.ndim(load_kw) == 1
+                           else np.asarray(load_kw, dtype=float), injection.shape)
+    net = injection - load
+    excess = np.clip(net - capacity, 0.0, None)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(injection > 0, (capacity + load) / injection, np.inf).min(axis=1)
+    peak_hour = net.argmax(axis=1)
+    return pd.DataFrame({
+        "energy_mwh": injection.sum(axis=1) / 1000.0,
+        "peak_kw": net[np.arange(len(net)), peak_hour],
+        "peak_hour": peak_hour,
+        "overload_hours": (excess > 0).sum(axis=1),
+        "overload_mwh": excess.sum(axis=1) / 1000.0,
+        "headroom_kw": capacity[:, 0] - net.max(axis=1),
+        "headroom_factor": scale,
+    })
+
+
+def _roof_lat_lon(roofs):
+    if "lat" in roofs and "lon" in roofs:
+        return roofs["lat"].to_numpy(float), roofs["lon"].to_numpy(float)
+    pts = gpd.GeoSeries(shapely.points(roofs["centroid_x"], roofs["centroid_y"]), crs=TARGET_EPSG).to_crs(4326)
+    return pts.y.to_numpy(), pts.x.to_numpy()
+
+
+def simulate_congestion(roofs, zones, layout=SOUTH, model=None, loss_percent=DEFAULT_LOSS,
+                        load_kw=0.0, chunk_rows=CHUNK_PROFILES):
+    """
+    Hourly grid-congestion simulation of ``roofs`` (with ``centroid_x``/``centroid_y``
+    in EPSG:31370) fully covered with ``layout`` across ``zones`` (see
+    :func:`load_zones` / :func:`grid_zones`).
+
+    Installed kWp comes from ``<layout>_kwp`` (as written by ``evaluate_layouts``) or
+    from ``area_m2``, and is split equally over the layout's azimuths. Per-kWp
+    profiles come from ``model.hourly_profiles``, one per PVGIS cell and orientation:
+    an ``OfflineYieldModel`` by default, or an ``HourlyProfileStore`` into which the
+    roofs were ingested with the layout's tilt and azimuths.
+
+    Returns ``(roofs, report, injection)``: the roofs with ``zone_id``,
+    ``zone_overload_hours`` and ``zone_headroom_kw``; one report row per zone; and
+    the ``n_zones x 8760`` injection matrix in kW.
+    """
+    if model is None:
+        from pv_model import OfflineYieldModel
+        model = OfflineYieldModel()
+    start = time.perf_counter()
+    kwp_col = f"{layout.name}_kwp"
+    if kwp_col in roofs:
+        kwp = roofs[kwp_col].to_numpy(float)
+    else:
+        kwp = roofs["area_m2"].to_numpy(float) * layout.fill_factor * WP_PER_M2 / 1000.0
+    zone = assign_zones(roofs["centroid_x"], roofs["centroid_y"], zones)
+    lat, lon = _roof_lat_lon(roofs)
+
+    injection = np.zeros((len(zones), HOURS_PER_YEAR))
+    share = kwp / len(layout.azimuths)
+    for azimuth in layout.azimuths:
+        profiles, rows = model.hourly_profiles(lat, lon, layout.tilt_deg, azimuth, loss_percent)
+        injection += zone_injection(zone, rows, share, profiles, len(zones), chunk_rows)
+
+    report = zone_report(injection, zones[CAPACITY_COL].to_numpy(), load_kw)
+    report.insert(0, ZONE_COL, zones[ZONE_COL].to_numpy())
+    report.insert(1, "roofs", np.bincount(zone[zone >= 0], minlength=len(zones)))
+    report.insert(2, "kwp", np.bincount(zone[zone >= 0], weights=kwp[zone >= 0], minlength=len(zones)))
+    report.insert(3, CAPACITY_COL, zones[CAPACITY_COL].to_numpy())
+    report.attrs.update({"unzoned_roofs": int((zone < 0).sum()), "seconds": time.perf_counter() - start})
+
+    out = roofs.copy()
+    known = zone >= 0
+    out[ZONE_COL] = np.where(known, zones[ZONE_COL].to_numpy()[np.maximum(zone, 0)], None)
+    out["zone_overload_hours"] = np.where(known, report["overload_hours"].to_numpy()[np.maximum(zone, 0)], 0)
+    out["zone_headroom_kw"] = np.where(known, report["headroom_kw"].to_numpy()[np.maximum(zone, 0)], np.nan)
+    return out, report, injection
+
+
+if __name__ == "__main__":
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "notebooks", "data")
+    leuven = gpd.read_file(os.path.join(data, "leuven_boundary.gpkg"))
+    zones = load_zones() if os.path.exists(DEFAULT_ZONES_PATH) else grid_zones(leuven)
+
+    rng = np.random.default_rng(0)
+    minx, miny, maxx, maxy = zones.total_bounds
+    n = 56_000
+    roofs = pd.DataFrame({"centroid_x": rng.uniform(minx, maxx, n), "centroid_y": rng.uniform(miny, maxy, n),
+                          "area_m2": rng.lognormal(5.0, 0.9, n)})
+    _, report, injection = simulate_congestion(roofs, zones)
+    print(f"{n} roofs, {len(zones)} zones, injection {injection.shape}: {report.attrs['seconds']:.1f}s "
+          f"({report.attrs['unzoned_roofs']} roofs outside all zones)")
+    print(report.sort_values("overload_hours", ascending=False).head(10).to_string(index=False))
@@ -0,0 +1,154 @@
+import json
+import os
+import time
+
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "notebooks", "data")
+DEFAULT_EXPORT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "notebooks", "cache", "exports",
+)
+ROW_GROUP_SIZE = 8192
+EXPORT_FORMATS = ("gpkg", "geojson", "csv")
+LEGACY_FORMATS = ("gpkg", "geojson")
+
+
+def layer_path(name, store_dir=DEFAULT_STORE_DIR):
+    return os.path.join(store_dir, f"{name}.parquet")
+
+
+def write_layer(gdf, name, store_dir=DEFAULT_STORE_DIR, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write ``gdf`` as the canonical GeoParquet copy of layer ``name``.
+
+    Rows are sorted along a Hilbert curve so each row group covers a compact area,
+    and a ``bbox`` covering column is written; together with the per-row-group
+    column statistics this lets :func:`read_layer` skip row groups outside a
+    requested bbox. The file is replaced atomically.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    path = layer_path(name, store_dir)
+    if len(gdf):
+        gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort(kind="stable")]
+    tmp = f"{path}.tmp"
+    gdf.to_parquet(tmp, index=False, compression="zstd", write_covering_bbox=True,
+                   row_group_size=row_group_size)
+    os.replace(tmp, path)
+    return path
+
+
+def layer_crs(name, store_dir=DEFAULT_STORE_DIR):
+    """CRS of a stored layer, read from the GeoParquet metadata only."""
+    geo = json.loads(pq.read_schema(layer_path(name, store_dir)).metadata[b"geo"])
+    column = geo["columns"][geo["primary_column"]]
+    return gpd.GeoSeries([], crs=column.get("crs", "OGC:CRS84")).crs
+
+
+def read_layer(name, columns=None, bbox=None, bbox_crs=None, store_dir=DEFAULT_STORE_DIR):
+    """
+    Read layer ``name`` from its GeoParquet file.
+
+    ``columns`` limits the attributes read (geometry is always included). ``bbox``
+    (minx, miny, maxx, maxy), in ``bbox_crs`` or else the layer's CRS, is pushed down
+    to the Parquet reader so only row groups and rows intersecting it are loaded.
+    """
+    path = layer_path(name, store_dir)
+    if bbox is not None and bbox_crs is not None:
+        bbox = tuple(gpd.GeoSeries.from_xy(bbox[::2], bbox[1::2], crs=bbox_crs)
+                     .to_crs(layer_crs(name, store_dir)).total_bounds)
+    if columns is not None:
+        columns = list(dict.fromkeys([*columns, "geometry"]))
+    gdf = gpd.read_parquet(path, columns=columns, bbox=bbox)
+    return gdf.drop(columns="bbox", errors="ignore")
+
+
+def export_layer(name, fmt, store_dir=DEFAULT_STORE_DIR, export_dir=DEFAULT_EXPORT_DIR):
+    """
+    Path to a GPKG/GeoJSON/CSV export of layer ``name``, generated on first use and
+    regenerated whenever the GeoParquet copy is newer.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}, expected one of {EXPORT_FORMATS}")
+    source = layer_path(name, store_dir)
+    target = os.path.join(export_dir, f"{name}.{fmt}")
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+        return target
+    os.makedirs(export_dir, exist_ok=True)
+    gdf = read_layer(name, store_dir=store_dir)
+    tmp = os.path.join(export_dir, f".{name}.tmp.{fmt}")
+    if fmt == "csv":
+        gdf.drop(columns="geometry").to_csv(tmp, index=False)
+    else:
+        gdf.to_file(tmp, driver="GPKG" if fmt == "gpkg" else "GeoJSON", layer=name)
+    os.replace(tmp, target)
+    return target
+
+
+def save_layers(gdf, name, out_dir=DEFAULT_STORE_DIR, exports=()):
+    """
+    Replacement for the notebooks' ``save_layers``: writes the GeoParquet copy and
+    only the ``exports`` (e.g. ``("gpkg",)``) asked for; others stay lazy.
+    """
+    path = write_layer(gdf, name, out_dir)
+    for fmt in exports:
+        export_layer(name, fmt, store_dir=out_dir)
+    return path
+
+
+def convert_legacy(name, store_dir=DEFAULT_STORE_DIR):
+    """Build the GeoParquet copy of ``name`` from its existing GPKG or GeoJSON file."""
+    for fmt in LEGACY_FORMATS:
+        path = os.path.join(store_dir, f"{name}.{fmt}")
+        if os.path.exists(path):
+            return write_layer(gpd.read_file(path), name, store_dir)
+    raise FileNotFoundError(f"no {' or '.join(LEGACY_FORMATS)} file for layer {name!r} in {store_dir}")
+
+
+def ensure_layer(name, store_dir=DEFAULT_STORE_DIR):
+    """
+    Path to the GeoParquet copy of ``name``, (re)built from its GPKG/GeoJSON file when
+    the copy is missing or older. The notebooks still write the legacy formats, so
+    a parquet copy must never be trusted over a newer legacy file.
+    """
+    path = layer_path(name, store_dir)
+    legacy = [os.path.join(store_dir, f"{name}.{fmt}") for fmt in LEGACY_FORMATS]
+    newest = max((os.path.getmtime(p) for p in legacy if os.path.exists(p)), default=None)
+    if not os.path.exists(path) or (newest is not None and newest > os.path.getmtime(path)):
+        convert_legacy(name, store_dir)
+    return path
+
+
+def benchmark(name, store_dir=DEFAULT_STORE_DIR, repeat=5):
+    """Cold-ish load time and file size of the GeoParquet copy versus the legacy GPKG."""
+    gpkg = os.path.join(store_dir, f"{name}.gpkg")
+    parquet = layer_path(name, store_dir)
+
+    def best_of(load):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            load()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    full = read_layer(name, store_dir=store_dir)
+    minx, miny, maxx, maxy = full.total_bounds
+    quarter = (minx, miny, (minx + maxx) / 2, (miny + maxy) / 2)
+    return {
+        "rows": len(full),
+        "gpkg_mb": os.path.getsize(gpkg) / 1e6,
+        "parquet_mb": os.path.getsize(parquet) / 1e6,
+        "gpkg_load_s": best_of(lambda: gpd.read_file(gpkg)),
+        "parquet_load_s": best_of(lambda: read_layer(name, store_dir=store_dir)),
+        "parquet_two_columns_s": best_of(lambda: read_layer(name, ["area_m2"], store_dir=store_dir)),
+        "parquet_bbox_quarter_s": best_of(lambda: read_layer(name, bbox=quarter, store_dir=store_dir)),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    for layer in sys.argv[1:] or ["large_roofs_test"]:
+        ensure_layer(layer)
+        print(layer, benchmark(layer))
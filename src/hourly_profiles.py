@@ -0,0 +1,202 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from pvgis_cache import PVGIS_GRID_DEG, snap_to_grid
+from pvgis_utils import (DEFAULT_AZIMUTH, DEFAULT_LOSS, DEFAULT_TILT, PVGIS_SERIES_URL,
+                         PVGISError, fetch_pvgis_batch)
+
+HOURS_PER_YEAR = 8760
+DEFAULT_SERIES_YEAR = 2019
+DEFAULT_STORE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "notebooks", "data", "hourly_profiles",
+)
+PROFILE_KEY = ["lat", "lon", "tilt", "azimuth", "loss"]
+
+
+def parse_hourly_series(outputs):
+    """
+    Turn a seriescalc ``outputs`` payload into an 8760-hour per-kWp profile in kW.
+
+    29 February is dropped and several years are averaged hour-by-hour, so every
+    profile lines up on the same non-leap hour-of-year axis.
+    """
+    try:
+        hourly = outputs["hourly"]
+    except KeyError as e:
+        raise PVGISError(f"Missing hourly series in PVGIS response: {e}")
+    times = pd.to_datetime([h["time"] for h in hourly], format="%Y%m%d:%H%M")
+    power_kw = np.array([h["P"] for h in hourly], dtype=float) / 1000.0
+    keep = ~((times.month == 2) & (times.day == 29))
+    power_kw = power_kw[keep]
+    years = len(power_kw) // HOURS_PER_YEAR
+    if years == 0 or len(power_kw) % HOURS_PER_YEAR:
+        raise PVGISError(f"Unexpected hourly series length {len(hourly)}")
+    return power_kw.reshape(years, HOURS_PER_YEAR).mean(axis=0).astype(np.float32)
+
+
+class HourlyProfileStore:
+    """
+    Columnar store of hourly PV production.
+
+    Normalised per-kWp profiles live in ``profiles.f32``, a float32 memmap of shape
+    ``(n_profiles, 8760)`` with one row per (PVGIS cell, tilt, azimuth, loss).
+    ``roofs.csv`` maps every roof to a profile row and its kWp. The logical
+    ``roofs x 8760`` matrix is therefore ``kwp[:, None] * profiles[profile_row]``.
+    Aggregations reduce roofs to per-profile weights and stream the memmap in
+    row chunks, so the full matrix is never materialised.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR, chunk_rows=1024):
+        self.root = root
+        self.chunk_rows = chunk_rows
+        os.makedirs(root, exist_ok=True)
+        self._profiles_path = os.path.join(root, "profiles.f32")
+        self._profile_index_path = os.path.join(root, "profiles.csv")
+        self._roofs_path = os.path.join(root, "roofs.csv")
+        self._meta_path = os.path.join(root, "meta.json")
+        if os.path.exists(self._profile_index_path):
+            self.profile_index = pd.read_csv(self._profile_index_path)
+        else:
+            self.profile_index = pd.DataFrame(columns=PROFILE_KEY)
+        if os.path.exists(self._roofs_path):
+            self.roofs = pd.read_csv(self._roofs_path, dtype={"roof_id": str}).set_index("roof_id")
+        else:
+            self.roofs = pd.DataFrame({"profile_row": pd.Series(dtype=int), "kwp": pd.Series(dtype=float)})
+            self.roofs.index.name = "roof_id"
+        self._keys = {tuple(k): i for i, k in enumerate(self.profile_index[PROFILE_KEY].itertuples(index=False))}
+
+    @property
+    def n_profiles(self):
+        return len(self.profile_index)
+
+    @property
+    def profiles(self):
+        """Read-only memmap of all per-kWp profiles (kW), shape ``(n_profiles, 8760)``."""
+        if self.n_profiles == 0:
+            return np.zeros((0, HOURS_PER_YEAR), dtype=np.float32)
+        return np.memmap(self._profiles_path, dtype=np.float32, mode="r",
+                         shape=(self.n_profiles, HOURS_PER_YEAR))
+
+    def profile_row(self, lat, lon, tilt, azimuth, loss):
+        return self._keys.get((float(lat), float(lon), float(tilt), float(azimuth), float(loss)))
+
+    def add_profiles(self, keys, profiles):
+        """Append per-kWp profiles for new keys; returns their row numbers."""
+        profiles = np.asarray(profiles, dtype=np.float32).reshape(-1, HOURS_PER_YEAR)
+        start = self.n_profiles
+        with open(self._profiles_path, "ab") as f:
+            f.write(profiles.tobytes())
+        new = pd.DataFrame([tuple(float(v) for v in key) for key in keys], columns=PROFILE_KEY)
+        self.profile_index = pd.concat([self.profile_index, new], ignore_index=True)
+        for i, key in enumerate(new.itertuples(index=False)):
+            self._keys[tuple(key)] = start + i
+        self._flush()
+        return list(range(start, start + len(new)))
+
+    def add_roofs(self, roof_ids, profile_rows, kwp):
+        new = pd.DataFrame({"profile_row": np.asarray(profile_rows, dtype=int),
+                            "kwp": np.asarray(kwp, dtype=float)},
+                           index=pd.Index(np.asarray(roof_ids).astype(str), name="roof_id"))
+        self.roofs = pd.concat([self.roofs[~self.roofs.index.isin(new.index)], new])
+        self._flush()
+
+    def _flush(self):
+        self.profile_index.to_csv(self._profile_index_path, index=False)
+        self.roofs.reset_index().to_csv(self._roofs_path, index=False)
+        with open(self._meta_path, "w") as f:
+            json.dump({"hours": HOURS_PER_YEAR, "n_profiles": self.n_profiles,
+                       "n_roofs": len(self.roofs), "dtype": "float32"}, f)
+
+    def profile_weights(self, roof_ids=None):
+        """Installed kWp per profile row for a subset of roofs (all roofs by default)."""
+        roofs = self.roofs if roof_ids is None else self.roofs.loc[np.asarray(roof_ids).astype(str)]
+        return np.bincount(roofs["profile_row"].to_numpy(), weights=roofs["kwp"].to_numpy(),
+                           minlength=self.n_profiles)
+
+    def weighted_sum(self, weights):
+        """``weights @ profiles`` streamed over row chunks; ``weights`` may be (n_profiles,) or (k, n_profiles)."""
+        weights = np.asarray(weights, dtype=np.float64)
+        squeeze = weights.ndim == 1
+        weights = np.atleast_2d(weights)
+        out = np.zeros((weights.shape[0], HOURS_PER_YEAR))
+        profiles = self.profiles
+        for start in range(0, self.n_profiles, self.chunk_rows):
+            stop = min(start + self.chunk_rows, self.n_profiles)
+            w = weights[:, start:stop]
+            used = np.flatnonzero(w.any(axis=0))
+            if len(used):
+                out += w[:, used] @ np.asarray(profiles[start + used], dtype=np.float64)
+        return out[0] if squeeze else out
+
+    def hourly_sum(self, roof_ids=None):
+        """Total production in kW per hour of the year over a roof subset."""
+        return self.weighted_sum(self.profile_weights(roof_ids))
+
+    def peak_hour(self, roof_ids=None):
+        """``(hour_of_year, kW)`` of the highest combined production."""
+        total = self.hourly_sum(roof_ids)
+        hour = int(np.argmax(total))
+        return hour, float(total[hour])
+
+    def duration_curve(self, roof_ids=None):
+        """Combined hourly production sorted from highest to lowest."""
+        return np.sort(self.hourly_sum(roof_ids))[::-1]
+
+    def hourly_profiles(self, lat, lon, tilt_deg, azimuth_deg, loss_percent=DEFAULT_LOSS, grid_deg=PVGIS_GRID_DEG):
+        """
+        Same interface as ``OfflineYieldModel.hourly_profiles``, served from the store
+        (e.g. as the ``model`` of ``congestion.simulate_congestion``). Returns
+        ``(profiles, rows)``: the profile memmap and, per input, its row. Every
+        (cell, tilt, azimuth, loss) must have been ingested already.
+        """
+        lat, lon, tilt, azimuth, loss = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(v, dtype=float))
+              for v in (lat, lon, tilt_deg, azimuth_deg, loss_percent)))
+        if grid_deg:
+            lat, lon = snap_to_grid(lat, lon, grid_deg)
+        keys = list(zip(lat.ravel().tolist(), lon.ravel().tolist(), tilt.ravel().tolist(),
+                        azimuth.ravel().tolist(), loss.ravel().tolist()))
+        rows = [self.profile_row(*key) for key in keys]
+        missing = [key for key, row in zip(keys, rows) if row is None]
+        if missing:
+            raise KeyError(f"{len(missing)} of {len(keys)} profiles not in store {self.root} "
+                           f"(e.g. {missing[0]}); run ingest_hourly_profiles first")
+        return self.profiles, np.array(rows, dtype=np.int64)
+
+    def roof_series(self, roof_id):
+        row = self.roofs.loc[str(roof_id)]
+        return row["kwp"] * np.asarray(self.profiles[int(row["profile_row"])], dtype=np.float64)
+
+
+def ingest_hourly_profiles(store, roof_ids, lat, lon, kwp,
+                           tilt_deg=DEFAULT_TILT,
+                           azimuth_deg=DEFAULT_AZIMUTH,
+                           loss_percent=DEFAULT_LOSS,
+                           grid_deg=PVGIS_GRID_DEG,
+                           year=DEFAULT_SERIES_YEAR,
+                           url=PVGIS_SERIES_URL,
+                           **batch_kwargs):
+    """
+    Fetch seriescalc profiles for every PVGIS cell not yet in ``store`` and register
+    the roofs against them. Roofs in the same cell and orientation share one profile,
+    so only distinct cells hit the network. Returns the number of profiles fetched.
+    """
+    lat, lon, kwp, tilt, azimuth, loss = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(v, dtype=float))
+          for v in (lat, lon, kwp, tilt_deg, azimuth_deg, loss_percent)))
+    cell_lat, cell_lon = snap_to_grid(lat, lon, grid_deg) if grid_deg else (lat, lon)
+    keys = list(zip(cell_lat.tolist(), cell_lon.tolist(), tilt.tolist(), azimuth.tolist(), loss.tolist()))
+    missing = sorted({key for key in keys if store.profile_row(*key) is None})
+    if missing:
+        queries = dict(zip(PROFILE_KEY, np.array(missing).T))
+        outputs = fetch_pvgis_batch(
+            queries, url=url,
+            extra_params={"pvcalculation": 1, "startyear": year, "endyear": year},
+            **batch_kwargs,
+        )
+        store.add_profiles(missing, np.stack([parse_hourly_series(o) for o in outputs]))
+    store.add_roofs(roof_ids, [store.profile_row(*key) for key in keys], kwp)
+    return len(missing)
@@ -0,0 +1,211 @@
+import hashlib
+import os
+from collections import namedtuple
+
+import pandas as pd
+
+from buildings import LARGE_ROOF_MIN_M2, TARGET_EPSG, add_area_centroid, clean_columns, geometry_hashes
+from pvgis_utils import estimate_potential_batch
+from wfs_download import GRB_WFS_LAYER, GRB_WFS_URL, WFSStagingStore, download_wfs, remove_staging
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "notebooks", "data", "buildings_snapshot.gpkg",
+)
+DEFAULT_STAGING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "notebooks", "cache")
+KEY_COL = "object_id"
+VERSION_COL = "VersieId"
+HASH_COL = "geom_hash"
+
+SnapshotDiff = namedtuple("SnapshotDiff", ["new", "changed", "unchanged", "removed"])
+
+
+def with_geometry_hash(g):
+    """``g`` with a ``geom_hash`` column (see :func:`buildings.geometry_hashes`)."""
+    if HASH_COL in g and g[HASH_COL].notna().all():
+        return g
+    g = g.copy()
+    g[HASH_COL] = geometry_hashes(g.geometry)
+    return g
+
+
+def latest_versions(g, key=KEY_COL, version_col=VERSION_COL):
+    """One row per ``key``: the one with the latest ``version_col``."""
+    if not g[key].duplicated().any():
+        return g
+    return g.sort_values(version_col, kind="stable").drop_duplicates(key, keep="last")
+
+
+def diff_snapshots(previous, current, key=KEY_COL, version_col=VERSION_COL, complete=True):
+    """
+    Compare two cleaned building tables by ``key`` + ``version_col`` + geometry hash.
+
+    Returns a ``SnapshotDiff`` of key indexes. A building counts as changed when its
+    version or its geometry differs. ``removed`` is only filled when ``current`` is a
+    ``complete`` snapshot rather than a set of changes.
+    """
+    prev = with_geometry_hash(previous).set_index(key)[[version_col, HASH_COL]]
+    cur = with_geometry_hash(current).set_index(key)[[version_col, HASH_COL]]
+    both = cur.index.intersection(prev.index)
+    p, c = prev.loc[both], cur.loc[both]
+    same = ((p[version_col].to_numpy() == c[version_col].to_numpy())
+            & (p[HASH_COL].to_numpy() == c[HASH_COL].to_numpy()))
+    removed = prev.index.difference(cur.index) if complete else prev.index[:0]
+    return SnapshotDiff(cur.index.difference(prev.index), both[~same], both[same], removed)
+
+
+def since_version(previous, version_col=VERSION_COL):
+    """
+    ISO timestamp to request changes after. One second is taken off the newest
+    version in ``previous`` so buildings saved in that same second are not missed;
+    re-fetching an unchanged building only costs a hash comparison.
+    """
+    latest = pd.to_datetime(previous[version_col], utc=True, errors="coerce").max()
+    return (latest - pd.Timedelta(seconds=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def derive_buildings(g, yield_source=None, cache=None, predict=None, min_area_m2=LARGE_ROOF_MIN_M2):
+    """
+    Derived columns for a set of (new or changed) buildings: area and centroid for
+    all, PV estimates (see :func:`pvgis_utils.estimate_potential_batch`) and, when a
+    ``predict`` callable is given, its AI predictions for roofs of at least
+    ``min_area_m2``. ``predict`` takes a GeoDataFrame and returns a Series or
+    DataFrame with the same index.
+    """
+    g = add_area_centroid(g)
+    large = g["area_m2"] >= min_area_m2
+    if large.any():
+        pv = estimate_potential_batch(g[large], yield_source=yield_source, cache=cache)
+        g = g.join(pv.drop(columns="roof_area_m2"))
+        if predict is not None:
+            g = g.join(pd.DataFrame(predict(g[large])))
+    return g
+
+
+def refresh_buildings(previous, fetched, complete=False, key=KEY_COL, version_col=VERSION_COL,
+                      derive=derive_buildings, **derive_kwargs):
+    """
+    Merge freshly ``fetched`` buildings (raw WFS or cleaned) into the ``previous``
+    snapshot, running ``derive`` only on new and changed buildings.
+
+    ``fetched`` is either only the changed versions (``complete=False``) or the full
+    current set (``complete=True``, which also drops buildings that disappeared).
+    Returns ``(snapshot, report)``; ``report["work_avoided"]`` is the share of the
+    snapshot that did not need recomputing.
+    """
+    if "ObjectId" in fetched.columns:
+        fetched = clean_columns(fetched)
+    fetched = with_geometry_hash(latest_versions(fetched, key, version_col))
+    if previous is None or len(previous) == 0:
+        previous = fetched.iloc[:0]
+    diff = diff_snapshots(previous, fetched, key, version_col, complete)
+
+    work = fetched[fetched[key].isin(diff.new.union(diff.changed))]
+    derived = derive(work, **derive_kwargs) if len(work) else work
+    kept = previous[~previous[key].isin(diff.changed.union(diff.removed))]
+    snapshot = pd.concat([kept, derived], ignore_index=True)
+    report = {
+        "previous": len(previous),
+        "fetched": len(fetched),
+        "new": len(diff.new),
+        "changed": len(diff.changed),
+        "unchanged": len(diff.unchanged),
+        "removed": len(diff.removed),
+        "recomputed": len(work),
+        "total": len(snapshot),
+        "work_avoided": 1.0 - len(work) / len(snapshot) if len(snapshot) else 1.0,
+    }
+    return snapshot, report
+
+
+def download_frame(area, staging_dir, label, epsg=TARGET_EPSG, **download_kwargs):
+    """Download into a run-specific staging store (resumable until it succeeds) and load it."""
+    name = hashlib.sha1(f"{download_kwargs.get('layer', GRB_WFS_LAYER)}|{label}".encode()).hexdigest()[:12]
+    path = os.path.join(staging_dir, f"wfs_refresh_{name}.sqlite")
+    download_wfs(area, staging_path=path, epsg=epsg, **download_kwargs)
+    with WFSStagingStore(path) as store:
+        fetched = store.to_geodataframe(epsg)
+    remove_staging(path)
+    return fetched
+
+
+def fetch_changed_buildings(area, since, staging_dir=DEFAULT_STAGING_DIR, **download_kwargs):
+    """Raw WFS buildings in ``area`` whose ``VersieId`` is later than ``since``."""
+    return download_frame(area, staging_dir, f"since {since}", changed_since=since, **download_kwargs)
+
+
+def load_snapshot(path=DEFAULT_SNAPSHOT_PATH):
+    import geopandas as gpd
+
+    return gpd.read_file(path) if os.path.exists(path) else None
+
+
+def save_snapshot(snapshot, path=DEFAULT_SNAPSHOT_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    snapshot.to_file(path, driver="GPKG")
+
+
+def incremental_refresh(area,
+                        snapshot_path=DEFAULT_SNAPSHOT_PATH,
+                        url=GRB_WFS_URL,
+                        layer=GRB_WFS_LAYER,
+                        full=False,
+                        staging_dir=DEFAULT_STAGING_DIR,
+                        download_kwargs=None,
+                        **derive_kwargs):
+    """
+    Bring the building snapshot at ``snapshot_path`` up to date.
+
+    Without a snapshot (or with ``full=True``) every building in ``area`` is
+    downloaded and only new or changed ones are recomputed; otherwise only versions
+    newer than the snapshot's latest ``VersieId`` are requested. Buildings deleted
+    from the registry are only noticed on a full refresh. ``derive_kwargs`` go to
+    :func:`derive_buildings` (e.g. ``yield_source``, ``predict``).
+    Returns ``(snapshot, report)``.
+    """
+    download_kwargs = dict(download_kwargs or {}, url=url, layer=layer)
+    previous = load_snapshot(snapshot_path)
+    complete = previous is None or full
+    if complete:
+        fetched = download_frame(area, staging_dir, "full", **download_kwargs)
+    else:
+        fetched = fetch_changed_buildings(area, since_version(previous), staging_dir, **download_kwargs)
+    snapshot, report = refresh_buildings(previous, fetched, complete=complete, **derive_kwargs)
+    save_snapshot(snapshot, snapshot_path)
+    report["mode"] = "full" if complete else "changes"
+    return snapshot, report
+
+
+if __name__ == "__main__":
+    import copy
+    import tempfile
+    import time
+
+    import numpy as np
+
+    from pv_model import OfflineYieldModel
+    from wfs_stub import VERSION_EPOCH, WFSStubServer, synthetic_buildings, version_timestamp
+
+    features = synthetic_buildings()
+    model = OfflineYieldModel()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapshot.gpkg")
+        with WFSStubServer(features) as stub:
+            start = time.perf_counter()
+            _, report = incremental_refresh(stub.extent, path, url=stub.wfs_url, staging_dir=tmp, yield_source=model)
+            print(f"initial ({time.perf_counter() - start:.1f}s):", report)
+
+        rng = np.random.default_rng(1)
+        features = copy.deepcopy(features)
+        now = version_timestamp(VERSION_EPOCH + pd.Timedelta(days=3700))
+        for i in rng.choice(len(features), len(features) // 50, replace=False):
+            features[i]["properties"]["VersieId"] = now
+            features[i]["geometry"]["coordinates"][0][2][0] += 1.0
+            features[i]["geometry"]["coordinates"][0][1][0] += 1.0
+        features += synthetic_buildings(200, seed=2)
+        for i, f in enumerate(features[-200:]):
+            f["id"], f["properties"]["ObjectId"] = f"Gebouw.{20_000_000 + i}", 20_000_000 + i
+            f["properties"]["VersieId"] = now
+        with WFSStubServer(features) as stub:
+            start = time.perf_counter()
+            _, report = incremental_refresh(stub.extent, path, url=stub.wfs_url, staging_dir=tmp, yield_source=model)
+            print(f"incremental ({time.perf_counter() - start:.1f}s):", report)
@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from pvgis_cache import PVGIS_GRID_DEG, snap_to_grid
+from pvgis_utils import (CO2_KG_PER_KWH, DEFAULT_LOSS, FILL_FACTOR, WP_PER_M2,
+                         _columnar_roofs, pvgis_yield_source)
+
+
+@dataclass(frozen=True)
+class Layout:
+    """
+    A panel layout: one tilt and one or more azimuths sharing the array equally
+    (e.g. east-west rows are ``azimuths=(-90, 90)``).
+    """
+    name: str
+    tilt_deg: float
+    azimuths: tuple = (0,)
+    fill_factor: float = FILL_FACTOR
+
+
+SOUTH = Layout("south", 30, (0,))
+EAST_WEST = Layout("ew", 10, (-90, 90))
+FLAT = Layout("flat", 0, (0,))
+DEFAULT_LAYOUTS = (SOUTH, EAST_WEST, FLAT)
+
+
+class LayoutEngine:
+    """
+    Evaluates a set of layouts for many roofs at once.
+
+    Specific yield is memoised per (PVGIS cell, tilt, azimuth): every distinct query
+    is sent to the yield source once, across layouts, roofs and repeated calls.
+    ``requested`` counts the queries a per-roof, per-layout loop would have made and
+    ``issued`` the ones that actually reached the yield source.
+    """
+
+    def __init__(self, yield_source=None, cache=None, grid_deg=PVGIS_GRID_DEG, loss_percent=DEFAULT_LOSS):
+        self.yield_source = yield_source if yield_source is not None else pvgis_yield_source(cache=cache)
+        self.grid_deg = grid_deg
+        self.loss_percent = loss_percent
+        self.memo = {}
+        self.requested = 0
+        self.issued = 0
+
+    def _specific_yields(self, cell_lat, cell_lon, tilt, azimuth):
+        keys = np.column_stack([cell_lat, cell_lon, np.full(len(cell_lat), tilt), np.full(len(cell_lat), azimuth)])
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        self.requested += len(keys)
+        missing = [i for i, key in enumerate(map(tuple, unique)) if key not in self.memo]
+        if missing:
+            q = unique[missing]
+            values = self.yield_source(q[:, 0], q[:, 1], q[:, 2], q[:, 3], self.loss_percent)
+            self.issued += len(missing)
+            for key, value in zip(map(tuple, q), np.asarray(values, dtype=float)):
+                self.memo[key] = value
+        unique_values = np.array([self.memo[key] for key in map(tuple, unique)])
+        return unique_values[np.ravel(inverse)]
+
+    def evaluate(self, data=None, layouts=DEFAULT_LAYOUTS, lat=None, lon=None, area_m2=None,
+                 area_col="area_m2", wp_per_m2=WP_PER_M2, co2_kg_per_kwh=CO2_KG_PER_KWH):
+        """
+        Return ``{layout}_usable_panel_area_m2/_kwp/_specific_yield/_kwh_year/_co2_tons_year``
+        for every layout plus ``best_layout``, ``best_kwh_year`` and ``best_co2_tons_year``.
+        """
+        if not layouts:
+            raise ValueError("need at least one layout")
+        index, lat, lon, area = _columnar_roofs(data, lat, lon, area_m2, area_col)
+        if self.grid_deg:
+            cell_lat, cell_lon = snap_to_grid(lat, lon, self.grid_deg)
+        else:
+            cell_lat, cell_lon = lat, lon
+        columns = {}
+        kwh = np.empty((len(layouts), len(area)))
+        for i, layout in enumerate(layouts):
+            specific_yield = np.mean(
+                [self._specific_yields(cell_lat, cell_lon, layout.tilt_deg, az) for az in layout.azimuths],
+                axis=0,
+            )
+            usable = area * layout.fill_factor
+            kwp = usable * (wp_per_m2 / 1000.0)
+            kwh[i] = kwp * specific_yield
+            columns[f"{layout.name}_usable_panel_area_m2"] = usable
+            columns[f"{layout.name}_kwp"] = kwp
+            columns[f"{layout.name}_specific_yield"] = specific_yield
+            columns[f"{layout.name}_kwh_year"] = kwh[i]
+            columns[f"{layout.name}_co2_tons_year"] = kwh[i] * (co2_kg_per_kwh / 1000.0)
+        best = np.argmax(kwh, axis=0)
+        best_kwh = kwh[best, np.arange(len(area))]
+        columns["best_layout"] = np.array([layout.name for layout in layouts], dtype=object)[best]
+        columns["best_kwh_year"] = best_kwh
+        columns["best_co2_tons_year"] = best_kwh * (co2_kg_per_kwh / 1000.0)
+        return pd.DataFrame(columns, index=index)
+
+    def report(self):
+        return {
+            "requested": self.requested,
+            "issued": self.issued,
+            "saved": self.requested - self.issued,
+            "memoised": len(self.memo),
+        }
+
+
+def evaluate_layouts(data=None, layouts=DEFAULT_LAYOUTS, yield_source=None, cache=None, **kwargs):
+    """One-shot :meth:`LayoutEngine.evaluate`; returns ``(columns, report)``."""
+    engine = LayoutEngine(yield_source=yield_source, cache=cache)
+    columns = engine.evaluate(data, layouts, **kwargs)
+    return columns, engine.report()
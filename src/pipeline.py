@@ -0,0 +1,483 @@
+"""
+Rooftop pipeline as a DAG of cached stages.
+
+    python src/pipeline.py run                       # run what is out of date
+    python src/pipeline.py run --until candidates    # stop after a stage
+    python src/pipeline.py run --set large_roof_min_m2=600 --publish top200_pipeline
+    python src/pipeline.py status                    # show which stages are cached
+
+Every stage output is stored under ``notebooks/cache/pipeline/<stage>-<key>.parquet``
+where ``key`` is a SHA-1 over the stage's code, its parameters, the contents of
+the files it reads and the keys of its inputs, so a change anywhere only re-runs
+the stages downstream of it. Stages whose inputs are ready run in parallel.
+"""
+import argparse
+import hashlib
+import importlib.metadata
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from buildings import LARGE_ROOF_MIN_M2, TARGET_EPSG, clean_columns
+from pvgis_utils import FILL_FACTOR
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+NOTEBOOKS_DIR = os.path.join(SRC_DIR, os.pardir, "notebooks")
+DEFAULT_CACHE_DIR = os.path.join(NOTEBOOKS_DIR, "cache", "pipeline")
+PIPELINE_JOBS = 4
+DEDUP_LOG_ROWS = 20
+
+
+def _ai_runtime():
+    """Installed torch/torchvision versions, so the ai stage re-runs once they change or appear."""
+    versions = []
+    for name in ("torch", "torchvision"):
+        try:
+            versions.append(f"{name} {importlib.metadata.version(name)}")
+        except importlib.metadata.PackageNotFoundError:
+            versions.append(f"{name} missing")
+    return ", ".join(versions)
+
+
+DEFAULT_PARAMS = {
+    "place": "Leuven, Belgium",
+    "boundary_path": os.path.join(NOTEBOOKS_DIR, "data", "leuven_boundary.gpkg"),
+    "wfs_url": "https://geo.api.vlaanderen.be/Gebouwenregister/wfs",
+    "wfs_layer": "Gebouwenregister:Gebouw",
+    "wfs_tile_m": 2000.0,
+    "wfs_snapshot": "",  # change (e.g. to a date) to force a fresh download
+    "large_roof_min_m2": LARGE_ROOF_MIN_M2,
+    "fill_factor": FILL_FACTOR,
+    "yield_engine": "pvgis",  # or "offline" for pv_model.OfflineYieldModel
+    "address_points_path": os.path.join(NOTEBOOKS_DIR, "data", "address_points.gpkg"),
+    "address_csv": os.path.join(NOTEBOOKS_DIR, "data", "500_large_with_pv_geocoded.csv"),
+    "model_path": os.path.join(NOTEBOOKS_DIR, "rooftop_classifier_resnet18.pth"),
+    "ai_runtime": _ai_runtime(),
+    "zones_path": os.path.join(NOTEBOOKS_DIR, "data", "grid_zones.gpkg"),  # square cells if missing
+    "weight_area": 0.4,
+    "weight_yield": 0.4,
+    "weight_orient": 0.2,
+    "top_n": 200,
+}
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One pipeline step. ``func`` receives the outputs of ``inputs`` positionally and
+    ``params`` as keyword arguments, plus ``log`` if it accepts one; parameters listed in ``files`` are paths whose
+    contents are hashed into the cache key. ``modules`` are the ``src`` or ``notebooks``
+    modules the stage relies on, whose source counts as part of the code version
+    (read from disk, not imported, so e.g. the torch modules hash without torch).
+    """
+    name: str
+    func: object
+    inputs: tuple = ()
+    params: tuple = ()
+    files: tuple = ()
+    modules: tuple = ()
+
+
+# --- stages ---
+
+def boundary_stage(place, boundary_path):
+    if boundary_path and os.path.exists(boundary_path):
+        g = gpd.read_file(boundary_path)
+    else:
+        import osmnx as ox
+        g = ox.geocode_to_gdf(place)
+    return g.to_crs(TARGET_EPSG).dissolve().reset_index(drop=True)[["geometry"]]
+
+
+def wfs_stage(boundary, wfs_url, wfs_layer, wfs_tile_m, wfs_snapshot):
+    from incremental_refresh import DEFAULT_STAGING_DIR, download_frame
+
+    return download_frame(boundary, DEFAULT_STAGING_DIR, f"pipeline {wfs_snapshot}",
+                          url=wfs_url, layer=wfs_layer, tile_m=wfs_tile_m)
+
+
+def clean_stage(raw):
+    return clean_columns(raw, drop_invalid=False)
+
+
+def area_stage(buildings, log=print):
+    from geometry_prep import prepare_buildings
+
+    prepared, report = prepare_buildings(buildings)
+    log(f"geometry prep: {report['valid']} valid, {report['repaired']} repaired, "
+        f"{report['dropped']} dropped ({report['workers']} workers, {report['seconds']:.1f}s)")
+    return prepared
+
+
+def clip_stage(buildings, boundary, log=print):
+    from boundary_clip import clip_to_boundary
+
+    inside, report = clip_to_boundary(buildings, boundary)
+    log(f"boundary clip: {report['inside']} inside, {report['crossing']} crossing, "
+        f"{report['outside']} outside dropped ({report['outside_candidates']} large roofs "
+        f"spared PV/AI work, {report['seconds']:.1f}s)")
+    return inside
+
+
+def dedup_stage(buildings, log=print):
+    from dedup import dedup_versions
+
+    kept, merged = dedup_versions(buildings)
+    log(f"dedup: {len(merged)} overlapping versions merged into {merged['kept'].nunique()} buildings "
+        f"({merged.attrs['seconds']:.1f}s)")
+    for row in merged.head(DEDUP_LOG_ROWS).itertuples(index=False):
+        log(f"  {row.dropped} ({row.dropped_status}) -> {row.kept} ({row.kept_status}), IoU {row.iou:.2f}")
+    if len(merged) > DEDUP_LOG_ROWS:
+        log(f"  ... {len(merged) - DEDUP_LOG_ROWS} more, see the merged_from column")
+    return kept
+
+
+def candidates_stage(buildings, large_roof_min_m2):
+    c = buildings[buildings["area_m2"] >= large_roof_min_m2].copy()
+    c["rank_area"] = c["area_m2"].rank(ascending=False, method="dense").astype(int)
+    return c.sort_values("rank_area", kind="stable")
+
+
+def pv_stage(candidates, fill_factor, yield_engine):
+    from layouts import DEFAULT_LAYOUTS, evaluate_layouts
+    from pvgis_cache import PVGISCache
+    from pvgis_utils import estimate_potential_batch, pvgis_yield_source
+
+    if yield_engine == "offline":
+        from pv_model import OfflineYieldModel
+        source = OfflineYieldModel()
+    else:
+        source = pvgis_yield_source(cache=PVGISCache())
+    pv = estimate_potential_batch(candidates, fill_factor=fill_factor, yield_source=source)
+    layouts = tuple(replace(layout, fill_factor=fill_factor) for layout in DEFAULT_LAYOUTS)
+    columns, _ = evaluate_layouts(candidates, layouts, yield_source=source)
+    return pv.drop(columns="roof_area_m2").join(columns)
+
+
+def congestion_stage(candidates, pv, boundary, zones_path, log=print):
+    from congestion import grid_zones, load_zones, simulate_congestion
+
+    zones = load_zones(zones_path) if os.path.exists(zones_path) else grid_zones(boundary)
+    roofs = candidates[["centroid_x", "centroid_y", "area_m2"]].join(pv[["south_kwp"]])
+    _, report, _ = simulate_congestion(roofs, zones)
+    overloaded = report[report["overload_hours"] > 0]
+    log(f"congestion: {len(overloaded)} of {len(report)} zones overloaded, "
+        f"{int(report['overload_hours'].max())} h worst ({report.attrs['seconds']:.1f}s)")
+    return report
+
+
+def orientation_stage(candidates):
+    from orientation import footprint_orientation
+
+    return footprint_orientation(candidates.geometry)
+
+
+def geocode_stage(buildings, address_points_path, address_csv, log=print):
+    if address_points_path and os.path.exists(address_points_path):
+        from address_index import geocode_buildings
+
+        found = geocode_buildings(buildings, address_points_path)
+        log(f"geocode: {found['address'].notna().sum()} of {len(found)} buildings addressed "
+            f"({found.attrs['looked_up']} looked up, {found.attrs['seconds']:.1f}s)")
+        return found
+    address = pd.Series(pd.NA, index=buildings.index, dtype="string", name="address")
+    if address_csv and os.path.exists(address_csv):
+        known = pd.read_csv(address_csv, usecols=["src_id", "address"], dtype=str).drop_duplicates("src_id")
+        address[:] = buildings["src_id"].astype(str).map(known.set_index("src_id")["address"])
+    return address.to_frame()
+
+
+def ai_stage(candidates, model_path, ai_runtime, log=print):
+    # Same fallback as the Top 200 page when no predictions exist.
+    unknown = pd.DataFrame({"roof_type": "Unknown", "ai_confidence": 0.0}, index=candidates.index)
+    if not (model_path and os.path.exists(model_path)):
+        return unknown
+    try:
+        return _predict_roof_types(candidates, model_path, log=log)
+    except ImportError as e:
+        log(f"ai: skipped, roof types set to Unknown ({e}; {ai_runtime})")
+        return unknown
+
+
+def _predict_roof_types(gdf, model_path, label_map=None, log=print):
+    import torch
+
+    if NOTEBOOKS_DIR not in sys.path:
+        sys.path.append(NOTEBOOKS_DIR)
+    from predict_rooftypes import LABEL_MAP, run_inference
+    from rooftop_dataset import RooftopDataset
+    from train_classifier import get_model
+
+    label_map = label_map or LABEL_MAP
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = get_model(num_classes=2, pretrained=False)
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.to(device).eval()
+    predictions, confidence, errors, stats = run_inference(model, RooftopDataset(gdf), device=device, progress=False)
+    log(f"ai: {stats['images_per_second']:.1f} images/s, {stats['failed']} failed")
+    return pd.DataFrame({
+        "roof_type_id": predictions,
+        "roof_type": [label_map[p] for p in predictions],
+        "ai_confidence": confidence,
+        "ai_error": errors,
+    }, index=gdf.index)
+
+
+def top_stage(candidates, pv, orientation, geocode, ai, weight_area, weight_yield, weight_orient, top_n):
+    from scoring import top_k_scores
+
+    merged = candidates.join(pv).join(orientation).join(geocode).join(ai)
+    return top_k_scores(merged, k=top_n, weight_area=weight_area, weight_yield=weight_yield,
+                        weight_orient=weight_orient, dtype=np.float64)
+
+
+STAGES = (
+    Stage("boundary", boundary_stage, params=("place", "boundary_path"), files=("boundary_path",)),
+    Stage("wfs", wfs_stage, ("boundary",), ("wfs_url", "wfs_layer", "wfs_tile_m", "wfs_snapshot"),
+          modules=("wfs_download", "incremental_refresh")),
+    Stage("clean", clean_stage, ("wfs",), modules=("buildings",)),
+    Stage("area", area_stage, ("clean",), modules=("geometry_prep",)),
+    Stage("clip", clip_stage, ("area", "boundary"), modules=("boundary_clip",)),
+    Stage("dedup", dedup_stage, ("clip",), modules=("dedup",)),
+    Stage("candidates", candidates_stage, ("dedup",), ("large_roof_min_m2",)),
+    Stage("pv", pv_stage, ("candidates",), ("fill_factor", "yield_engine"),
+          modules=("pvgis_utils", "pvgis_cache", "layouts", "pv_model")),
+    Stage("congestion", congestion_stage, ("candidates", "pv", "boundary"), ("zones_path",),
+          files=("zones_path",), modules=("congestion", "pv_model")),
+    Stage("orientation", orientation_stage, ("candidates",), modules=("orientation",)),
+    Stage("geocode", geocode_stage, ("dedup",), ("address_points_path", "address_csv"),
+          files=("address_points_path", "address_csv"), modules=("address_index",)),
+    Stage("ai", ai_stage, ("candidates",), ("model_path", "ai_runtime"), files=("model_path",),
+          modules=("predict_rooftypes", "rooftop_dataset", "train_classifier", "image_store", "tile_cache",
+                   "wms_prefetch", "wms_mosaic")),
+    Stage("top", top_stage, ("candidates", "pv", "orientation", "geocode", "ai"),
+          ("weight_area", "weight_yield", "weight_orient", "top_n"), modules=("scoring",)),
+)
+
+
+# --- runner ---
+
+def _file_digest(path):
+    if not path or not os.path.exists(path):
+        return "missing"
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _code_digest(stage):
+    digest = hashlib.sha1(inspect.getsource(stage.func).encode())
+    for name in stage.modules:
+        path = os.path.join(SRC_DIR, f"{name}.py")
+        if not os.path.exists(path):
+            path = os.path.join(NOTEBOOKS_DIR, f"{name}.py")
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _write_frame(frame, path):
+    tmp = f"{path}.tmp"
+    frame.to_parquet(tmp)
+    os.replace(tmp, path)
+
+
+def _read_frame(path):
+    if b"geo" in (pq.read_schema(path).metadata or {}):
+        return gpd.read_parquet(path)
+    return pd.read_parquet(path)
+
+
+class Pipeline:
+    """
+    Runs :data:`STAGES` (or any stage tuple) with content-hash caching.
+
+    ``params`` override :data:`DEFAULT_PARAMS`. ``run`` returns the outputs of the
+    requested stages; ``report`` lists per stage whether it was cached or ran, and
+    the summary lines a ran stage sent to ``log``.
+    """
+
+    def __init__(self, stages=STAGES, params=None, cache_dir=DEFAULT_CACHE_DIR, jobs=PIPELINE_JOBS, log=print):
+        self.stages = {stage.name: stage for stage in stages}
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        self.cache_dir = cache_dir
+        self.jobs = jobs
+        self.log = log
+        self.report = {}
+        self._keys = {}
+        self._outputs = {}
+        self._lock = threading.Lock()
+        unknown = {p for s in stages for p in s.params} - set(self.params)
+        if unknown:
+            raise ValueError(f"stages use undefined parameters: {sorted(unknown)}")
+
+    def key(self, name):
+        if name not in self._keys:
+            stage = self.stages[name]
+            payload = {
+                "stage": name,
+                "code": _code_digest(stage),
+                "params": {p: self.params[p] for p in stage.params},
+                "files": {p: _file_digest(self.params[p]) for p in stage.files},
+                "inputs": {i: self.key(i) for i in stage.inputs},
+            }
+            self._keys[name] = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+        return self._keys[name]
+
+    def path(self, name):
+        return os.path.join(self.cache_dir, f"{name}-{self.key(name)}.parquet")
+
+    def is_cached(self, name):
+        return os.path.exists(self.path(name))
+
+    def upstream(self, targets):
+        """``targets`` and all their ancestors, in dependency order."""
+        order, seen = [], set()
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for i in self.stages[name].inputs:
+                visit(i)
+            order.append(name)
+
+        for target in targets:
+            visit(target)
+        return order
+
+    def downstream(self, names):
+        found = set(names)
+        changed = True
+        while changed:
+            changed = False
+            for stage in self.stages.values():
+                if stage.name not in found and found.intersection(stage.inputs):
+                    found.add(stage.name)
+                    changed = True
+        return found
+
+    def status(self, targets=None):
+        names = self.upstream(targets or list(self.stages))
+        return [(name, self.key(name)[:12], self.is_cached(name)) for name in names]
+
+    def _output(self, name):
+        with self._lock:
+            if name not in self._outputs:
+                self._outputs[name] = _read_frame(self.path(name))
+            return self._outputs[name]
+
+    def _run_stage(self, name):
+        stage = self.stages[name]
+        inputs = [self._output(i) for i in stage.inputs]
+        kwargs = {p: self.params[p] for p in stage.params}
+        summary = []
+        if "log" in inspect.signature(stage.func).parameters:
+            def log(message):
+                summary.append(message)
+                self.log(f"[{name}] {message}")
+            kwargs["log"] = log
+        start = time.perf_counter()
+        out = stage.func(*inputs, **kwargs)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        _write_frame(out, self.path(name))
+        with self._lock:
+            self._outputs[name] = out
+        return time.perf_counter() - start, summary
+
+    def run(self, targets=None, force=()):
+        """
+        Bring ``targets`` (default: every stage) up to date and return their outputs.
+        Stages in ``force`` and everything downstream of them are re-run even when
+        cached.
+        """
+        targets = list(targets or self.stages)
+        names = self.upstream(targets)
+        forced = self.downstream(force)
+        todo = {n for n in names if n in forced or not self.is_cached(n)}
+        for name in names:
+            if name not in todo:
+                self.report[name] = {"status": "cached", "seconds": 0.0}
+                self.log(f"[cached] {name}")
+        done = set(names) - todo
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while todo or running:
+                for name in [n for n in names if n in todo and done.issuperset(self.stages[n].inputs)]:
+                    todo.discard(name)
+                    running[pool.submit(self._run_stage, name)] = name
+                    self.log(f"[run] {name}")
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    seconds, summary = future.result()
+                    self.report[name] = {"status": "ran", "seconds": seconds, "summary": summary}
+                    self.log(f"[done] {name} ({seconds:.1f}s)")
+                    done.add(name)
+        return {name: self._output(name) for name in targets}
+
+    def clean(self, keep_current=True):
+        """Delete cached outputs, by default all but the current key of each stage."""
+        current = {os.path.basename(self.path(name)) for name in self.stages} if keep_current else set()
+        removed = 0
+        if os.path.isdir(self.cache_dir):
+            for fname in os.listdir(self.cache_dir):
+                if fname.endswith(".parquet") and fname not in current:
+                    os.remove(os.path.join(self.cache_dir, fname))
+                    removed += 1
+        return removed
+
+
+def _parse_set(items):
+    params = {}
+    for item in items or ():
+        name, _, value = item.partition("=")
+        try:
+            params[name] = json.loads(value)
+        except ValueError:
+            params[name] = value
+    return params
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Leuven rooftop pipeline")
+    parser.add_argument("command", choices=["run", "status", "clean"])
+    parser.add_argument("--until", nargs="*", help="stages to bring up to date (default: all)")
+    parser.add_argument("--force", nargs="*", default=[], help="re-run these stages and everything after them")
+    parser.add_argument("--set", nargs="*", metavar="NAME=VALUE", help="override a parameter (JSON value)")
+    parser.add_argument("--jobs", type=int, default=PIPELINE_JOBS)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--publish", metavar="LAYER", help="write the final stage to notebooks/data as a GeoParquet layer")
+    args = parser.parse_args(argv)
+
+    pipeline = Pipeline(params=_parse_set(args.set), cache_dir=args.cache_dir, jobs=args.jobs)
+    if args.command == "status":
+        for name, key, cached in pipeline.status(args.until):
+            print(f"{name:12s} {key} {'cached' if cached else 'stale'}")
+    elif args.command == "clean":
+        print(f"removed {pipeline.clean()} outdated outputs")
+    else:
+        outputs = pipeline.run(args.until, force=args.force)
+        if args.publish:
+            from geostore import write_layer
+
+            final = outputs[(args.until or list(pipeline.stages))[-1]]
+            print("published", write_layer(final, args.publish))
+        ran = sum(r["status"] == "ran" for r in pipeline.report.values())
+        print(f"{ran} of {len(pipeline.report)} stages ran")
+
+
+if __name__ == "__main__":
+    main()
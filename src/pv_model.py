@@ -0,0 +1,214 @@
+import time
+
+import numpy as np
+
+from pvgis_cache import PVGIS_GRID_DEG, snap_to_grid
+from pvgis_utils import DEFAULT_LOSS, PVGIS_API_VERSION
+
+HOURS_PER_YEAR = 8760
+SOLAR_CONSTANT = 1367.0
+GROUND_ALBEDO = 0.2
+OVERCAST_FRACTION = 0.25
+
+# Ratio of typical-year to clear-sky global irradiance per month for central Belgium
+# (Uccle climatology), applied to the Haurwitz clear-sky model.
+MONTHLY_CLEARNESS = np.array([0.43, 0.49, 0.55, 0.61, 0.62, 0.61,
+                              0.62, 0.61, 0.58, 0.52, 0.45, 0.41])
+
+# Plane-of-array kWh/m2 -> kWh/kWp before the system loss. Absorbs the bias of the
+# typical-year model against PVGIS (SARAH irradiance, temperature and spectral
+# effects); set so that 30 deg south in Leuven reproduces the PVGIS value in
+# 200_large_with_pv.csv (1076.43 kWh/kWp at 14% loss).
+DEFAULT_CALIBRATION = 1.0894
+CHUNK_ORIENTATIONS = 256
+
+
+def _sun_position(lat, lon):
+    """Cosine of the zenith angle and solar azimuth (deg from north) for every UTC hour of a non-leap year.
+
+    ``lat``/``lon`` are arrays of shape (n,); results have shape (n, 8760).
+    """
+    hours = np.arange(HOURS_PER_YEAR) + 0.5
+    doy = hours // 24 + 1
+    hour = hours % 24
+    gamma = 2 * np.pi / 365 * (doy - 1 + (hour - 12) / 24)
+    eqtime = 229.18 * (0.000075 + 0.001868 * np.cos(gamma) - 0.032077 * np.sin(gamma)
+                       - 0.014615 * np.cos(2 * gamma) - 0.040849 * np.sin(2 * gamma))
+    decl = (0.006918 - 0.399912 * np.cos(gamma) + 0.070257 * np.sin(gamma)
+            - 0.006758 * np.cos(2 * gamma) + 0.000907 * np.sin(2 * gamma)
+            - 0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma))
+    lat_r = np.radians(np.asarray(lat, dtype=float))[:, None]
+    true_solar_min = hour * 60 + eqtime + 4 * np.asarray(lon, dtype=float)[:, None]
+    ha = np.radians(true_solar_min / 4 - 180)
+    cos_z = np.sin(lat_r) * np.sin(decl) + np.cos(lat_r) * np.cos(decl) * np.cos(ha)
+    azimuth = np.degrees(np.arctan2(np.sin(ha), np.cos(ha) * np.sin(lat_r) - np.tan(decl) * np.cos(lat_r))) + 180
+    return cos_z, azimuth
+
+
+def _typical_year_irradiance(cos_z):
+    """
+    Global, direct-normal and diffuse horizontal irradiance (W/m2) for a typical year.
+
+    Each month mixes clear-sky hours (Haurwitz GHI, Erbs beam/diffuse split) with
+    fully overcast hours (``OVERCAST_FRACTION`` of clear-sky GHI, all diffuse) so the
+    monthly mean matches ``MONTHLY_CLEARNESS``.
+    """
+    doy = np.arange(HOURS_PER_YEAR) // 24 + 1
+    month = np.minimum(((doy - 1) * 12) // 365, 11)
+    extra = SOLAR_CONSTANT * (1 + 0.033 * np.cos(2 * np.pi * doy / 365))
+    up = cos_z > 0.01
+    mu = np.where(up, cos_z, 1.0)
+    clear_ghi = np.where(up, 1098.0 * mu * np.exp(-0.059 / mu), 0.0)
+    kt = np.clip(clear_ghi / (extra * mu), 0.0, 1.0)
+    clear_diffuse_fraction = np.where(
+        kt <= 0.22, 1 - 0.09 * kt,
+        np.where(kt <= 0.8,
+                 0.9511 - 0.1604 * kt + 4.388 * kt ** 2 - 16.638 * kt ** 3 + 12.336 * kt ** 4,
+                 0.165))
+    clear_share = (MONTHLY_CLEARNESS[month] - OVERCAST_FRACTION) / (1.0 - OVERCAST_FRACTION)
+    ghi = clear_ghi * MONTHLY_CLEARNESS[month]
+    dhi = clear_share * clear_ghi * clear_diffuse_fraction + (1 - clear_share) * OVERCAST_FRACTION * clear_ghi
+    dni = np.where(up, (ghi - dhi) / mu, 0.0)
+    return ghi, dni, dhi
+
+
+def plane_of_array_hourly(lat, lon, tilt_deg, azimuth_deg, albedo=GROUND_ALBEDO):
+    """
+    Hourly plane-of-array irradiance (W/m2), shape (n, 8760), with isotropic-sky
+    transposition. ``azimuth_deg`` uses the PVGIS ``aspect`` convention (0 = south).
+    """
+    lat, lon, tilt, aspect = (np.atleast_1d(np.asarray(v, dtype=float))
+                              for v in np.broadcast_arrays(lat, lon, tilt_deg, azimuth_deg))
+    cos_z, sun_azimuth = _sun_position(lat, lon)
+    ghi, dni, dhi = _typical_year_irradiance(cos_z)
+    beta = np.radians(tilt)[:, None]
+    surface_azimuth = np.radians(180.0 + aspect)[:, None]
+    sin_z = np.sqrt(np.clip(1 - cos_z ** 2, 0.0, 1.0))
+    cos_aoi = cos_z * np.cos(beta) + sin_z * np.sin(beta) * np.cos(np.radians(sun_azimuth) - surface_azimuth)
+    beam = dni * np.clip(cos_aoi, 0.0, None)
+    sky = dhi * (1 + np.cos(beta)) / 2
+    ground = ghi * albedo * (1 - np.cos(beta)) / 2
+    return beam + sky + ground
+
+
+class OfflineYieldModel:
+    """
+    Pure-NumPy PV yield model used when PVGIS is slow or unreachable.
+
+    Typical-year irradiance comes from a clear-sky model scaled by monthly
+    clearness, transposed to each tilt/azimuth, and converted to kWh/kWp with a
+    calibration factor and the same percentage system loss PVGIS uses. Roofs are
+    grouped by PVGIS cell and orientation, so a city costs as many evaluations as
+    it has distinct (cell, tilt, azimuth) combinations.
+
+    Instances follow the yield-source signature and can be passed to
+    ``estimate_potential``, ``estimate_potential_batch`` or ``LayoutEngine``.
+    """
+
+    def __init__(self, calibration=DEFAULT_CALIBRATION, grid_deg=PVGIS_GRID_DEG,
+                 chunk=CHUNK_ORIENTATIONS):
+        self.calibration = calibration
+        self.grid_deg = grid_deg
+        self.chunk = chunk
+
+    def _unique(self, lat, lon, tilt_deg, azimuth_deg, loss_percent):
+        shape = np.broadcast(lat, lon, tilt_deg, azimuth_deg, loss_percent).shape
+        lat, lon, tilt, azimuth, loss = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(v, dtype=float))
+              for v in (lat, lon, tilt_deg, azimuth_deg, loss_percent)))
+        if self.grid_deg:
+            lat, lon = snap_to_grid(lat, lon, self.grid_deg)
+        keys = np.column_stack([lat.ravel(), lon.ravel(), tilt.ravel(), azimuth.ravel()])
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        return unique, np.ravel(inverse), loss.ravel(), shape
+
+    def _profiles(self, unique):
+        for start in range(0, len(unique), self.chunk):
+            q = unique[start:start + self.chunk]
+            poa = plane_of_array_hourly(q[:, 0], q[:, 1], q[:, 2], q[:, 3])
+            yield start, poa * (self.calibration / 1000.0)
+
+    def __call__(self, lat, lon, tilt_deg, azimuth_deg, loss_percent=DEFAULT_LOSS):
+        """Specific yield in kWh/kWp/year."""
+        unique, inverse, loss, shape = self._unique(lat, lon, tilt_deg, azimuth_deg, loss_percent)
+        annual = np.empty(len(unique))
+        for start, profiles in self._profiles(unique):
+            annual[start:start + len(profiles)] = profiles.sum(axis=1)
+        return (annual[inverse] * (1.0 - loss / 100.0)).reshape(shape)
+
+    def hourly_profiles(self, lat, lon, tilt_deg, azimuth_deg, loss_percent=DEFAULT_LOSS):
+        """
+        Per-kWp hourly production (kW) for every distinct (cell, tilt, azimuth, loss).
+
+        Returns ``(profiles, rows)``: a float32 ``(n_unique, 8760)`` array and, per input
+        roof, the row of ``profiles`` it uses.
+        """
+        lat, lon, tilt, azimuth, loss = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(v, dtype=float))
+              for v in (lat, lon, tilt_deg, azimuth_deg, loss_percent)))
+        if self.grid_deg:
+            lat, lon = snap_to_grid(lat, lon, self.grid_deg)
+        keys = np.column_stack([lat.ravel(), lon.ravel(), tilt.ravel(), azimuth.ravel(), loss.ravel()])
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        out = np.empty((len(unique), HOURS_PER_YEAR), dtype=np.float32)
+        for start, profiles in self._profiles(unique[:, :4]):
+            stop = start + len(profiles)
+            out[start:stop] = profiles * (1.0 - unique[start:stop, 4:5] / 100.0)
+        return out, np.ravel(inverse)
+
+    def calibrate(self, lat, lon, tilt_deg, azimuth_deg, loss_percent, pvgis_yield):
+        """
+        Least-squares fit of the calibration factor to PVGIS specific yields.
+        Returns relative error statistics after the fit.
+        """
+        pvgis_yield = np.asarray(pvgis_yield, dtype=float)
+        modelled = self(lat, lon, tilt_deg, azimuth_deg, loss_percent)
+        scale = float(np.dot(modelled, pvgis_yield) / np.dot(modelled, modelled))
+        self.calibration *= scale
+        rel = np.abs(modelled * scale - pvgis_yield) / pvgis_yield
+        return {
+            "samples": int(len(pvgis_yield)),
+            "calibration": self.calibration,
+            "mean_rel": float(rel.mean()),
+            "max_rel": float(rel.max()),
+        }
+
+    def calibrate_from_cache(self, cache, api_version=PVGIS_API_VERSION):
+        """Calibrate against every specific-yield (1 kWp) entry in a :class:`pvgis_cache.PVGISCache`."""
+        rows = [
+            (lat, lon, tilt, azimuth, loss, outputs["totals"]["fixed"]["E_y"])
+            for lat, lon, tilt, azimuth, loss, peakpower, outputs in cache.entries(api_version)
+            if peakpower == 1.0 and "E_y" in outputs.get("totals", {}).get("fixed", {})
+        ]
+        if not rows:
+            raise ValueError("PVGIS cache holds no specific-yield entries to calibrate against")
+        return self.calibrate(*np.array(rows, dtype=float).T)
+
+
+def benchmark(n_roofs=56_000, orientations=((30, 0), (10, -90), (10, 90), (0, 0)), seed=0):
+    """Roofs per second for ``n_roofs`` random Leuven roofs evaluated at every orientation."""
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(50.82, 50.95, n_roofs)
+    lon = rng.uniform(4.64, 4.77, n_roofs)
+    model = OfflineYieldModel()
+    start = time.perf_counter()
+    for tilt, azimuth in orientations:
+        model(lat, lon, tilt, azimuth)
+    elapsed = time.perf_counter() - start
+    return {"roofs": n_roofs, "orientations": len(orientations), "seconds": elapsed,
+            "roofs_per_second": n_roofs * len(orientations) / elapsed}
+
+
+if __name__ == "__main__":
+    import os
+
+    from pvgis_cache import DEFAULT_CACHE_PATH, PVGISCache
+
+    model = OfflineYieldModel()
+    print(f"30 deg south, Leuven: {float(model(50.88, 4.70, 30, 0)):.1f} kWh/kWp (PVGIS 1076.4)")
+    east, west = model(50.88, 4.70, 10, -90), model(50.88, 4.70, 10, 90)
+    print(f"10 deg east-west, Leuven: {float((east + west) / 2):.1f} kWh/kWp (PVGIS 886.1)")
+    if os.path.exists(DEFAULT_CACHE_PATH):
+        with PVGISCache(DEFAULT_CACHE_PATH, offline=True) as cache:
+            print("Calibrated against PVGIS cache:", model.calibrate_from_cache(cache))
+    print(benchmark())
@@ -0,0 +1,200 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# PVGIS irradiance (SARAH) is gridded at roughly 0.05 degrees, so every roof
+# inside the same cell returns the same yield for the same tilt/aspect/loss.
+PVGIS_GRID_DEG = 0.05
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    "notebooks", "cache", "pvgis_cache.sqlite",
+)
+DEFAULT_TTL_DAYS = 365
+DEFAULT_MAX_ENTRIES = 100_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pvcalc (
+    api_version TEXT NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    tilt REAL NOT NULL,
+    azimuth REAL NOT NULL,
+    loss REAL NOT NULL,
+    peakpower REAL NOT NULL,
+    outputs TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (api_version, lat, lon, tilt, azimuth, loss, peakpower)
+)
+"""
+
+
+def snap_to_grid(lat, lon, grid_deg=PVGIS_GRID_DEG):
+    """Snap coordinates (scalars or arrays) to the centre of their PVGIS grid cell."""
+    snapped_lat = np.round((np.floor(np.asarray(lat, dtype=float) / grid_deg) + 0.5) * grid_deg, 6)
+    snapped_lon = np.round((np.floor(np.asarray(lon, dtype=float) / grid_deg) + 0.5) * grid_deg, 6)
+    if snapped_lat.ndim == 0 and snapped_lon.ndim == 0:
+        return float(snapped_lat), float(snapped_lon)
+    return snapped_lat, snapped_lon
+
+
+class PVGISCache:
+    """
+    Persistent SQLite cache for PVGIS PVcalc responses.
+
+    Entries are keyed by the grid-snapped location plus tilt, azimuth, loss,
+    peak power and API version, and hold the full ``outputs`` payload.
+    Entries older than ``ttl_days`` are treated as stale and only served
+    when PVGIS cannot be reached (or ``offline=True``). The table is trimmed
+    to ``max_entries`` by least-recent access.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH,
+                 ttl_days=DEFAULT_TTL_DAYS,
+                 max_entries=DEFAULT_MAX_ENTRIES,
+                 grid_deg=PVGIS_GRID_DEG,
+                 offline=False):
+        self.path = path
+        self.ttl_s = None if ttl_days is None else ttl_days * 86400.0
+        self.max_entries = max_entries
+        self.grid_deg = grid_deg
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def snap(self, lat, lon):
+        if not self.grid_deg:
+            return float(lat), float(lon)
+        return snap_to_grid(lat, lon, self.grid_deg)
+
+    def _key(self, lat, lon, tilt_deg, azimuth_deg, loss_percent, peakpower_kw, api_version):
+        lat, lon = self.snap(lat, lon)
+        return (str(api_version), lat, lon, float(tilt_deg), float(azimuth_deg),
+                float(loss_percent), float(peakpower_kw))
+
+    def get(self, lat, lon, tilt_deg, azimuth_deg, loss_percent,
+            api_version, peakpower_kw=1.0, allow_stale=False, fallback=False):
+        """
+        Return the cached ``outputs`` dict, or None on a miss.
+
+        ``fallback=True`` marks a retry of a lookup that was just counted as a miss
+        (serving a stale entry because PVGIS failed), so it is not counted twice.
+        """
+        key = self._key(lat, lon, tilt_deg, azimuth_deg, loss_percent, peakpower_kw, api_version)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT outputs, created_at FROM pvcalc WHERE api_version=? AND lat=? AND lon=? "
+                "AND tilt=? AND azimuth=? AND loss=? AND peakpower=?",
+                key,
+            ).fetchone()
+            if row is None:
+                if not fallback:
+                    self.misses += 1
+                return None
+            if fallback:
+                self.misses -= 1
+            outputs, created_at = row
+            expired = self.ttl_s is not None and now - created_at > self.ttl_s
+            if expired and not (allow_stale or self.offline):
+                self.misses += 1
+                return None
+            if expired:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            self._conn.execute(
+                "UPDATE pvcalc SET accessed_at=? WHERE api_version=? AND lat=? AND lon=? "
+                "AND tilt=? AND azimuth=? AND loss=? AND peakpower=?",
+                (now,) + key,
+            )
+            self._conn.commit()
+        return json.loads(outputs)
+
+    def put(self, lat, lon, tilt_deg, azimuth_deg, loss_percent,
+            api_version, outputs, peakpower_kw=1.0):
+        key = self._key(lat, lon, tilt_deg, azimuth_deg, loss_percent, peakpower_kw, api_version)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pvcalc VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (json.dumps(outputs), now, now),
+            )
+            self._conn.commit()
+        if self.max_entries is not None and len(self) > self.max_entries:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones above ``max_entries``."""
+        removed = 0
+        with self._lock:
+            if self.ttl_s is not None and not self.offline:
+                cur = self._conn.execute(
+                    "DELETE FROM pvcalc WHERE created_at < ?", (time.time() - self.ttl_s,))
+                removed += cur.rowcount
+            if self.max_entries is not None:
+                cur = self._conn.execute(
+                    "DELETE FROM pvcalc WHERE rowid IN (SELECT rowid FROM pvcalc "
+                    "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                removed += cur.rowcount
+            self._conn.commit()
+            self.evictions += removed
+        return removed
+
+    def entries(self, api_version=None):
+        """Yield ``(lat, lon, tilt, azimuth, loss, peakpower, outputs)`` for every stored entry."""
+        query = "SELECT lat, lon, tilt, azimuth, loss, peakpower, outputs FROM pvcalc"
+        args = ()
+        if api_version is not None:
+            query += " WHERE api_version=?"
+            args = (str(api_version),)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        for lat, lon, tilt, azimuth, loss, peakpower, outputs in rows:
+            yield lat, lon, tilt, azimuth, loss, peakpower, json.loads(outputs)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pvcalc")
+            self._conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pvcalc").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
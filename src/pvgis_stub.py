@@ -0,0 +1,191 @@
+import json
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Share of the annual yield per month for a south-facing array in Leuven.
+MONTHLY_SHARE = [0.030, 0.048, 0.083, 0.115, 0.128, 0.127,
+                 0.130, 0.117, 0.091, 0.065, 0.038, 0.028]
+REFERENCE_YIELD = 1076.43  # kWh/kWp/year at 30 deg south, 14% loss
+
+
+def stub_specific_yield(lat, lon, tilt_deg, azimuth_deg, loss_percent=14):
+    """Smooth, deterministic stand-in for PVGIS E_y (kWh/kWp/year)."""
+    a = math.radians(azimuth_deg)
+    orient = 0.865 + 0.0112 * tilt_deg * math.cos(a) - 0.00013 * tilt_deg ** 2
+    orient /= 0.865 + 0.0112 * 30 - 0.00013 * 30 ** 2
+    site = 1.0 - 0.012 * (lat - 50.88) + 0.004 * (lon - 4.70)
+    losses = (1.0 - loss_percent / 100.0) / (1.0 - 0.14)
+    return REFERENCE_YIELD * orient * site * losses
+
+
+def stub_pvcalc_response(lat, lon, peakpower, loss, angle, aspect):
+    e_y = stub_specific_yield(lat, lon, angle, aspect, loss) * peakpower
+    monthly = [
+        {"month": m + 1, "E_d": e_y * share / 30.4, "E_m": e_y * share}
+        for m, share in enumerate(MONTHLY_SHARE)
+    ]
+    return {
+        "inputs": {
+            "location": {"latitude": lat, "longitude": lon},
+            "mounting_system": {"fixed": {"slope": {"value": angle}, "azimuth": {"value": aspect}}},
+            "pv_module": {"peak_power": peakpower, "system_loss": loss},
+        },
+        "outputs": {
+            "monthly": {"fixed": monthly},
+            "totals": {"fixed": {
+                "E_d": e_y / 365.0, "E_m": e_y / 12.0, "E_y": e_y,
+                "SD_m": e_y * 0.01, "SD_y": e_y * 0.04,
+                "l_total": -loss,
+            }},
+        },
+        "meta": {"stub": True},
+    }
+
+
+def stub_hourly_power(lat, lon, peakpower, loss, angle, aspect, year):
+    """Hourly AC power in W for one year, shaped by day length and scaled to the stub E_y."""
+    leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+    days = 366 if leap else 365
+    hours = []
+    shift = aspect / 30.0  # east-facing arrays peak earlier, west-facing later
+    for d in range(days):
+        day_length = 12.0 + 4.2 * math.cos(2 * math.pi * (d - 172) / days)
+        sunrise = 12.0 + shift - day_length / 2
+        seasonal = 0.35 + 0.65 * MONTHLY_SHARE[min(11, d * 12 // days)] / max(MONTHLY_SHARE)
+        for h in range(24):
+            x = (h + 0.5 - sunrise) / day_length
+            hours.append(seasonal * math.sin(math.pi * x) if 0.0 < x < 1.0 else 0.0)
+    total = sum(hours)
+    e_y_wh = stub_specific_yield(lat, lon, angle, aspect, loss) * peakpower * 1000.0
+    return [e_y_wh * v / total for v in hours]
+
+
+def stub_seriescalc_response(lat, lon, peakpower, loss, angle, aspect, startyear, endyear):
+    hourly = []
+    for year in range(startyear, endyear + 1):
+        power = stub_hourly_power(lat, lon, peakpower, loss, angle, aspect, year)
+        start = datetime(year, 1, 1)
+        for i, p in enumerate(power):
+            t = start + timedelta(hours=i)
+            hourly.append({"time": t.strftime("%Y%m%d:%H10"), "P": round(p, 2), "Int": 0.0})
+    return {
+        "inputs": {"location": {"latitude": lat, "longitude": lon}},
+        "outputs": {"hourly": hourly},
+        "meta": {"stub": True},
+    }
+
+
+class PVGISStubServer:
+    """
+    Local HTTP server emulating the PVGIS ``PVcalc`` and ``seriescalc`` JSON APIs
+    for tests and benchmarks.
+
+    ``fail_first`` requests are answered with ``fail_status`` (429 by default) to
+    exercise retry logic; ``latency_s`` adds a delay to every response.
+
+        with PVGISStubServer(latency_s=0.05) as stub:
+            fetch_pvgis_batch(df, url=stub.pvcalc_url)
+    """
+
+    def __init__(self, latency_s=0.0, fail_first=0, fail_status=429, host="127.0.0.1", port=0):
+        self.latency_s = latency_s
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.requests = 0
+        self.queries = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v5_3"
+
+    @property
+    def pvcalc_url(self):
+        return f"{self.base_url}/PVcalc"
+
+    @property
+    def seriescalc_url(self):
+        return f"{self.base_url}/seriescalc"
+
+    def _next_status(self):
+        with self._lock:
+            self.requests += 1
+            return self.fail_status if self.requests <= self.fail_first else 200
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                if stub.latency_s:
+                    time.sleep(stub.latency_s)
+                status = stub._next_status()
+                if status != 200:
+                    self._send(status, {"message": "stub failure"})
+                    return
+                try:
+                    body = stub.handle(parsed.path, query)
+                except (KeyError, ValueError) as e:
+                    self._send(400, {"message": f"bad request: {e}"})
+                    return
+                if body is None:
+                    self._send(404, {"message": "not found"})
+                    return
+                with stub._lock:
+                    stub.queries.append(query)
+                self._send(200, body)
+
+            def _send(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def handle(self, path, query):
+        if path.endswith("/PVcalc"):
+            return stub_pvcalc_response(
+                float(query["lat"]), float(query["lon"]),
+                float(query.get("peakpower", 1.0)), float(query.get("loss", 14)),
+                float(query.get("angle", 0)), float(query.get("aspect", 0)),
+            )
+        if path.endswith("/seriescalc"):
+            startyear = int(query.get("startyear", 2019))
+            return stub_seriescalc_response(
+                float(query["lat"]), float(query["lon"]),
+                float(query.get("peakpower", 1.0)), float(query.get("loss", 14)),
+                float(query.get("angle", 0)), float(query.get("aspect", 0)),
+                startyear, int(query.get("endyear", startyear)),
+            )
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,6 +1,14 @@
+import asyncio
+import random
+import threading
+import time
+
+import numpy as np
 import requests
 
 PVGIS_URL = "https://re.jrc.ec.europa.eu/api/v5_3/PVcalc"
+PVGIS_SERIES_URL = "https://re.jrc.ec.europa.eu/api/v5_3/seriescalc"
+PVGIS_API_VERSION = "v5_3"
 
 WP_PER_M2 = 190.0
 FILL_FACTOR = 0.6
@@ -9,15 +17,17 @@ DEFAULT_AZIMUTH = 0
 DEFAULT_LOSS = 14
 CO2_KG_PER_KWH = 0.23
 
+BATCH_CONCURRENCY = 8
+BATCH_RATE_PER_S = 5.0
+BATCH_MAX_RETRIES = 5
+BATCH_BACKOFF_S = 0.5
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
 class PVGISError(Exception):
     pass
 
-def get_pvgis_specific_yield(lat, lon,
-                             peakpower_kw=1.0,
-                             tilt_deg=DEFAULT_TILT,
-                             azimuth_deg=DEFAULT_AZIMUTH,
-                             loss_percent=DEFAULT_LOSS):
-    params = {
+def _pvcalc_params(lat, lon, peakpower_kw, tilt_deg, azimuth_deg, loss_percent):
+    return {
         "lat": lat, "lon": lon,
         "peakpower": peakpower_kw,
         "loss": loss_percent,
@@ -25,12 +35,66 @@ def get_pvgis_specific_yield(lat, lon,
         "aspect": azimuth_deg,
         "outputformat": "json",
     }
-    resp = requests.get(PVGIS_URL, params=params, timeout=30)
-    if resp.status_code != 200:
-        raise PVGISError(f"PVGIS error {resp.status_code}: {resp.text[:200]}")
-    data = resp.json()
+
+def fetch_pvgis_outputs(lat, lon,
+                        peakpower_kw=1.0,
+                        tilt_deg=DEFAULT_TILT,
+                        azimuth_deg=DEFAULT_AZIMUTH,
+                        loss_percent=DEFAULT_LOSS,
+                        cache=None):
+    if cache is not None:
+        lat, lon = cache.snap(lat, lon)
+        outputs = cache.get(lat, lon, tilt_deg, azimuth_deg, loss_percent,
+                            PVGIS_API_VERSION, peakpower_kw=peakpower_kw)
+        if outputs is not None:
+            return outputs
+        if cache.offline:
+            raise PVGISError(f"PVGIS offline and no cached result for ({lat}, {lon})")
+    params = _pvcalc_params(lat, lon, peakpower_kw, tilt_deg, azimuth_deg, loss_percent)
+    error = None
+    try:
+        resp = requests.get(PVGIS_URL, params=params, timeout=30)
+    except requests.RequestException as e:
+        if cache is None:
+            raise
+        error = PVGISError(f"PVGIS request failed: {e}")
+    else:
+        if resp.status_code != 200:
+            error = PVGISError(f"PVGIS error {resp.status_code}: {resp.text[:200]}")
+        else:
+            try:
+                outputs = resp.json()["outputs"]
+            except (KeyError, ValueError) as e:
+                error = PVGISError(f"Missing outputs in PVGIS response: {e}")
+    if error is not None:
+        # PVGIS down or answering garbage: serve an expired entry if we have one
+        stale = None if cache is None else cache.get(
+            lat, lon, tilt_deg, azimuth_deg, loss_percent, PVGIS_API_VERSION,
+            peakpower_kw=peakpower_kw, allow_stale=True, fallback=True)
+        if stale is None:
+            raise error
+        return stale
+    if cache is not None:
+        cache.put(lat, lon, tilt_deg, azimuth_deg, loss_percent,
+                  PVGIS_API_VERSION, outputs, peakpower_kw=peakpower_kw)
+    return outputs
+
+def get_pvgis_specific_yield(lat, lon,
+                             peakpower_kw=1.0,
+                             tilt_deg=DEFAULT_TILT,
+                             azimuth_deg=DEFAULT_AZIMUTH,
+                             loss_percent=DEFAULT_LOSS,
+                             cache=None):
+    outputs = fetch_pvgis_outputs(
+        lat, lon,
+        peakpower_kw=peakpower_kw,
+        tilt_deg=tilt_deg,
+        azimuth_deg=azimuth_deg,
+        loss_percent=loss_percent,
+        cache=cache,
+    )
     try:
-        return float(data["outputs"]["totals"]["fixed"]["E_y"])
+        return float(outputs["totals"]["fixed"]["E_y"])
     except KeyError as e:
         raise PVGISError(f"Missing E_y in PVGIS response: {e}")
 
@@ -40,16 +104,22 @@ def estimate_potential(lat, lon, area_m2,
                        tilt_deg=DEFAULT_TILT,
                        azimuth_deg=DEFAULT_AZIMUTH,
                        loss_percent=DEFAULT_LOSS,
-                       co2_kg_per_kwh=CO2_KG_PER_KWH):
+                       co2_kg_per_kwh=CO2_KG_PER_KWH,
+                       cache=None,
+                       yield_source=None):
     if area_m2 <= 0:
         raise ValueError("area_m2 must be positive")
-    specific_yield = get_pvgis_specific_yield(
-        lat, lon,
-        peakpower_kw=1.0,
-        tilt_deg=tilt_deg,
-        azimuth_deg=azimuth_deg,
-        loss_percent=loss_percent,
-    )
+    if yield_source is not None:
+        specific_yield = float(np.ravel(yield_source(lat, lon, tilt_deg, azimuth_deg, loss_percent))[0])
+    else:
+        specific_yield = get_pvgis_specific_yield(
+            lat, lon,
+            peakpower_kw=1.0,
+            tilt_deg=tilt_deg,
+            azimuth_deg=azimuth_deg,
+            loss_percent=loss_percent,
+            cache=cache,
+        )
     usable_panel_area = area_m2 * fill_factor
     kwp = usable_panel_area * wp_per_m2 / 1000.0
     kwh_year = kwp * specific_yield
@@ -62,3 +132,279 @@ def estimate_potential(lat, lon, area_m2,
         "kwh_year": float(kwh_year),
         "co2_tons": float(co2_tons),
     }
+
+class TokenBucket:
+    """Async token bucket: ``rate_per_s`` tokens per second, at most ``burst`` banked."""
+
+    def __init__(self, rate_per_s, burst=None):
+        self.rate = float(rate_per_s)
+        self.capacity = float(burst if burst is not None else max(1.0, rate_per_s))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+def _batch_queries(df, tilt_deg, azimuth_deg, loss_percent):
+    n = len(np.asarray(df["lat"]))
+    def column(name, default):
+        if name in df:
+            return np.asarray(df[name], dtype=float)
+        return np.full(n, float(default))
+    return list(zip(
+        column("lat", np.nan), column("lon", np.nan),
+        column("tilt", tilt_deg), column("azimuth", azimuth_deg), column("loss", loss_percent),
+    ))
+
+async def fetch_pvgis_batch_async(df,
+                                  tilt_deg=DEFAULT_TILT,
+                                  azimuth_deg=DEFAULT_AZIMUTH,
+                                  loss_percent=DEFAULT_LOSS,
+                                  concurrency=BATCH_CONCURRENCY,
+                                  rate_per_s=BATCH_RATE_PER_S,
+                                  max_retries=BATCH_MAX_RETRIES,
+                                  backoff_s=BATCH_BACKOFF_S,
+                                  cache=None,
+                                  url=PVGIS_URL,
+                                  timeout=30,
+                                  extra_params=None,
+                                  return_exceptions=False,
+                                  stats=None):
+    """
+    Fetch PVcalc ``outputs`` for every row of ``df`` (a DataFrame or dict of columns
+    ``lat``, ``lon`` and optionally ``tilt``, ``azimuth``, ``loss``), returned as a
+    list in input order.
+
+    At most ``concurrency`` requests are in flight and requests start at no more
+    than ``rate_per_s`` per second. 429/5xx responses and connection errors are
+    retried with exponential backoff, as are 200 responses without valid ``outputs``;
+    once retries are exhausted an expired cache entry is returned if there is one.
+    Identical queries (after grid snapping when a cache is given) are issued once
+    and shared. ``extra_params`` are added to every request, e.g. to call
+    ``seriescalc`` instead of ``PVcalc`` (do not combine that with a cache, which
+    only holds PVcalc results).
+    """
+    queries = _batch_queries(df, tilt_deg, azimuth_deg, loss_percent)
+    stats = {} if stats is None else stats
+    stats.update({"rows": len(queries), "unique": 0, "cached": 0, "stale": 0, "requests": 0, "retries": 0})
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(rate_per_s, burst=concurrency)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def get(params):
+        return session.get(url, params=params, timeout=timeout)
+
+    async def fetch_one(lat, lon, tilt, azimuth, loss):
+        if cache is not None:
+            outputs = cache.get(lat, lon, tilt, azimuth, loss, PVGIS_API_VERSION)
+            if outputs is not None:
+                stats["cached"] += 1
+                return outputs
+            if cache.offline:
+                raise PVGISError(f"PVGIS offline and no cached result for ({lat}, {lon})")
+        params = _pvcalc_params(lat, lon, 1.0, tilt, azimuth, loss)
+        params.update(extra_params or {})
+        for attempt in range(max_retries + 1):
+            retry_after = None
+            async with semaphore:
+                await bucket.acquire()
+                stats["requests"] += 1
+                try:
+                    resp = await asyncio.to_thread(get, params)
+                except requests.RequestException as e:
+                    error = PVGISError(f"PVGIS request failed: {e}")
+                else:
+                    if resp.status_code == 200:
+                        try:
+                            outputs = resp.json()["outputs"]
+                        except (KeyError, ValueError) as e:
+                            # truncated or garbled body: retried like a 5xx
+                            error = PVGISError(f"Missing outputs in PVGIS response: {e}")
+                        else:
+                            if cache is not None:
+                                cache.put(lat, lon, tilt, azimuth, loss, PVGIS_API_VERSION, outputs)
+                            return outputs
+                    else:
+                        error = PVGISError(f"PVGIS error {resp.status_code}: {resp.text[:200]}")
+                        if resp.status_code not in RETRY_STATUS:
+                            break
+                        retry_after = resp.headers.get("Retry-After")
+            if attempt == max_retries:
+                break
+            stats["retries"] += 1
+            delay = backoff_s * 2 ** attempt * (1.0 + 0.25 * random.random())
+            if retry_after is not None:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            await asyncio.sleep(delay)
+        # PVGIS down or answering garbage: serve an expired entry if we have one
+        stale = None if cache is None else cache.get(lat, lon, tilt, azimuth, loss, PVGIS_API_VERSION,
+                                                     allow_stale=True, fallback=True)
+        if stale is None:
+            raise error
+        stats["stale"] += 1
+        return stale
+
+    in_flight = {}
+    tasks = []
+    for lat, lon, tilt, azimuth, loss in queries:
+        if cache is not None:
+            lat, lon = cache.snap(lat, lon)
+        key = (lat, lon, tilt, azimuth, loss)
+        if key not in in_flight:
+            in_flight[key] = asyncio.ensure_future(fetch_one(*key))
+        tasks.append(in_flight[key])
+    stats["unique"] = len(in_flight)
+    try:
+        unique = await asyncio.gather(*in_flight.values(), return_exceptions=return_exceptions)
+    finally:
+        session.close()
+    by_task = dict(zip(in_flight.values(), unique))
+    return [by_task[task] for task in tasks]
+
+def fetch_pvgis_batch(df, **kwargs):
+    """Blocking wrapper around :func:`fetch_pvgis_batch_async` (also usable inside Jupyter)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(fetch_pvgis_batch_async(df, **kwargs))
+    # A loop is already running (e.g. in a notebook): run the batch on its own loop in a thread.
+    result = {}
+    def runner():
+        try:
+            result["value"] = asyncio.run(fetch_pvgis_batch_async(df, **kwargs))
+        except BaseException as e:
+            result["error"] = e
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+def specific_yields_from_outputs(outputs_list):
+    """Extract ``E_y`` per row from a batch result; failed rows become NaN."""
+    yields = np.full(len(outputs_list), np.nan)
+    for i, outputs in enumerate(outputs_list):
+        if isinstance(outputs, dict):
+            try:
+                yields[i] = float(outputs["totals"]["fixed"]["E_y"])
+            except KeyError:
+                pass
+    return yields
+
+def pvgis_yield_source(cache=None, fallback=None, **batch_kwargs):
+    """
+    Yield source backed by exact PVGIS values (through ``cache`` when given).
+
+    A yield source is any callable ``source(lat, lon, tilt_deg, azimuth_deg, loss_percent)``
+    taking broadcastable arrays and returning specific yields in kWh/kWp/year;
+    :class:`yield_surface.YieldSurface` and :class:`pv_model.OfflineYieldModel` follow
+    the same signature. Rows PVGIS cannot answer are filled from ``fallback`` (another
+    yield source) when given, otherwise a :class:`PVGISError` is raised.
+    """
+    def source(lat, lon, tilt_deg, azimuth_deg, loss_percent):
+        lat, lon, tilt, azimuth, loss = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(v, dtype=float))
+              for v in (lat, lon, tilt_deg, azimuth_deg, loss_percent)))
+        queries = {"lat": lat, "lon": lon, "tilt": tilt, "azimuth": azimuth, "loss": loss}
+        outputs = fetch_pvgis_batch(queries, cache=cache, return_exceptions=fallback is not None, **batch_kwargs)
+        yields = specific_yields_from_outputs(outputs)
+        failed = np.isnan(yields)
+        if fallback is not None and failed.any():
+            yields[failed] = fallback(lat[failed], lon[failed], tilt[failed], azimuth[failed], loss[failed])
+        elif failed.any():
+            raise PVGISError(f"PVGIS returned no E_y for {int(failed.sum())} of {len(yields)} roofs")
+        return yields
+    return source
+
+def _columnar_roofs(data, lat, lon, area_m2, area_col):
+    index = None
+    if data is not None:
+        index = data.index
+        geometry = getattr(data, "geometry", None) if hasattr(data, "crs") else None
+        if area_m2 is None:
+            if area_col in data:
+                area_m2 = data[area_col]
+            elif geometry is not None:
+                projected = geometry if not geometry.crs.is_geographic else geometry.to_crs(31370)
+                area_m2 = projected.area
+        if lat is None or lon is None:
+            if "lat" in data and "lon" in data:
+                lat, lon = data["lat"], data["lon"]
+            elif geometry is not None:
+                centroids = (geometry.to_crs(31370) if geometry.crs.is_geographic else geometry).centroid
+                centroids = centroids.to_crs(4326)
+                lat, lon = centroids.y, centroids.x
+    if lat is None or lon is None or area_m2 is None:
+        raise ValueError("need lat, lon and area_m2 (or a GeoDataFrame to derive them from)")
+    lat, lon, area = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(lat, dtype=float)),
+        np.atleast_1d(np.asarray(lon, dtype=float)),
+        np.atleast_1d(np.asarray(area_m2, dtype=float)),
+    )
+    return index, lat, lon, area
+
+def estimate_potential_batch(data=None, lat=None, lon=None, area_m2=None,
+                             area_col="area_m2",
+                             fill_factor=FILL_FACTOR,
+                             wp_per_m2=WP_PER_M2,
+                             tilt_deg=DEFAULT_TILT,
+                             azimuth_deg=DEFAULT_AZIMUTH,
+                             loss_percent=DEFAULT_LOSS,
+                             co2_kg_per_kwh=CO2_KG_PER_KWH,
+                             yield_source=None,
+                             cache=None):
+    """
+    Vectorised :func:`estimate_potential` for many roofs at once.
+
+    Takes either a (Geo)DataFrame -- area from ``area_col`` or the geometry, location
+    from ``lat``/``lon`` columns or the geometry centroids -- or plain arrays. Tilt,
+    azimuth and loss may be scalars or per-roof arrays. ``yield_source`` is a yield
+    source callable (see :func:`pvgis_yield_source`), an array/scalar of precomputed
+    specific yields, or None for exact PVGIS values via ``cache``.
+
+    Returns a DataFrame with the same columns as :func:`estimate_potential`, aligned
+    with ``data``'s index, ready to ``join`` back.
+    """
+    import pandas as pd
+
+    index, lat, lon, area = _columnar_roofs(data, lat, lon, area_m2, area_col)
+    bad = ~(area > 0)
+    if bad.any():
+        raise ValueError(f"area_m2 must be positive ({int(bad.sum())} of {len(area)} roofs are not)")
+    if yield_source is None:
+        yield_source = pvgis_yield_source(cache=cache)
+    if callable(yield_source):
+        specific_yield = yield_source(lat, lon, tilt_deg, azimuth_deg, loss_percent)
+    else:
+        specific_yield = yield_source
+    specific_yield = np.broadcast_to(np.asarray(specific_yield, dtype=float), area.shape)
+    usable_panel_area = area * fill_factor
+    kwp = usable_panel_area * (wp_per_m2 / 1000.0)
+    kwh_year = kwp * specific_yield
+    co2_tons = kwh_year * (co2_kg_per_kwh / 1000.0)
+    return pd.DataFrame({
+        "roof_area_m2": area,
+        "usable_panel_area_m2": usable_panel_area,
+        "kwp": kwp,
+        "specific_yield_kwh_per_kwp": specific_yield,
+        "kwh_year": kwh_year,
+        "co2_tons": co2_tons,
+    }, index=index, copy=False)
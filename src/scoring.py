@@ -1,22 +1,228 @@
+from collections import namedtuple
+
+import numpy as np
 import pandas as pd
 
+WeightSweepResult = namedtuple("WeightSweepResult", ["top_k", "scenarios", "buildings"])
+
+def _column_max(values):
+    values = values[~np.isnan(values)]
+    return values.max() if len(values) else np.nan
+
+def score_components(df,
+                     area_col="area_m2",
+                     yield_col="specific_yield_kwh_per_kwp",
+                     area_max=None,
+                     yield_max=None,
+                     dtype=np.float32,
+                     orient_col="orientation_score"):
+    """
+    Normalised (area, yield, orientation) scores as an ``(N, 3)`` array.
+
+    ``area_max``/``yield_max`` default to the column maxima of ``df``; pass global
+    maxima when scoring a chunk of a larger table. The orientation score is taken
+    from ``orient_col`` when present (see ``orientation.add_orientation``) and is
+    1.0 otherwise or where missing.
+    """
+    area = df[area_col].to_numpy(dtype=np.float64)
+    if area_max is None:
+        area_max = _column_max(area)
+    components = np.ones((len(df), 3), dtype=dtype)
+    components[:, 0] = area / area_max
+    if yield_col in df:
+        yields = df[yield_col].to_numpy(dtype=np.float64)
+        if yield_max is None:
+            yield_max = _column_max(yields)
+        components[:, 1] = yields / yield_max
+    if orient_col in df:
+        components[:, 2] = df[orient_col].fillna(1.0).to_numpy(dtype=np.float64)
+    return components
+
+def _weighted_score(components, weight_area, weight_yield, weight_orient):
+    return (
+        weight_area   * components[:, 0] +
+        weight_yield  * components[:, 1] +
+        weight_orient * components[:, 2]
+    )
+
+def _dense_rank_desc(score):
+    _, inverse = np.unique(-score, return_inverse=True)
+    return np.ravel(inverse) + 1
+
 def calculate_combined_score(df,
                      area_col="area_m2",
                      yield_col="specific_yield_kwh_per_kwp",
                      weight_area=0.4,
                      weight_yield=0.4,
-                     weight_orient=0.2):
+                     weight_orient=0.2,
+                     orient_col="orientation_score"):
     g = df.copy()
-    g["area_score"] = g[area_col] / g[area_col].max()
-    if yield_col in g:
-        g["yield_score"] = g[yield_col] / g[yield_col].max()
-    else:
-        g["yield_score"] = 1.0
-    g["orientation_score"] = 1.0
-    g["score"] = (
-        weight_area   * g["area_score"] +
-        weight_yield  * g["yield_score"] +
-        weight_orient * g["orientation_score"]
-    )
+    components = score_components(g, area_col, yield_col, dtype=np.float64, orient_col=orient_col)
+    g["area_score"] = components[:, 0]
+    g["yield_score"] = components[:, 1]
+    g["orientation_score"] = components[:, 2]
+    g["score"] = _weighted_score(components, weight_area, weight_yield, weight_orient)
     g["score_rank"] = g["score"].rank(ascending=False, method="dense").astype(int)
     return g
+
+def _top_k_positions(score, k):
+    score = np.where(np.isnan(score), -np.inf, score)
+    k = min(k, len(score))
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    idx = np.argpartition(-score, k - 1)[:k]
+    return idx[np.lexsort((idx, -score[idx]))]
+
+def _with_scores(rows, components, score):
+    rows = rows.copy()
+    rows["area_score"] = components[:, 0]
+    rows["yield_score"] = components[:, 1]
+    rows["orientation_score"] = components[:, 2]
+    rows["score"] = score
+    # Every score above a top-K score is itself in the top K, so the dense rank
+    # inside the top K equals the dense rank over the full table.
+    rows["score_rank"] = _dense_rank_desc(score)
+    return rows
+
+def top_k_scores(df, k=200,
+                 area_col="area_m2",
+                 yield_col="specific_yield_kwh_per_kwp",
+                 weight_area=0.4,
+                 weight_yield=0.4,
+                 weight_orient=0.2,
+                 dtype=np.float32,
+                 orient_col="orientation_score"):
+    """
+    The ``k`` best rows of ``calculate_combined_score`` without copying the table.
+
+    Components are computed once as ``dtype`` arrays and the top K is selected with
+    ``argpartition``; only those K rows are copied. Rows come back sorted by score
+    (ties in input order) with the same columns as the full function. Use
+    ``dtype=np.float64`` for bit-identical scores.
+    """
+    components = score_components(df, area_col, yield_col, dtype=dtype, orient_col=orient_col)
+    score = _weighted_score(components, weight_area, weight_yield, weight_orient)
+    idx = _top_k_positions(score, k)
+    return _with_scores(df.iloc[idx], components[idx], score[idx])
+
+def top_k_scores_chunked(make_chunks, k=200,
+                         area_col="area_m2",
+                         yield_col="specific_yield_kwh_per_kwp",
+                         weight_area=0.4,
+                         weight_yield=0.4,
+                         weight_orient=0.2,
+                         area_max=None,
+                         yield_max=None,
+                         dtype=np.float32,
+                         orient_col="orientation_score"):
+    """
+    Streaming :func:`top_k_scores` for tables larger than memory.
+
+    ``make_chunks`` is a zero-argument callable returning an iterable of DataFrame
+    chunks, e.g. ``lambda: pd.read_csv(path, chunksize=50_000)``. It is called twice:
+    once for the normalisation maxima (skipped when both are given) and once to
+    score. Only the running top K rows are kept in memory.
+    """
+    if area_max is None or yield_max is None:
+        seen_area, seen_yield = -np.inf, -np.inf
+        for chunk in make_chunks():
+            seen_area = np.nanmax([seen_area, _column_max(chunk[area_col].to_numpy(dtype=np.float64))])
+            if yield_col in chunk:
+                seen_yield = np.nanmax([seen_yield, _column_max(chunk[yield_col].to_numpy(dtype=np.float64))])
+        area_max = seen_area if area_max is None else area_max
+        yield_max = seen_yield if yield_max is None else yield_max
+
+    best_rows, best_components, best_score, best_order = [], np.empty((0, 3), dtype=dtype), np.empty(0), np.empty(0)
+    offset = 0
+    for chunk in make_chunks():
+        components = score_components(chunk, area_col, yield_col, area_max, yield_max,
+                                      dtype=dtype, orient_col=orient_col)
+        score = _weighted_score(components, weight_area, weight_yield, weight_orient)
+        idx = _top_k_positions(score, k)
+        rows = best_rows + [chunk.iloc[idx]]
+        components = np.concatenate([best_components, components[idx]])
+        order = np.concatenate([best_order, offset + idx])
+        score = np.concatenate([best_score, score[idx]])
+        merged = pd.concat(rows)
+        keep = _top_k_positions(score, k)
+        keep = keep[np.lexsort((order[keep], -np.where(np.isnan(score[keep]), -np.inf, score[keep])))]
+        best_rows = [merged.iloc[keep]]
+        best_components, best_score, best_order = components[keep], score[keep], order[keep]
+        offset += len(chunk)
+    if not best_rows:
+        raise ValueError("make_chunks() produced no rows")
+    return _with_scores(best_rows[0], best_components, best_score)
+
+def weight_grid(step=0.1):
+    """All (weight_area, weight_yield, weight_orient) triples on a ``step`` grid that sum to 1."""
+    n = int(round(1.0 / step))
+    return np.array([(a / n, y / n, (n - a - y) / n)
+                     for a in range(n + 1) for y in range(n + 1 - a)])
+
+def weight_sweep(df, weights, k=200,
+                 area_col="area_m2",
+                 yield_col="specific_yield_kwh_per_kwp",
+                 baseline=(0.4, 0.4, 0.2),
+                 robust_share=0.9,
+                 chunk_scenarios=64,
+                 dtype=np.float32,
+                 orient_col="orientation_score"):
+    """
+    Score ``df`` under many weight vectors at once.
+
+    ``weights`` is a ``(W, 3)`` array of (area, yield, orientation) weights. Scores
+    for a block of scenarios come from one ``(N x 3) @ (3 x W)`` product and the top K
+    per scenario from a column-wise ``argpartition``.
+
+    Returns a ``WeightSweepResult``:
+
+    * ``top_k`` -- ``(W, k)`` DataFrame of index labels, best first, per scenario;
+    * ``scenarios`` -- weights plus how many of the ``baseline`` top K each keeps
+      (``retained``, ``retained_share``) and the Jaccard overlap with it;
+    * ``buildings`` -- every building that reached any top K, with the share of
+      scenarios it did so in, its baseline rank and a ``robust`` flag
+      (share >= ``robust_share``).
+    """
+    weights = np.asarray(weights, dtype=dtype).reshape(-1, 3)
+    components = score_components(df, area_col, yield_col, dtype=dtype, orient_col=orient_col)
+    n = len(df)
+    k = min(k, n)
+    baseline_score = components @ np.asarray(baseline, dtype=dtype)
+    baseline_top = _top_k_positions(baseline_score, k)
+
+    top = np.empty((len(weights), k), dtype=np.intp)
+    for start in range(0, len(weights), chunk_scenarios):
+        block = weights[start:start + chunk_scenarios]
+        scores = components @ block.T
+        scores[np.isnan(scores)] = -np.inf
+        part = np.argpartition(-scores, k - 1, axis=0)[:k]
+        values = np.take_along_axis(scores, part, axis=0)
+        order = np.argsort(-values, axis=0, kind="stable")
+        top[start:start + len(block)] = np.take_along_axis(part, order, axis=0).T
+
+    in_baseline = np.zeros(n, dtype=bool)
+    in_baseline[baseline_top] = True
+    retained = in_baseline[top].sum(axis=1)
+    scenarios = pd.DataFrame({
+        "weight_area": weights[:, 0],
+        "weight_yield": weights[:, 1],
+        "weight_orient": weights[:, 2],
+        "retained": retained,
+        "retained_share": retained / k if k else np.nan,
+        "jaccard": retained / (2 * k - retained) if k else np.nan,
+    })
+
+    frequency = np.bincount(top.ravel(), minlength=n) / max(len(weights), 1)
+    baseline_rank = np.zeros(n, dtype=int)
+    baseline_rank[baseline_top] = np.arange(1, k + 1)
+    reached = np.flatnonzero(frequency > 0)
+    buildings = pd.DataFrame({
+        "top_k_share": frequency[reached],
+        "baseline_rank": baseline_rank[reached],
+        "robust": frequency[reached] >= robust_share,
+    }, index=df.index[reached])
+    buildings["baseline_rank"] = buildings["baseline_rank"].replace(0, pd.NA).astype("Int64")
+    buildings = buildings.sort_values("top_k_share", ascending=False, kind="stable")
+
+    top_k = pd.DataFrame(np.asarray(df.index)[top], columns=pd.RangeIndex(1, k + 1, name="rank"))
+    return WeightSweepResult(top_k, scenarios, buildings)
@@ -0,0 +1,382 @@
+import hashlib
+import json
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from pvgis_utils import BATCH_BACKOFF_S, BATCH_MAX_RETRIES, RETRY_STATUS
+
+GRB_WFS_URL = "https://geo.api.vlaanderen.be/Gebouwenregister/wfs"
+GRB_WFS_LAYER = "Gebouwenregister:Gebouw"
+TARGET_EPSG = 31370
+
+DEFAULT_STAGING_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    "notebooks", "cache", "wfs_staging.sqlite",
+)
+DEFAULT_TILE_M = 2000.0
+DEFAULT_PAGE_SIZE = 1000
+DOWNLOAD_CONCURRENCY = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    tile TEXT PRIMARY KEY,
+    next_index INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0,
+    fetched INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS features (
+    feature_id TEXT PRIMARY KEY,
+    tile TEXT NOT NULL,
+    feature TEXT NOT NULL
+);
+"""
+
+
+class WFSError(Exception):
+    pass
+
+
+def make_tiles(bounds, tile_m=DEFAULT_TILE_M, boundary=None):
+    """
+    Split ``bounds`` (minx, miny, maxx, maxy) into square tiles of ``tile_m`` metres.
+    With a Shapely ``boundary`` only tiles intersecting it are kept.
+    """
+    minx, miny, maxx, maxy = (float(v) for v in bounds)
+    nx = max(1, math.ceil((maxx - minx) / tile_m))
+    ny = max(1, math.ceil((maxy - miny) / tile_m))
+    tiles = []
+    for j in range(ny):
+        for i in range(nx):
+            tiles.append((minx + i * tile_m, miny + j * tile_m,
+                          min(minx + (i + 1) * tile_m, maxx), min(miny + (j + 1) * tile_m, maxy)))
+    if boundary is not None:
+        import shapely
+
+        boxes = shapely.box(*zip(*tiles))
+        tiles = [t for t, keep in zip(tiles, shapely.intersects(boxes, boundary)) if keep]
+    return tiles
+
+
+def tile_key(bbox):
+    return ",".join(f"{v:.3f}" for v in bbox)
+
+
+def feature_key(feature):
+    """Stable identity of a WFS feature: its feature id, else ``ObjectId``, else a geometry hash."""
+    if feature.get("id") is not None:
+        return str(feature["id"])
+    object_id = (feature.get("properties") or {}).get("ObjectId")
+    if object_id is not None:
+        return f"ObjectId.{object_id}"
+    return hashlib.sha1(json.dumps(feature.get("geometry"), sort_keys=True).encode()).hexdigest()
+
+
+def fes_filter(bbox, epsg=TARGET_EPSG, changed_since=None, version_property="VersieId"):
+    """
+    FES 2.0 filter selecting features in ``bbox`` whose ``version_property`` is later
+    than ``changed_since``. WFS servers reject ``bbox`` together with ``FILTER``, so
+    the bbox goes into the filter (on the default geometry property).
+    """
+    minx, miny, maxx, maxy = (repr(float(v)) for v in bbox)
+    return (
+        '<fes:Filter xmlns:fes="http://www.opengis.net/fes/2.0" xmlns:gml="http://www.opengis.net/gml/3.2">'
+        "<fes:And>"
+        f'<fes:BBOX><gml:Envelope srsName="urn:ogc:def:crs:EPSG::{epsg}">'
+        f"<gml:lowerCorner>{minx} {miny}</gml:lowerCorner><gml:upperCorner>{maxx} {maxy}</gml:upperCorner>"
+        "</gml:Envelope></fes:BBOX>"
+        f"<fes:PropertyIsGreaterThan><fes:ValueReference>{version_property}</fes:ValueReference>"
+        f"<fes:Literal>{changed_since}</fes:Literal></fes:PropertyIsGreaterThan>"
+        "</fes:And></fes:Filter>"
+    )
+
+
+def getfeature_params(layer, bbox, epsg=TARGET_EPSG, start_index=0, count=DEFAULT_PAGE_SIZE, sort_by="ObjectId",
+                      changed_since=None, version_property="VersieId"):
+    params = {
+        "service": "WFS",
+        "version": "2.0.0",
+        "request": "GetFeature",
+        "typeNames": layer,
+        "srsName": f"EPSG:{epsg}",
+        "outputFormat": "application/json",
+        "startIndex": start_index,
+        "count": count,
+    }
+    if changed_since is None:
+        params["bbox"] = f"{','.join(repr(float(v)) for v in bbox)},EPSG:{epsg}"
+    else:
+        params["FILTER"] = fes_filter(bbox, epsg, changed_since, version_property)
+    if sort_by:
+        params["sortBy"] = sort_by
+    return params
+
+
+class WFSStagingStore:
+    """
+    On-disk SQLite staging area for a tiled WFS download.
+
+    Every page is written in one transaction together with the tile's next
+    ``startIndex``, so an interrupted download resumes at the first missing page.
+    Features are keyed by :func:`feature_key`; buildings returned by several tiles
+    are stored once. One store holds one layer.
+    """
+
+    def __init__(self, path=DEFAULT_STAGING_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def tile_progress(self, tile):
+        """``(next_index, done)`` for a tile key; ``(0, False)`` when never started."""
+        with self._lock:
+            row = self._conn.execute("SELECT next_index, done FROM tiles WHERE tile = ?", (tile,)).fetchone()
+        return (0, False) if row is None else (row[0], bool(row[1]))
+
+    def add_page(self, tile, start_index, features, done=False):
+        """Store one page of a tile; returns how many features were new."""
+        rows = [(feature_key(f), tile, json.dumps(f)) for f in features]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO features VALUES (?, ?, ?)", rows)
+            added = self._conn.total_changes - before
+            self._conn.execute(
+                "INSERT INTO tiles (tile, next_index, pages, fetched, done) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT(tile) DO UPDATE SET next_index = excluded.next_index, pages = pages + 1, "
+                "fetched = fetched + excluded.fetched, done = excluded.done",
+                (tile, start_index + len(features), len(features), int(done)),
+            )
+        return added
+
+    def iter_features(self, batch=5000):
+        with self._lock:
+            cursor = self._conn.execute("SELECT feature FROM features ORDER BY rowid")
+            rows = cursor.fetchmany(batch)
+        while rows:
+            for (feature,) in rows:
+                yield json.loads(feature)
+            with self._lock:
+                rows = cursor.fetchmany(batch)
+
+    def to_geodataframe(self, epsg=TARGET_EPSG):
+        import geopandas as gpd
+
+        features = list(self.iter_features())
+        gdf = gpd.GeoDataFrame.from_features(features, crs=f"EPSG:{epsg}")
+        if any("id" in f for f in features):
+            # Keep the feature id as a column, as gpd.read_file does for GeoJSON.
+            gdf.insert(0, "id", [f.get("id") for f in features])
+        return gdf
+
+    def stats(self):
+        with self._lock:
+            tiles, done, pages, fetched = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(done), 0), COALESCE(SUM(pages), 0), COALESCE(SUM(fetched), 0) FROM tiles"
+            ).fetchone()
+            features = self._conn.execute("SELECT COUNT(*) FROM features").fetchone()[0]
+        return {"tiles_started": tiles, "tiles_done": done, "pages": pages,
+                "fetched": fetched, "features": features, "duplicates": fetched - features}
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM features")
+            self._conn.execute("DELETE FROM tiles")
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM features").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _get_page(session, url, params, timeout, max_retries, backoff_s, stats):
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        stats["requests"] += 1
+        try:
+            resp = session.get(url, params=params, timeout=timeout)
+        except requests.RequestException as e:
+            error = WFSError(f"WFS request failed: {e}")
+        else:
+            if resp.status_code == 200:
+                try:
+                    return resp.json()
+                except ValueError as e:
+                    raise WFSError(f"Invalid WFS response: {e}")
+            error = WFSError(f"WFS error {resp.status_code}: {resp.text[:200]}")
+            if resp.status_code not in RETRY_STATUS:
+                raise error
+            retry_after = resp.headers.get("Retry-After")
+        if attempt == max_retries:
+            break
+        stats["retries"] += 1
+        delay = backoff_s * 2 ** attempt * (1.0 + 0.25 * random.random())
+        if retry_after is not None:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        time.sleep(delay)
+    raise error
+
+
+def download_wfs(area,
+                 url=GRB_WFS_URL,
+                 layer=GRB_WFS_LAYER,
+                 epsg=TARGET_EPSG,
+                 tile_m=DEFAULT_TILE_M,
+                 page_size=DEFAULT_PAGE_SIZE,
+                 concurrency=DOWNLOAD_CONCURRENCY,
+                 staging_path=DEFAULT_STAGING_PATH,
+                 store=None,
+                 sort_by="ObjectId",
+                 changed_since=None,
+                 version_property="VersieId",
+                 max_retries=BATCH_MAX_RETRIES,
+                 backoff_s=BATCH_BACKOFF_S,
+                 timeout=60):
+    """
+    Download every feature of ``layer`` inside ``area`` into a :class:`WFSStagingStore`.
+
+    ``area`` is a (minx, miny, maxx, maxy) tuple in ``epsg`` or a GeoDataFrame such as
+    the Leuven boundary, in which case tiles outside the boundary are skipped. The
+    bbox is cut into ``tile_m`` tiles, each paged with ``startIndex``/``count``;
+    up to ``concurrency`` tiles are fetched at once and every page is written to the
+    store as it arrives. Tiles and pages already in the store are skipped, so
+    calling again after an interruption resumes the download.
+
+    With ``changed_since`` only features whose ``version_property`` is later are
+    requested (see :func:`fes_filter`); such tiles are tracked separately from
+    unfiltered ones.
+
+    Returns a stats dict including ``features_per_second`` (new features stored
+    per second of this run).
+    """
+    boundary = None
+    if hasattr(area, "total_bounds"):
+        area = area.to_crs(epsg)
+        bounds, boundary = area.total_bounds, area.union_all()
+    else:
+        bounds = area
+    tiles = make_tiles(bounds, tile_m, boundary)
+    own_store = store is None
+    if own_store:
+        store = WFSStagingStore(staging_path)
+
+    stats = {"tiles": len(tiles), "tiles_skipped": 0, "pages": 0, "requests": 0, "retries": 0,
+             "fetched": 0, "new_features": 0}
+    stats_lock = threading.Lock()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def fetch_tile(bbox):
+        key = tile_key(bbox) if changed_since is None else f"{tile_key(bbox)}>{changed_since}"
+        start_index, done = store.tile_progress(key)
+        local = {"pages": 0, "requests": 0, "retries": 0, "fetched": 0, "new_features": 0}
+        if done:
+            with stats_lock:
+                stats["tiles_skipped"] += 1
+            return
+        while not done:
+            params = getfeature_params(layer, bbox, epsg, start_index, page_size, sort_by,
+                                       changed_since, version_property)
+            page = _get_page(session, url, params, timeout, max_retries, backoff_s, local)
+            features = page.get("features") or []
+            matched = page.get("numberMatched")
+            next_index = start_index + len(features)
+            if isinstance(matched, int):
+                done = not features or next_index >= matched
+            else:
+                done = len(features) < page_size
+            local["new_features"] += store.add_page(key, start_index, features, done)
+            local["pages"] += 1
+            local["fetched"] += len(features)
+            start_index = next_index
+        with stats_lock:
+            for k, v in local.items():
+                stats[k] += v
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(fetch_tile, bbox) for bbox in tiles]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        session.close()
+        stats["seconds"] = time.perf_counter() - start
+        stats["stored"] = len(store)
+        if own_store:
+            store.close()
+    stats["features_per_second"] = stats["new_features"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+def remove_staging(path):
+    """Delete a staging store together with its WAL/SHM files."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def fetch_buildings_tiled(boundary_gdf, staging_path=None, **kwargs):
+    """
+    Drop-in replacement for the notebooks' ``fetch_buildings_wfs``: download the GRB
+    buildings inside ``boundary_gdf`` tile by tile and return them as a GeoDataFrame.
+
+    The staging store only lets an interrupted call resume: by default it is named
+    after the request (next to :data:`DEFAULT_STAGING_PATH`) and deleted once the
+    buildings are loaded, so every completed call returns the current features.
+    """
+    if staging_path is None:
+        epsg = kwargs.get("epsg", TARGET_EPSG)
+        bounds = boundary_gdf.to_crs(epsg).total_bounds if hasattr(boundary_gdf, "total_bounds") else boundary_gdf
+        request = [kwargs.get("url", GRB_WFS_URL), kwargs.get("layer", GRB_WFS_LAYER), epsg,
+                   kwargs.get("tile_m", DEFAULT_TILE_M), kwargs.get("changed_since"),
+                   [round(float(v), 2) for v in bounds]]
+        name = hashlib.sha1(json.dumps(request).encode()).hexdigest()[:12]
+        staging_path = os.path.join(os.path.dirname(DEFAULT_STAGING_PATH), f"wfs_staging_{name}.sqlite")
+    download_wfs(boundary_gdf, staging_path=staging_path, **kwargs)
+    with WFSStagingStore(staging_path) as store:
+        fetched = store.to_geodataframe(kwargs.get("epsg", TARGET_EPSG))
+    remove_staging(staging_path)
+    return fetched
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from wfs_stub import WFSStubServer
+
+    with WFSStubServer(latency_s=0.02) as stub, tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "staging.sqlite")
+        print("single request:", download_wfs(stub.extent, url=stub.wfs_url, staging_path=path,
+                                              tile_m=1e6, page_size=100_000, concurrency=1))
+        os.remove(path)
+        print("tiled:", download_wfs(stub.extent, url=stub.wfs_url, staging_path=path))
@@ -0,0 +1,137 @@
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from pvgis_stub import PVGISStubServer
+
+# Lambert 72 extent roughly covering Leuven.
+LEUVEN_EXTENT_31370 = (168_000.0, 168_000.0, 180_000.0, 180_000.0)
+VERSION_EPOCH = datetime(2015, 1, 1, tzinfo=timezone.utc)
+FES = "{http://www.opengis.net/fes/2.0}"
+GML = "{http://www.opengis.net/gml/3.2}"
+
+
+def version_timestamp(when):
+    """``VersieId`` as the Gebouwenregister serves it, e.g. ``2024-07-09T02:01:45+02:00``."""
+    return when.astimezone(timezone(timedelta(hours=2))).isoformat(timespec="seconds")
+
+
+def synthetic_buildings(n=20_000, extent=LEUVEN_EXTENT_31370, seed=0):
+    """
+    ``n`` rectangular GRB-like ``Gebouw`` features (EPSG:31370) scattered over ``extent``,
+    with the property names of the Gebouwenregister WFS.
+    """
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = extent
+    x = rng.uniform(minx, maxx, n)
+    y = rng.uniform(miny, maxy, n)
+    versions = rng.uniform(0, 10 * 365 * 86400, n)
+    w = rng.lognormal(2.5, 0.7, n)
+    h = w * rng.uniform(0.4, 1.0, n)
+    features = []
+    for i in range(n):
+        object_id = 10_000_000 + i
+        x0, y0, x1, y1 = x[i] - w[i] / 2, y[i] - h[i] / 2, x[i] + w[i] / 2, y[i] + h[i] / 2
+        features.append({
+            "type": "Feature",
+            "id": f"Gebouw.{object_id}",
+            "geometry": {"type": "Polygon", "coordinates": [[
+                [round(x0, 3), round(y0, 3)], [round(x1, 3), round(y0, 3)], [round(x1, 3), round(y1, 3)],
+                [round(x0, 3), round(y1, 3)], [round(x0, 3), round(y0, 3)],
+            ]]},
+            "properties": {
+                "Id": f"https://data.vlaanderen.be/id/gebouw/{object_id}",
+                "ObjectId": object_id,
+                "VersieId": version_timestamp(VERSION_EPOCH + timedelta(seconds=int(versions[i]))),
+                "GeometrieMethode": "IngemetenGRB",
+                "GebouwStatus": "Gerealiseerd",
+            },
+        })
+    return features
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _parse_filter(xml):
+    """Envelope and (property, literal) of the ``BBOX AND PropertyIsGreaterThan`` filters the downloader sends."""
+    root = ET.fromstring(xml)
+    bbox = None
+    lower, upper = root.find(f".//{GML}lowerCorner"), root.find(f".//{GML}upperCorner")
+    if lower is not None and upper is not None:
+        bbox = tuple(float(v) for v in lower.text.split()) + tuple(float(v) for v in upper.text.split())
+    newer = None
+    greater = root.find(f".//{FES}PropertyIsGreaterThan")
+    if greater is not None:
+        newer = (greater.find(f"{FES}ValueReference").text, greater.find(f"{FES}Literal").text)
+    return bbox, newer
+
+
+def _feature_bounds(feature):
+    coords = np.asarray(feature["geometry"]["coordinates"][0], dtype=float)
+    return (*coords.min(axis=0), *coords.max(axis=0))
+
+
+class WFSStubServer(PVGISStubServer):
+    """
+    Local stand-in for a WFS 2.0 ``GetFeature`` endpoint returning GeoJSON.
+
+    Serves ``features`` (GeoJSON dicts, :func:`synthetic_buildings` by default) with
+    ``bbox`` filtering on feature envelopes and ``startIndex``/``count`` paging in
+    ``ObjectId`` order, like GeoServer with ``sortBy``. A FES ``FILTER`` may combine a
+    BBOX with one timestamp ``PropertyIsGreaterThan``. ``latency_s`` and
+    ``fail_first`` behave as in :class:`PVGISStubServer`.
+
+        with WFSStubServer(latency_s=0.02) as stub:
+            download_wfs(stub.extent, url=stub.wfs_url, staging_path=":memory:")
+    """
+
+    def __init__(self, features=None, max_count=5000, **kwargs):
+        super().__init__(**kwargs)
+        if features is None:
+            features = synthetic_buildings()
+        self.features = sorted(features, key=lambda f: f["properties"]["ObjectId"])
+        self.max_count = max_count
+        self.bounds = np.array([_feature_bounds(f) for f in self.features]).reshape(-1, 4)
+
+    @property
+    def wfs_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/wfs"
+
+    @property
+    def extent(self):
+        return (*self.bounds[:, :2].min(axis=0), *self.bounds[:, 2:].max(axis=0))
+
+    def handle(self, path, query):
+        if not path.endswith("/wfs"):
+            return None
+        if query.get("request", "").lower() != "getfeature":
+            raise ValueError("only GetFeature is supported")
+        bbox, newer = None, None
+        if "FILTER" in query:
+            if "bbox" in query:
+                raise ValueError("bbox and FILTER are mutually exclusive")
+            bbox, newer = _parse_filter(query["FILTER"])
+        elif "bbox" in query:
+            bbox = tuple(float(v) for v in query["bbox"].split(",")[:4])
+        matched = np.arange(len(self.features))
+        if bbox is not None:
+            minx, miny, maxx, maxy = bbox
+            b = self.bounds
+            matched = np.flatnonzero((b[:, 0] <= maxx) & (b[:, 2] >= minx) & (b[:, 1] <= maxy) & (b[:, 3] >= miny))
+        if newer is not None:
+            prop, since = newer[0], _parse_time(newer[1])
+            matched = matched[np.array([_parse_time(self.features[i]["properties"][prop]) > since
+                                        for i in matched], dtype=bool)]
+        start = int(query.get("startIndex", 0))
+        count = min(int(query.get("count", self.max_count)), self.max_count)
+        page = [self.features[i] for i in matched[start:start + count]]
+        return {
+            "type": "FeatureCollection",
+            "numberMatched": len(matched),
+            "numberReturned": len(page),
+            "features": page,
+        }
@@ -0,0 +1,188 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from pvgis_utils import DEFAULT_LOSS, fetch_pvgis_batch, specific_yields_from_outputs
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "notebooks", "data")
+DEFAULT_BOUNDARY_PATH = os.path.join(DATA_DIR, "leuven_boundary.gpkg")
+DEFAULT_SURFACE_PATH = os.path.join(DATA_DIR, "leuven_yield_surface.npz")
+
+SURFACE_STEP_DEG = 0.025
+SURFACE_TILTS = (0, 10, 20, 30, 40, 50)
+SURFACE_AZIMUTHS = (-180, -135, -90, -45, 0, 45, 90, 135, 180)
+HOLDOUT_SAMPLES = 50
+
+
+def boundary_extent(path=DEFAULT_BOUNDARY_PATH):
+    """Return ``(min_lon, min_lat, max_lon, max_lat)`` of a boundary file in WGS84."""
+    import geopandas as gpd
+    return tuple(gpd.read_file(path).to_crs(4326).total_bounds)
+
+
+def _axis(lo, hi, step):
+    # Round before floor/ceil so e.g. 50.80 / 0.025 = 2031.9999... still starts at 50.80.
+    start = np.floor(np.round(lo / step, 9)) * step
+    stop = np.ceil(np.round(hi / step, 9)) * step
+    return np.round(np.arange(start, stop + step / 2, step), 6)
+
+
+def _axis_weights(axis, x):
+    """Lower/upper neighbour indices and the linear weight of the upper one, clamped to the axis."""
+    x = np.asarray(x, dtype=float)
+    if len(axis) == 1:
+        i0 = np.zeros(x.shape, dtype=np.intp)
+        return i0, i0, np.zeros(x.shape)
+    i0 = np.clip(np.searchsorted(axis, x, side="right") - 1, 0, len(axis) - 2)
+    t = (x - axis[i0]) / (axis[i0 + 1] - axis[i0])
+    return i0, i0 + 1, np.clip(t, 0.0, 1.0)
+
+
+def _check_exact(batch_kwargs):
+    cache = batch_kwargs.get("cache")
+    if cache is not None and cache.grid_deg:
+        raise ValueError(f"cache snaps queries to a {cache.grid_deg} deg grid, so surface nodes would share "
+                         f"values; pass PVGISCache(grid_deg=0)")
+
+
+class YieldSurface:
+    """
+    Specific yield (kWh/kWp/year) sampled on a regular lat/lon/tilt/azimuth grid.
+
+    ``values`` has shape ``(n_lat, n_lon, n_tilt, n_azimuth)`` and is looked up with
+    multilinear interpolation, i.e. bilinear in space and bilinear in tilt/azimuth.
+    Azimuth follows the PVGIS ``aspect`` convention (0 = south, -90 = east).
+    """
+
+    def __init__(self, lats, lons, tilts, azimuths, values, loss_percent=DEFAULT_LOSS, error=None):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.tilts = np.asarray(tilts, dtype=float)
+        self.azimuths = np.asarray(azimuths, dtype=float)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.loss_percent = float(loss_percent)
+        self.error = dict(error or {})
+        expected = (len(self.lats), len(self.lons), len(self.tilts), len(self.azimuths))
+        if self.values.shape != expected:
+            raise ValueError(f"values has shape {self.values.shape}, expected {expected}")
+
+    def lookup(self, lat, lon, tilt_deg, azimuth_deg):
+        lat, lon, tilt, azimuth = np.broadcast_arrays(
+            np.asarray(lat, dtype=float), np.asarray(lon, dtype=float),
+            np.asarray(tilt_deg, dtype=float), np.asarray(azimuth_deg, dtype=float),
+        )
+        # Wrap azimuth into [-180, 180] so e.g. 270 (= -90, east) is found on the grid.
+        azimuth = (azimuth + 180.0) % 360.0 - 180.0
+        axes = [
+            _axis_weights(self.lats, lat),
+            _axis_weights(self.lons, lon),
+            _axis_weights(self.tilts, tilt),
+            _axis_weights(self.azimuths, azimuth),
+        ]
+        out = np.zeros(lat.shape)
+        for corner in range(16):
+            idx = []
+            weight = np.ones(lat.shape)
+            for d, (i0, i1, t) in enumerate(axes):
+                upper = (corner >> d) & 1
+                idx.append(i1 if upper else i0)
+                weight = weight * (t if upper else 1.0 - t)
+            out += weight * self.values[tuple(idx)]
+        return out
+
+    def __call__(self, lat, lon, tilt_deg, azimuth_deg, loss_percent=DEFAULT_LOSS):
+        """Yield-source interface: specific yield per roof, rescaled for a different system loss."""
+        scale = (1.0 - np.asarray(loss_percent, dtype=float) / 100.0) / (1.0 - self.loss_percent / 100.0)
+        return self.lookup(lat, lon, tilt_deg, azimuth_deg) * scale
+
+    def save(self, path=DEFAULT_SURFACE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(
+            path,
+            lats=self.lats, lons=self.lons, tilts=self.tilts, azimuths=self.azimuths,
+            values=self.values, loss_percent=self.loss_percent,
+            error_keys=np.array(list(self.error.keys()), dtype=str),
+            error_values=np.array(list(self.error.values()), dtype=float),
+        )
+
+    @classmethod
+    def load(cls, path=DEFAULT_SURFACE_PATH):
+        with np.load(path) as f:
+            error = dict(zip(f["error_keys"].tolist(), f["error_values"].tolist()))
+            return cls(f["lats"], f["lons"], f["tilts"], f["azimuths"], f["values"],
+                       loss_percent=float(f["loss_percent"]), error=error)
+
+
+def build_yield_surface(extent=None,
+                        step_deg=SURFACE_STEP_DEG,
+                        tilts=SURFACE_TILTS,
+                        azimuths=SURFACE_AZIMUTHS,
+                        loss_percent=DEFAULT_LOSS,
+                        holdout=HOLDOUT_SAMPLES,
+                        seed=0,
+                        **batch_kwargs):
+    """
+    Sample PVGIS on a coarse grid covering ``extent`` (defaults to the Leuven boundary)
+    for every tilt/azimuth combination, then score the surface on ``holdout`` random
+    off-grid points. Extra keyword arguments go to :func:`pvgis_utils.fetch_pvgis_batch`;
+    a ``cache`` must not snap coordinates (``PVGISCache(grid_deg=0)``).
+    """
+    _check_exact(batch_kwargs)
+    if extent is None:
+        extent = boundary_extent()
+    min_lon, min_lat, max_lon, max_lat = extent
+    lats = _axis(min_lat, max_lat, step_deg)
+    lons = _axis(min_lon, max_lon, step_deg)
+    grid = np.stack(np.meshgrid(lats, lons, tilts, azimuths, indexing="ij"), axis=-1).reshape(-1, 4)
+    queries = pd.DataFrame(grid, columns=["lat", "lon", "tilt", "azimuth"])
+    queries["loss"] = loss_percent
+    outputs = fetch_pvgis_batch(queries, **batch_kwargs)
+    values = specific_yields_from_outputs(outputs).reshape(len(lats), len(lons), len(tilts), len(azimuths))
+    if np.isnan(values).any():
+        raise ValueError(f"{int(np.isnan(values).sum())} grid samples failed; surface is incomplete")
+    surface = YieldSurface(lats, lons, tilts, azimuths, values, loss_percent=loss_percent)
+    if holdout:
+        surface.error = evaluate_surface(surface, holdout, extent=extent, seed=seed, **batch_kwargs)
+    return surface
+
+
+def evaluate_surface(surface, n=HOLDOUT_SAMPLES, extent=None, seed=0, **batch_kwargs):
+    """Compare interpolated yields with exact PVGIS values on ``n`` random points inside ``extent``."""
+    _check_exact(batch_kwargs)
+    rng = np.random.default_rng(seed)
+    if extent is None:
+        extent = (surface.lons[0], surface.lats[0], surface.lons[-1], surface.lats[-1])
+    min_lon, min_lat, max_lon, max_lat = extent
+    sample = pd.DataFrame({
+        "lat": rng.uniform(min_lat, max_lat, n),
+        "lon": rng.uniform(min_lon, max_lon, n),
+        "tilt": rng.uniform(surface.tilts.min(), surface.tilts.max(), n).round(1),
+        "azimuth": rng.uniform(surface.azimuths.min(), surface.azimuths.max(), n).round(1),
+        "loss": surface.loss_percent,
+    })
+    exact = specific_yields_from_outputs(fetch_pvgis_batch(sample, **batch_kwargs))
+    approx = surface.lookup(sample["lat"], sample["lon"], sample["tilt"], sample["azimuth"])
+    ok = ~np.isnan(exact)
+    abs_err = np.abs(approx[ok] - exact[ok])
+    rel_err = abs_err / exact[ok]
+    return {
+        "samples": float(ok.sum()),
+        "mean_abs_kwh_per_kwp": float(abs_err.mean()),
+        "max_abs_kwh_per_kwp": float(abs_err.max()),
+        "mean_rel": float(rel_err.mean()),
+        "p95_rel": float(np.percentile(rel_err, 95)),
+        "max_rel": float(rel_err.max()),
+    }
+
+
+if __name__ == "__main__":
+    from pvgis_cache import PVGISCache
+
+    # Surface nodes and holdout points are queried at their exact coordinates, not PVGIS cell centres.
+    with PVGISCache(grid_deg=0) as cache:
+        surface = build_yield_surface(cache=cache)
+    surface.save()
+    print(f"Surface {surface.values.shape} saved to {DEFAULT_SURFACE_PATH}")
+    for key, value in surface.error.items():
+        print(f"  {key}: {value:.4f}")